@@ -1,32 +1,153 @@
+import asyncio
+import os
 import threading
+import time
 from datetime import datetime
-from typing import Dict, Any
-from queue import Queue
+from typing import Dict, Any, Iterable, List
+from queue import Queue, Empty
 from .proto import publication_pb2 as pb
 import logging
 
-from .subscription import Subscription
-from .utils import log_event
+from .expiry import ExpiryWheel
+from .match_cache import MatchCache
+from .metrics import MetricsRegistry, REGISTRY, now_ns
+from .records import DEFAULT_SCHEMA, PublicationRecord, Schema, new_hop
+from .profiling import SubscriptionProfile, build_profile_report, dump_profile_report
+from .rebalancer import MigrationMarker, subscription_cost
+from .shard_pool import ShardPool
+from .subscription import SharedPredicate, Subscription, unpack_conditions
+from .subscription_store import SubscriptionJournal, iter_subscription_chunks, journal_path_for, write_snapshot
+from .utils import log_event, event_level
 
 class Broker:
-    def __init__(self, broker_id: str, window_size: int = 10, logger: logging.Logger = None):
+    def __init__(self, broker_id: str, window_size: int = 10, logger: logging.Logger = None,
+                 metrics: MetricsRegistry = None, expiry_resolution: float = 0.1,
+                 match_cache_size: int = 0, schema: Schema = None,
+                 batch_size: int = 1, batch_deadline_us: float = 0, match_shards: int = 1):
         self.broker_id = broker_id
+        # Field IDs that publications are decoded to and conditions compiled against
+        self.schema = schema or DEFAULT_SCHEMA
         self.window_size = window_size
-        self.subscriptions: Dict[str, Subscription] = {}
+        self.subscriptions: Dict[int, Subscription] = {}
+        # Simple subscriptions grouped by packed conditions: each distinct predicate is
+        # evaluated once per publication and fanned out to all its registrations
+        self.predicates: Dict[tuple, SharedPredicate] = {}
+        # Window subscriptions keep their own buffers, so they are never shared
+        self.window_subscriptions: Dict[int, Subscription] = {}
+        self.predicate_evaluations = 0
+        # Matching predicates per distinct projected publication; opt-in, since generated
+        # workloads rarely repeat a projection (None disables the cache)
+        self.match_cache = MatchCache(match_cache_size, self.schema) if match_cache_size else None
+        # With match_shards > 1 the simple predicates are also split over that many worker
+        # processes, which match each batch in parallel
+        self.shard_pool = ShardPool(match_shards) if match_shards > 1 else None
         self.publication_queue = Queue()
+        # Micro-batching: up to batch_size queued publications are processed together,
+        # waiting at most batch_deadline_us for a batch to fill
+        self.batch_size = max(1, batch_size)
+        self.batch_deadline_us = batch_deadline_us
+        self.batches = 0
         self.is_running = False
         self.processing_thread = None
+        # Set while the broker runs as an asyncio task; publication_queue is then an asyncio.Queue
+        self.task: asyncio.Task = None
+        self.loop: asyncio.AbstractEventLoop = None
+        self.loop_thread = None
+        # Orders enqueue() against switching publication_queue between the two runtimes
+        self.queue_lock = threading.Lock()
         self.lock = threading.Lock()
         self.logger = logger or logging.getLogger('pubsub_system')
         self.received_publications = 0
         self.sent_to_subscribers = 0
         self.matching_attempts = 0
         self.matches_found = 0
+        self.deliver_ns = 0
+        self.metrics = metrics or REGISTRY
+        self.dequeue_hist = self.metrics.histogram('pubsub_stage_seconds', stage='dequeue', broker_id=broker_id)
+        self.decode_hist = self.metrics.histogram('pubsub_stage_seconds', stage='decode', broker_id=broker_id)
+        self.match_hist = self.metrics.histogram('pubsub_stage_seconds', stage='match', broker_id=broker_id)
+        self.received_counter = self.metrics.counter('pubsub_broker_publications_total', broker_id=broker_id)
+        self.matches_counter = self.metrics.counter('pubsub_broker_matches_total', broker_id=broker_id)
+        self.decode_failures = 0
+        self.decode_failures_counter = self.metrics.counter('pubsub_broker_decode_failures_total', broker_id=broker_id)
+        self.batch_hist = self.metrics.histogram('pubsub_broker_batch_size', scale=1, broker_id=broker_id)
+        self.deliver_hists = {}
+        # Opt-in per-subscription cost profiling, on every Nth publication
+        self.profile_every = 0
+        self.profiled_publications = 0
+        self.profiles: Dict[str, SubscriptionProfile] = {}
+        # Adds/removes since the last snapshot, once the broker is backed by one
+        self.journal: SubscriptionJournal = None
+        # Lease deadlines of subscriptions with a TTL; expired ones are dropped at most
+        # expiry_resolution seconds late, between publications
+        self.expiry = ExpiryWheel(expiry_resolution)
+        self.expired_subscriptions = 0
+
+    def enqueue(self, publication):
+        """Queue a publication for processing, stamped with its enqueue time"""
+        item = (now_ns(), publication)
+        with self.queue_lock:
+            if self.loop is None:
+                self.publication_queue.put(item)
+            elif threading.get_ident() == self.loop_thread:
+                # Through the loop's ready queue too, not put_nowait(): items then reach every
+                # broker in the order they were enqueued, whichever thread enqueued them, so a
+                # migration marker cuts source and target queues at the same publication
+                self.loop.call_soon(self._put_on_loop, item)
+            else:
+                # asyncio queues are not thread-safe: hand the item to the loop
+                self.loop.call_soon_threadsafe(self._put_on_loop, item)
+
+    def _put_on_loop(self, item):
+        """Loop callback that queues an item; looks the queue up only once it runs,
+        so an item scheduled just before stop_async() lands in the restored thread queue"""
+        self.publication_queue.put_nowait(item)
+
+    def _deliver(self, subscriber, publication: Dict[str, Any]) -> int:
+        """Hand a publication to a subscriber and return the time it took (ns)"""
+        started_ns = now_ns()
+        subscriber.receive_message(publication)
+        elapsed_ns = now_ns() - started_ns
+        deliver_hist = self.deliver_hists.get(subscriber.subscriber_id)
+        if deliver_hist is None:
+            deliver_hist = self.metrics.histogram(
+                'pubsub_stage_seconds', stage='deliver',
+                broker_id=self.broker_id, subscriber_id=subscriber.subscriber_id)
+            self.deliver_hists[subscriber.subscriber_id] = deliver_hist
+        deliver_hist.record(elapsed_ns)
+        return elapsed_ns
+
+    def enable_profiling(self, sample_every: int = 1):
+        """Profile every sample_every-th publication per subscription (1 profiles them all)"""
+        with self.lock:
+            self.profile_every = max(1, int(sample_every))
+
+    def disable_profiling(self, reset: bool = False):
+        with self.lock:
+            self.profile_every = 0
+            if reset:
+                self.profiles = {}
+                self.profiled_publications = 0
+
+    def get_profile_report(self, top_n: int = 20, sort_by: str = 'eval_ns') -> Dict[str, Any]:
+        """Return the top_n most expensive subscriptions seen while profiling"""
+        with self.lock:
+            return build_profile_report(
+                self.broker_id, self.profiled_publications, self.subscriptions,
+                self.profiles, top_n, sort_by)
+
+    def dump_profile_report(self, path: str, top_n: int = 20, sort_by: str = 'eval_ns'):
+        dump_profile_report(self.get_profile_report(top_n, sort_by), path)
 
     def add_subscription(self, subscription: Subscription) -> str:
         """Add a new subscription and return its ID"""
         with self.lock:
             self.subscriptions[subscription.id] = subscription
+            self._index([subscription])
+            if subscription.expires_at is not None:
+                self.expiry.schedule(subscription.id, subscription.expires_at)
+            if self.journal:
+                self.journal.append_add(subscription)
             # Convert conditions to a serializable format
             log_conditions = [
                 {
@@ -43,63 +164,445 @@ class Broker:
             })
             return subscription.id
 
-    def remove_subscription(self, subscription_id: str):
+    def remove_subscription(self, subscription_id: int):
         """Remove a subscription by ID"""
         with self.lock:
             if subscription_id in self.subscriptions:
-                del self.subscriptions[subscription_id]
+                self._unindex([self.subscriptions.pop(subscription_id)])
+                self.profiles.pop(subscription_id, None)
+                if self.journal:
+                    self.journal.append_remove(subscription_id)
                 log_event(self.logger, 'subscription_removed', {
                     'broker_id': self.broker_id,
                     'subscription_id': subscription_id
                 })
 
-    def process_publication(self, publication: Dict[str, Any]):
-        """Process a publication and notify subscribers if conditions match"""
+    def add_subscriptions(self, subscriptions: Iterable[Subscription]) -> List[int]:
+        """Add many subscriptions under a single lock acquisition, with one summary log event"""
+        subscriptions = list(subscriptions)
         with self.lock:
-            self.received_publications += 1
+            self.subscriptions.update((subscription.id, subscription) for subscription in subscriptions)
+            self._index(subscriptions)
+            self._schedule_expiry(subscriptions)
+            if self.journal:
+                self.journal.append_adds(subscriptions)
+            total = len(self.subscriptions)
+        log_event(self.logger, 'subscriptions_added', {
+            'broker_id': self.broker_id,
+            'count': len(subscriptions),
+            'total_subscriptions': total,
+        })
+        return [subscription.id for subscription in subscriptions]
 
-            log_event(self.logger, 'publication_received', {
+    def remove_subscriptions(self, subscription_ids: Iterable[int]) -> int:
+        """Remove every known subscription among subscription_ids and return how many were removed"""
+        with self.lock:
+            removed = self._remove_locked(subscription_ids)
+            total = len(self.subscriptions)
+        if removed:
+            log_event(self.logger, 'subscriptions_removed', {
                 'broker_id': self.broker_id,
-                'publication': publication,
+                'count': len(removed),
+                'total_subscriptions': total,
             })
+        return len(removed)
+
+    def _remove_locked(self, subscription_ids: Iterable[int]) -> List[int]:
+        """Drop subscriptions from the table (caller holds the lock) and return the removed IDs"""
+        removed = []
+        for sub_id in subscription_ids:
+            subscription = self.subscriptions.pop(sub_id, None)
+            if subscription is not None:
+                removed.append(subscription)
+        self._unindex(removed)
+        removed = [subscription.id for subscription in removed]
+        for sub_id in removed:
+            self.profiles.pop(sub_id, None)
+        if self.journal and removed:
+            self.journal.append_removes(removed)
+        return removed
+
+    def _index(self, subscriptions: Iterable[Subscription]):
+        """Register subscriptions with the matching index (caller holds the lock)"""
+        created = False
+        for subscription in subscriptions:
+            if subscription.window_size is not None:
+                self.window_subscriptions[subscription.id] = subscription
+                continue
+            key = subscription.packed
+            predicate = self.predicates.get(key)
+            if predicate is None:
+                conditions = unpack_conditions(key)
+                predicate = SharedPredicate(self.schema.compile_conditions(conditions), subscription)
+                self.predicates[key] = predicate
+                created = True
+                if self.shard_pool:
+                    self.shard_pool.add(predicate)
+                if self.match_cache:
+                    self.match_cache.reference(conditions)
+            else:
+                predicate.registrations[subscription.id] = subscription
+                # Duplicates share one packed tuple instead of holding equal copies
+                subscription.packed = predicate.packed
+        # More registrations of a known predicate leave every cached result valid
+        if created and self.match_cache:
+            self.match_cache.invalidate()
+
+    def _unindex(self, subscriptions: Iterable[Subscription]):
+        """Drop subscriptions from the matching index; a predicate goes when its last registration does"""
+        deleted = False
+        for subscription in subscriptions:
+            if subscription.window_size is not None:
+                self.window_subscriptions.pop(subscription.id, None)
+                continue
+            key = subscription.packed
+            predicate = self.predicates.get(key)
+            if predicate is not None and predicate.release(subscription.id):
+                del self.predicates[key]
+                deleted = True
+                if self.shard_pool:
+                    self.shard_pool.remove(predicate)
+                if self.match_cache:
+                    self.match_cache.reference(unpack_conditions(key), -1)
+        if deleted and self.match_cache:
+            self.match_cache.invalidate()
+
+    def _schedule_expiry(self, subscriptions: Iterable[Subscription]):
+        for subscription in subscriptions:
+            if subscription.expires_at is not None:
+                self.expiry.schedule(subscription.id, subscription.expires_at)
+
+    def _expire_due(self, now: float):
+        """Drop the subscriptions whose lease ran out (caller holds the lock)
+
+        Only the wheel ticks that are due are looked at; a subscription renewed since it
+        was scheduled is simply put back on the wheel at its new deadline.
+        """
+        expired = []
+        for sub_id in self.expiry.pop_due(now):
+            subscription = self.subscriptions.get(sub_id)
+            if subscription is None or subscription.expires_at is None:
+                continue
+            if subscription.expires_at <= now:
+                expired.append(sub_id)
+            else:
+                self.expiry.schedule(sub_id, subscription.expires_at)
+        if expired:
+            self._remove_locked(expired)
+            self.expired_subscriptions += len(expired)
+            log_event(self.logger, 'subscriptions_expired', {
+                'broker_id': self.broker_id,
+                'count': len(expired),
+                'total_subscriptions': len(self.subscriptions),
+            })
+
+    def expire_subscriptions(self):
+        """Drop every subscription whose lease has run out"""
+        now = now_ns() / 1e9
+        if now >= self.expiry.next_due:
+            with self.lock:
+                self._expire_due(now)
+
+    def pick_subscriptions(self, share: float) -> List[int]:
+        """IDs of subscriptions worth about share of this broker's matching cost, costliest first"""
+        with self.lock:
+            # Measured and estimated costs are not comparable, so mix them only if every subscription is profiled
+            profiles = self.profiles if len(self.profiles) >= len(self.subscriptions) else {}
+            costs = [
+                (subscription_cost(subscription, profiles.get(sub_id)), sub_id)
+                for sub_id, subscription in self.subscriptions.items()
+            ]
+        costs.sort(reverse=True)
+        budget = share * sum(cost for cost, _ in costs)
+        picked = []
+        for cost, sub_id in costs:
+            if cost <= budget:
+                picked.append(sub_id)
+                budget -= cost
+        return picked
+
+    def _apply_migration(self, marker: MigrationMarker):
+        """Hand subscriptions off (as source) or install them (as target) at a migration marker"""
+        if marker.source is self:
+            with self.lock:
+                moved = [self.subscriptions[sub_id] for sub_id in marker.subscription_ids
+                         if sub_id in self.subscriptions]
+                self._remove_locked([subscription.id for subscription in moved])
+            # Window buffers travel with the Subscription objects
+            marker.hand_off(moved)
+        if marker.target is self:
+            # Nothing after the marker may be matched before the moved subscriptions are here
+            while not marker.handed_off.wait(0.1):
+                if not self.is_running:
+                    return
+            with self.lock:
+                self.subscriptions.update((subscription.id, subscription) for subscription in marker.subscriptions)
+                self._index(marker.subscriptions)
+                self._schedule_expiry(marker.subscriptions)
+                if self.journal:
+                    self.journal.append_adds(marker.subscriptions)
+            marker.installed.set()
+            log_event(self.logger, 'subscriptions_migrated', {
+                'source': marker.source.broker_id,
+                'target': self.broker_id,
+                'count': len(marker.subscriptions),
+            })
+
+    def save_snapshot(self, path: str) -> int:
+        """Persist the subscription table to a snapshot file and start a fresh journal next to it
+
+        Window buffers are runtime state and are not part of the snapshot.
+        """
+        started = time.perf_counter()
+        with self.lock:
+            count = write_snapshot(path, list(self.subscriptions.values()))
+            self._open_journal(journal_path_for(path), truncate=True)
+        log_event(self.logger, 'snapshot_saved', {
+            'broker_id': self.broker_id,
+            'path': path,
+            'subscriptions': count,
+            'duration_ms': (time.perf_counter() - started) * 1000,
+        })
+        return count
+
+    def load_snapshot(self, path: str, subscribers: Dict[str, Any] = None) -> int:
+        """Restore subscriptions from a snapshot and its journal, and keep journaling changes
+
+        subscribers maps subscriber IDs to Subscriber objects; the restored subscriptions
+        are reattached to them. Subscriptions with a TTL start a fresh lease. The snapshot is
+        indexed chunk by chunk as it is decoded off the memory map, each chunk under its own
+        lock acquisition. Returns the number of subscriptions restored.
+        """
+        started = time.perf_counter()
+        journal_path = journal_path_for(path)
+        stats: Dict[str, int] = {}
+        restored = 0
+        for chunk in iter_subscription_chunks(path, subscribers, journal_path, stats):
+            with self.lock:
+                self.subscriptions.update((subscription.id, subscription) for subscription in chunk)
+                self._index(chunk)
+                self._schedule_expiry(chunk)
+            for subscription in chunk:
+                if subscription.subscriber is not None:
+                    subscription.subscriber.subscriptions[subscription.id] = subscription
+            restored += len(chunk)
+        with self.lock:
+            self._open_journal(journal_path, truncate=False)
+        log_event(self.logger, 'snapshot_loaded', {
+            'broker_id': self.broker_id,
+            'path': path,
+            'subscriptions': restored,
+            **stats,
+            'duration_ms': (time.perf_counter() - started) * 1000,
+        })
+        return restored
+
+    def _open_journal(self, journal_path: str, truncate: bool):
+        if self.journal:
+            self.journal.close()
+        if truncate and os.path.exists(journal_path):
+            os.remove(journal_path)
+        self.journal = SubscriptionJournal(journal_path)
+
+    def process_publication(self, publication: PublicationRecord):
+        """Process a publication (a record, or a dict to convert) and notify subscribers if conditions match"""
+        self.process_batch([publication])
+
+    def process_batch(self, publications: List[PublicationRecord]):
+        """Process publications in order, with one lock acquisition and one matching pass for the batch
+
+        Expiry, log-level checks and metric updates happen once per batch; publications that
+        project to the same match-cache key are evaluated once, and the simple predicates are
+        evaluated over all remaining publications together. Deliveries keep publication order.
+        """
+        schema = self.schema
+        records = [publication if isinstance(publication, PublicationRecord) else schema.from_dict(publication)
+                   for publication in publications]
+        if not records:
+            return
+        count = len(records)
+        with self.lock:
+            started_ns = now_ns()
+            if started_ns / 1e9 >= self.expiry.next_due:
+                self._expire_due(started_ns / 1e9)
+            self.deliver_ns = 0
+            matches_before = self.matches_found
+            first_number = self.received_publications + 1
+            self.received_publications += count
+            self.batches += 1
+
+            level = event_level(self.logger, 'publication_received')
+            if level:
+                for record in records:
+                    log_event(self.logger, 'publication_received', {
+                        'broker_id': self.broker_id,
+                        'publication': record,
+                    }, level)
+
+            # Which publications of the batch are profiled (every profile_every-th one overall)
+            profiled = None
+            if self.profile_every:
+                profiled = [(first_number + i) % self.profile_every == 0 for i in range(count)]
+                self.profiled_publications += sum(profiled)
+
+            self.predicate_evaluations += len(self.window_subscriptions) * count
+            self.matching_attempts += len(self.subscriptions) * count
+            matched_lists = self._match_batch(records, profiled)
+
+            for i, publication in enumerate(records):
+                profiling = profiled is not None and profiled[i]
+                notified_subscribers = set()
+                for predicate in matched_lists[i]:
+                    registrations = predicate.registrations
+                    self.matches_found += len(registrations)
+                    for subscription in registrations.values():
+                        # Only notify subscriber once, even if multiple subs match
+                        if subscription.subscriber_id not in notified_subscribers:
+                            self.deliver_ns += self._deliver(subscription.subscriber, publication)
+                            self.sent_to_subscribers += 1
+                            notified_subscribers.add(subscription.subscriber_id)
 
-            notified_subscribers = set()
+                for sub_id, subscription in self.window_subscriptions.items():
+                    profile = None
+                    if profiling:
+                        profile = self.profiles.get(sub_id)
+                        if profile is None:
+                            profile = self.profiles[sub_id] = SubscriptionProfile()
+                        eval_started_ns = now_ns()
+                        deliver_before_ns = self.deliver_ns
 
-            for sub_id, subscription in self.subscriptions.items():
-                self.matching_attempts += 1
+                    matched = self._process_window_subscription(sub_id, subscription, publication, profile)
 
-                matched = False
-                if subscription.window_size is None:
-                    matched = subscription.matches(publication)
+                    if profiling:
+                        # Window meta-publications are delivered in here; that time is not evaluation
+                        profile.eval_ns += now_ns() - eval_started_ns - (self.deliver_ns - deliver_before_ns)
+                        profile.attempts += 1
+                        if matched:
+                            profile.matches += 1
+
+                    if matched:
+                        self.matches_found += 1
+
+                        # Only notify subscriber once, even if multiple subs match
+                        if subscription.subscriber_id not in notified_subscribers:
+                            self.deliver_ns += self._deliver(subscription.subscriber, publication)
+                            self.sent_to_subscribers += 1
+                            notified_subscribers.add(subscription.subscriber_id)
+
+            # Matching time excludes the time spent inside subscribers; each publication of
+            # the batch is charged an equal share
+            self.match_hist.record((now_ns() - started_ns - self.deliver_ns) // count, count)
+            self.batch_hist.record(count)
+            self.received_counter.inc(count)
+            self.matches_counter.inc(self.matches_found - matches_before)
+
+    def _match_batch(self, records: List[PublicationRecord], profiled: List[bool] = None) -> List[List[SharedPredicate]]:
+        """Matching simple predicates of each record: profiled ones one at a time, the rest via the cache"""
+        matched_lists = [None] * len(records)
+        cache = self.match_cache
+        # Cache key (or position, without a cache) -> positions of the records still to evaluate
+        pending: Dict[Any, List[int]] = {}
+        for i, record in enumerate(records):
+            if profiled is not None and profiled[i]:
+                matched_lists[i] = self._match_profiled(record)
+                continue
+            if cache:
+                key = cache.key(record)
+                if key in pending:
+                    pending[key].append(i)
+                    continue
+                cached = cache.get(key)
+                if cached is not None:
+                    matched_lists[i] = cached
+                    continue
+            else:
+                key = i
+            pending[key] = [i]
+        if pending:
+            keys = list(pending)
+            results = self._match_predicates_batch([records[pending[key][0]] for key in keys])
+            for key, matched_predicates in zip(keys, results):
+                if cache:
+                    cache.put(key, matched_predicates)
+                for i in pending[key]:
+                    matched_lists[i] = matched_predicates
+        return matched_lists
+
+    def _match_predicates(self, publication: Dict[str, Any]) -> List[SharedPredicate]:
+        """Evaluate every distinct simple predicate against a publication"""
+        self.predicate_evaluations += len(self.predicates)
+        return [predicate for predicate in self.predicates.values() if predicate.matches(publication)]
+
+    def _match_predicates_batch(self, records: List[PublicationRecord]) -> List[List[SharedPredicate]]:
+        """_match_predicates for several records, going over the predicates once (per shard, if sharded)"""
+        if self.shard_pool:
+            self.predicate_evaluations += len(self.predicates) * len(records)
+            return self.shard_pool.match([record.values for record in records])
+        if len(records) == 1:
+            return [self._match_predicates(records[0])]
+        self.predicate_evaluations += len(self.predicates) * len(records)
+        matched_lists = [[] for _ in records]
+        rows = [(record.values, matched) for record, matched in zip(records, matched_lists)]
+        for predicate in self.predicates.values():
+            # SharedPredicate.matches inlined: the call per (predicate, record) pair is most of the cost
+            conditions = predicate.conditions
+            for values, matched in rows:
+                for field_id, compare, value in conditions:
+                    if not compare(values[field_id], value):
+                        break
                 else:
-                    matched = self._process_window_subscription(sub_id, subscription, publication)
+                    matched.append(predicate)
+        return matched_lists
 
+    def _match_profiled(self, publication: Dict[str, Any]) -> List[SharedPredicate]:
+        """_match_predicates, timing each evaluation into the registrations' profiles"""
+        self.predicate_evaluations += len(self.predicates)
+        matched_predicates = []
+        for predicate in self.predicates.values():
+            registrations = predicate.registrations
+            eval_started_ns = now_ns()
+            matched = predicate.matches(publication)
+            # A shared evaluation is charged in equal parts to every registration
+            eval_ns = (now_ns() - eval_started_ns) / len(registrations)
+            for sub_id in registrations:
+                profile = self.profiles.get(sub_id)
+                if profile is None:
+                    profile = self.profiles[sub_id] = SubscriptionProfile()
+                profile.eval_ns += eval_ns
+                profile.attempts += 1
                 if matched:
-                    self.matches_found += 1
-
-                    # Only notify subscriber once, even if multiple subs match
-                    if subscription.subscriber_id not in notified_subscribers:
-                        subscription.subscriber.receive_message(publication)
-                        self.sent_to_subscribers += 1
-                        notified_subscribers.add(subscription.subscriber_id)
+                    profile.matches += 1
+            if matched:
+                matched_predicates.append(predicate)
+        return matched_predicates
 
-    def _process_window_subscription(self, sub_id, subscription, publication):
+    def _process_window_subscription(self, sub_id, subscription, publication, profile=None):
         """Process a window-based subscription"""
         subscription.window_buffer.append(publication)
-        log_event(self.logger, 'window_buffer_updated', {
-            'broker_id': self.broker_id,
-            'subscription_id': sub_id,
-            'buffer_size': len(subscription.window_buffer),
-            'window_size': subscription.window_size
-        })
+        level = event_level(self.logger, 'window_buffer_updated')
+        if level:
+            log_event(self.logger, 'window_buffer_updated', {
+                'broker_id': self.broker_id,
+                'subscription_id': sub_id,
+                'buffer_size': len(subscription.window_buffer),
+                'window_size': subscription.window_size
+            }, level)
         if len(subscription.window_buffer) >= subscription.window_size:
             log_event(self.logger, 'window_size_reached', {
                 'broker_id': self.broker_id,
                 'subscription_id': sub_id,
                 'window_size': subscription.window_size
             })
-            meta_pub = subscription.process_window()
+            if profile is not None:
+                window_started_ns = now_ns()
+                meta_pub = subscription.process_window()
+                profile.window_ns += now_ns() - window_started_ns
+                profile.window_runs += 1
+            else:
+                meta_pub = subscription.process_window()
             if meta_pub:
+                # Adăugăm un ID unic pentru publicație pentru a evita duplicatele
+                meta_pub['unique_id'] = f"{meta_pub['id']}_{self.broker_id}"
                 self.notify_subscriber(sub_id, meta_pub)
                 log_event(self.logger, 'window_subscription_generated', {
                     'broker_id': self.broker_id,
@@ -116,19 +619,19 @@ class Broker:
         if subscription.matches(publication):
             self.notify_subscriber(sub_id, publication)
 
-    def notify_subscriber(self, subscription_id: str, publication: Dict[str, Any]):
+    def notify_subscriber(self, subscription_id: int, publication: Dict[str, Any]):
         """Notify the subscriber of a matched publication"""
         subscription = self.subscriptions.get(subscription_id)
         if subscription and subscription.subscriber:
-            # Adăugăm un ID unic pentru publicație pentru a evita duplicatele
-            publication['unique_id'] = f"{publication['id']}_{self.broker_id}"
-            subscription.subscriber.receive_message(publication)
-            log_event(self.logger, 'subscriber_notified', {
-                'broker_id': self.broker_id,
-                'subscription_id': subscription_id,
-                'publication': publication,
-                'subscriber_id': subscription.subscriber.subscriber_id
-            })
+            self.deliver_ns += self._deliver(subscription.subscriber, publication)
+            level = event_level(self.logger, 'subscriber_notified')
+            if level:
+                log_event(self.logger, 'subscriber_notified', {
+                    'broker_id': self.broker_id,
+                    'subscription_id': subscription_id,
+                    'publication': publication,
+                    'subscriber_id': subscription.subscriber.subscriber_id
+                }, level)
         else:
             log_event(self.logger, 'subscriber_notify_failed', {
                 'broker_id': self.broker_id,
@@ -138,6 +641,8 @@ class Broker:
     def start(self):
         """Start the broker's processing thread"""
         self.is_running = True
+        if self.shard_pool:
+            self.shard_pool.start()
         self.processing_thread = threading.Thread(target=self._process_loop_proto)
         self.processing_thread.start()
         log_event(self.logger, 'broker_started', {
@@ -150,60 +655,248 @@ class Broker:
         self.is_running = False
         if self.processing_thread:
             self.processing_thread.join()
+        if self.shard_pool:
+            self.shard_pool.close()
+        if self.journal:
+            self.journal.close()
         log_event(self.logger, 'broker_stopped', {
             'broker_id': self.broker_id
         })
         print(f"Broker {self.broker_id} stopped")
 
+    def _next_batch(self) -> List[tuple]:
+        """Wait for a queue item, then take up to batch_size of them, waiting at most batch_deadline_us
+
+        Raises Empty when the queue stays idle. A migration marker ends the batch, so it is
+        applied right after the publications queued before it.
+        """
+        queue = self.publication_queue
+        batch = [queue.get(timeout=1)]
+        if self.batch_size > 1:
+            deadline_ns = now_ns() + int(self.batch_deadline_us * 1000)
+            while len(batch) < self.batch_size and not isinstance(batch[-1][1], MigrationMarker):
+                remaining_ns = deadline_ns - now_ns()
+                try:
+                    batch.append(queue.get(timeout=remaining_ns / 1e9) if remaining_ns > 0 else queue.get_nowait())
+                except Empty:
+                    break
+        return batch
+
     def _process_loop(self):
         """Main processing loop for publications"""
         while self.is_running:
             try:
-                publication = self.publication_queue.get(timeout=1)
-                self.process_publication(publication)
-            except:
+                batch = self._next_batch()
+                marker = batch.pop()[1] if isinstance(batch[-1][1], MigrationMarker) else None
+                dequeued_ns = now_ns()
+                for enqueued_ns, _ in batch:
+                    self.dequeue_hist.record(dequeued_ns - enqueued_ns)
+                self.process_batch([publication for _, publication in batch])
+                if marker is not None:
+                    self._apply_migration(marker)
+            except Empty:
                 continue
+            except Exception as error:
+                log_event(self.logger, 'broker_batch_failed', {
+                    'broker_id': self.broker_id,
+                    'error': repr(error),
+                })
 
     def get_stats(self):
         """Get statistics about the broker's operations"""
+        cache_stats = {}
+        if self.match_cache:
+            with self.lock:
+                cache_stats = self.match_cache.get_stats()
+        shard_stats = self.shard_pool.get_stats() if self.shard_pool else {}
         return {
             "broker_id": self.broker_id,
             "received_publications": self.received_publications,
             "sent_to_subscribers": self.sent_to_subscribers,
             "matching_attempts": self.matching_attempts,
-            "matches_found": self.matches_found
+            "matches_found": self.matches_found,
+            "expired_subscriptions": self.expired_subscriptions,
+            "decode_failures": self.decode_failures,
+            "subscriptions": len(self.subscriptions),
+            "distinct_predicates": len(self.predicates) + len(self.window_subscriptions),
+            "predicate_evaluations": self.predicate_evaluations,
+            "batches": self.batches,
+            "avg_batch_size": self.received_publications / self.batches if self.batches else 0.0,
+            **cache_stats,
+            **shard_stats,
         }
 
+    def decode_publication(self, serialized_pub: bytes, enqueued_ns: int, dequeued_ns: int) -> PublicationRecord:
+        """Decode a serialized publication into the record used for matching, adding this broker's hop"""
+        # Deserializăm din bytes în mesaj Protobuf
+        pub_msg = pb.Publication()
+        pub_msg.ParseFromString(serialized_pub)
+
+        # Hop trace: earlier hops from the wire plus this broker's own
+        wire_hops = pub_msg.hops
+        hops = [new_hop((hop.node_id, hop.received_ns, hop.dequeued_ns, hop.decoded_ns))
+                for hop in wire_hops] if wire_hops else []
+        record = self.schema.from_proto(pub_msg, hops)
+        hops.append(new_hop((self.broker_id, enqueued_ns, dequeued_ns, now_ns())))
+        return record
+
+    def _handle_batch(self, batch: List[tuple]) -> MigrationMarker:
+        """Decode and process a batch of queue items; return the migration marker that ended it, if any"""
+        marker = batch.pop()[1] if isinstance(batch[-1][1], MigrationMarker) else None
+        dequeued_ns = now_ns()
+        records = []
+        for enqueued_ns, serialized_pub in batch:
+            self.dequeue_hist.record(dequeued_ns - enqueued_ns)
+            decode_started_ns = now_ns()
+            try:
+                record = self.decode_publication(serialized_pub, enqueued_ns, dequeued_ns)
+            except Exception as error:
+                # Skip just this publication, but leave a trace of it
+                self.decode_failures += 1
+                self.decode_failures_counter.inc()
+                log_event(self.logger, 'publication_decode_failed', {
+                    'broker_id': self.broker_id,
+                    'error': repr(error),
+                })
+                continue
+            self.decode_hist.record(record.hops[-1].decoded_ns - decode_started_ns)
+            records.append(record)
+        self.process_batch(records)
+        return marker
+
     def _process_loop_proto(self):
         """Main processing loop for publications using Protobuf serialization"""
         while self.is_running:
             try:
-                serialized_pub = self.publication_queue.get(timeout=1)
-
-                # Deserializăm din bytes în mesaj Protobuf
-                pub_msg = pb.Publication()
-                pub_msg.ParseFromString(serialized_pub)
-
-                # Convertim în dict pentru logare și procesare
-                publication_dict = {
-                    'station_id': pub_msg.station_id,
-                    'city': pub_msg.city,
-                    'direction': pub_msg.direction,
-                    'temperature': pub_msg.temperature,
-                    'rain': pub_msg.rain,
-                    'wind': pub_msg.wind,
-                    'created_at': pub_msg.created_at,
-                    'timestamp': pub_msg.timestamp,
-                }
+                marker = self._handle_batch(self._next_batch())
+                if marker is not None:
+                    self._apply_migration(marker)
+            except Empty:
+                # Idle: still let leases run out
+                self.expire_subscriptions()
+            except Exception as error:
+                log_event(self.logger, 'broker_batch_failed', {
+                    'broker_id': self.broker_id,
+                    'error': repr(error),
+                })
+
+    def start_async(self) -> asyncio.Task:
+        """Run the broker as a task on the running event loop instead of a thread
+
+        The task sleeps until a publication arrives or a lease is due, and stop_async()
+        cancels it immediately. Publications already queued are carried over.
+        """
+        queue = asyncio.Queue()
+        loop = asyncio.get_running_loop()
+        # No enqueue() may slip in between draining the thread queue and switching over
+        with self.queue_lock:
+            while True:
+                try:
+                    queue.put_nowait(self.publication_queue.get_nowait())
+                except Empty:
+                    break
+            self.loop = loop
+            self.loop_thread = threading.get_ident()
+            self.publication_queue = queue
+        self.is_running = True
+        self.task = self.loop.create_task(self._run_async(), name=f"broker:{self.broker_id}")
+        log_event(self.logger, 'broker_started', {
+            'broker_id': self.broker_id,
+            'runtime': 'asyncio',
+        })
+        print(f"Broker {self.broker_id} started (asyncio)")
+        return self.task
 
-                self.process_publication(publication_dict)
-            except Exception:
+    async def stop_async(self):
+        """Cancel the broker task and go back to a thread-safe queue (pending items are kept)"""
+        if self.task:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+        queue = Queue()
+        with self.queue_lock:
+            while not self.publication_queue.empty():
+                queue.put(self.publication_queue.get_nowait())
+            self.publication_queue = queue
+            self.loop = None
+            self.loop_thread = None
+        # Items enqueued before the switch may still wait in the loop's ready queue;
+        # let them run (into the thread queue) before returning
+        await asyncio.sleep(0)
+        self.stop()
+
+    async def _next_batch_async(self) -> List[tuple]:
+        """_next_batch for the asyncio queue; raises TimeoutError when a lease falls due first"""
+        queue = self.publication_queue
+        if queue.empty():
+            lease_wait = self.expiry.next_due - now_ns() / 1e9
+            if lease_wait == float('inf'):
+                batch = [await queue.get()]
+            else:
+                batch = [await asyncio.wait_for(queue.get(), max(lease_wait, 0))]
+        else:
+            batch = [queue.get_nowait()]
+        deadline_ns = now_ns() + int(self.batch_deadline_us * 1000)
+        while len(batch) < self.batch_size and not isinstance(batch[-1][1], MigrationMarker):
+            if not queue.empty():
+                batch.append(queue.get_nowait())
+                continue
+            remaining_ns = deadline_ns - now_ns()
+            if remaining_ns <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(queue.get(), remaining_ns / 1e9))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _off_loop(self, function, *args):
+        """Run function in a helper thread; if the task is cancelled meanwhile, let it finish first"""
+        work = asyncio.ensure_future(asyncio.to_thread(function, *args))
+        try:
+            return await asyncio.shield(work)
+        except asyncio.CancelledError:
+            await work
+            raise
+
+    async def _run_async(self):
+        """Processing task: woken by each publication or lease deadline, never by polling"""
+        if self.shard_pool:
+            # Spawning the shard workers takes a while; other tasks keep running meanwhile
+            await self._off_loop(self.shard_pool.start)
+        while True:
+            try:
+                batch = await self._next_batch_async()
+            except asyncio.TimeoutError:
+                self.expire_subscriptions()
                 continue
+            try:
+                if self.shard_pool:
+                    # Waiting for the shard workers would otherwise block the whole loop
+                    marker = await self._off_loop(self._handle_batch, batch)
+                else:
+                    marker = self._handle_batch(batch)
+                if marker is not None:
+                    if marker.target is self:
+                        # The source may be a task on this same loop: wait without blocking it
+                        while not marker.handed_off.is_set():
+                            await asyncio.to_thread(marker.handed_off.wait, 0.1)
+                    self._apply_migration(marker)
+            except Exception as error:
+                log_event(self.logger, 'broker_batch_failed', {
+                    'broker_id': self.broker_id,
+                    'error': repr(error),
+                })
+            # Let publishers and other brokers run between batches
+            await asyncio.sleep(0)
 
     def publish(self, publication: Dict[str, Any]):
         """Publish a message to all brokers to ensure all subscriptions are checked"""
         for broker in self.brokers:
-            broker.publication_queue.put(publication)
+            broker.enqueue(publication)
         log_event(self.logger, 'publication_broadcasted', {
             'publication': publication,
             'num_brokers': len(self.brokers)
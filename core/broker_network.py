@@ -1,18 +1,66 @@
+import asyncio
+import os
 import threading
 import time
-from typing import Dict, List, Any, Set, Tuple
+from typing import Dict, Iterable, List, Any, Set, Tuple
 from queue import Queue
 from datetime import datetime
 import json
 import logging
 from .broker import Broker
+from .hash_ring import HashRing
+from .metrics import MetricsRegistry, REGISTRY
+from .rebalancer import MigrationMarker, Rebalancer
+from .records import Schema
 from .subscription import Subscription
-from .utils import log_event
+from .utils import log_event, event_level
+
+async def _start_on_loop(broker: Broker):
+    broker.start_async()
+
+
+def snapshot_file(directory: str, broker_id: str) -> str:
+    return os.path.join(directory, f"subscriptions_{broker_id}.snap")
+
+
+def snapshots_exist(directory: str, num_brokers: int) -> bool:
+    """Whether a directory holds a snapshot for each of num_brokers brokers"""
+    return all(os.path.exists(snapshot_file(directory, f"broker_{i}")) for i in range(num_brokers))
+
 
 class BrokerNetwork:
-    def __init__(self, num_brokers: int = 3, window_size: int = 10, logger: logging.Logger = None):
-        self.brokers = [Broker(f"broker_{i}", window_size, logger) for i in range(num_brokers)]
-        self.current_broker_index = 0
+    def __init__(self, num_brokers: int = 3, window_size: int = 10, logger: logging.Logger = None,
+                 metrics: MetricsRegistry = None, expiry_resolution: float = 0.1,
+                 match_cache_size: int = 0, schema: Schema = None,
+                 batch_size: int = 1, batch_deadline_us: float = 0, match_shards: int = 1):
+        self.metrics = metrics or REGISTRY
+        self.window_size = window_size
+        self.expiry_resolution = expiry_resolution
+        self.match_cache_size = match_cache_size
+        self.schema = schema
+        self.batch_size = batch_size
+        self.batch_deadline_us = batch_deadline_us
+        self.match_shards = match_shards
+        self.profile_every = 0
+        self.brokers = [
+            Broker(f"broker_{i}", window_size, logger, self.metrics, expiry_resolution, match_cache_size, schema,
+                   batch_size, batch_deadline_us, match_shards)
+            for i in range(num_brokers)
+        ]
+        self.next_broker_index = num_brokers
+        # Subscriptions are placed on the ring so resizing the pool moves as few as possible
+        self.ring = HashRing([broker.broker_id for broker in self.brokers])
+        # Publications reach every broker queue in one global order; migrations rely on it
+        self.publish_lock = threading.Lock()
+        # Held by whoever moves subscriptions around: pool resizing and the rebalancer
+        self.membership_lock = threading.Lock()
+        # Orders placing new subscriptions against ring changes: an add lands either before a
+        # resize lists the brokers' subscriptions (and moves with them) or on the new owner.
+        # Held only briefly, unlike membership_lock, which spans whole migrations
+        self.placement_lock = threading.Lock()
+        self.rebalancer = None
+        # Event loop the brokers run on as tasks, in the asyncio runtime
+        self.loop: asyncio.AbstractEventLoop = None
         self.logger = logger or logging.getLogger('pubsub_system')
         log_event(self.logger, 'broker_network_created', {
             'num_brokers': num_brokers,
@@ -32,30 +80,243 @@ class BrokerNetwork:
         log_event(self.logger, 'broker_network_stopping', {
             'num_brokers': len(self.brokers)
         })
+        self.stop_rebalancing()
+        for broker in self.brokers:
+            broker.stop()
+
+    def start_async(self) -> List[asyncio.Task]:
+        """Run every broker as a task on the running event loop instead of a thread each
+
+        Pool resizing blocks until migrations finish, so in this mode call add_broker and
+        remove_broker off the loop, e.g. through asyncio.to_thread.
+        """
+        log_event(self.logger, 'broker_network_starting', {
+            'num_brokers': len(self.brokers),
+            'runtime': 'asyncio',
+        })
+        self.loop = asyncio.get_running_loop()
+        return [broker.start_async() for broker in self.brokers]
+
+    async def stop_async(self):
+        """Stop rebalancing and cancel every broker task"""
+        log_event(self.logger, 'broker_network_stopping', {
+            'num_brokers': len(self.brokers)
+        })
+        # The rebalancer thread may be waiting on a migration that needs this loop to finish
+        await asyncio.to_thread(self.stop_rebalancing)
         for broker in self.brokers:
+            await broker.stop_async()
+        self.loop = None
+
+    def _start_broker(self, broker: Broker):
+        if self.loop is None:
+            broker.start()
+        else:
+            asyncio.run_coroutine_threadsafe(_start_on_loop(broker), self.loop).result()
+
+    def _stop_broker(self, broker: Broker):
+        if self.loop is None:
             broker.stop()
+        else:
+            asyncio.run_coroutine_threadsafe(broker.stop_async(), self.loop).result()
+
+    def get_broker(self, broker_id: str) -> Broker:
+        return next(broker for broker in self.brokers if broker.broker_id == broker_id)
 
     def add_subscription(self, subscription: Subscription) -> str:
-        """Add a subscription to a broker using round-robin distribution"""
-        broker = self.brokers[self.current_broker_index]
-        self.current_broker_index = (self.current_broker_index + 1) % len(self.brokers)
-        subscription_id = broker.add_subscription(subscription)
+        """Add a subscription to the broker owning its ID on the hash ring"""
+        with self.placement_lock:
+            broker = self.get_broker(self.ring.node_for(subscription.id))
+            subscription_id = broker.add_subscription(subscription)
         log_event(self.logger, 'subscription_distributed', {
             'broker_id': broker.broker_id,
-            'subscription_id': subscription_id,
-            'current_broker_index': self.current_broker_index
+            'subscription_id': subscription_id
         })
         return subscription_id
 
+    def add_subscriptions(self, subscriptions: Iterable[Subscription]) -> List[int]:
+        """Distribute many subscriptions over the hash ring in one pass, one bulk add per broker"""
+        with self.placement_lock:
+            brokers = self.brokers
+            per_broker = {broker.broker_id: [] for broker in brokers}
+            subscription_ids = []
+            for subscription in subscriptions:
+                per_broker[self.ring.node_for(subscription.id)].append(subscription)
+                subscription_ids.append(subscription.id)
+            for broker in brokers:
+                if per_broker[broker.broker_id]:
+                    broker.add_subscriptions(per_broker[broker.broker_id])
+        log_event(self.logger, 'subscriptions_distributed', {
+            'count': len(subscription_ids),
+            'per_broker': {broker_id: len(batch) for broker_id, batch in per_broker.items()}
+        })
+        return subscription_ids
+
+    def remove_subscriptions(self, subscription_ids: Iterable[int]) -> int:
+        """Remove subscriptions wherever they live and return how many were removed"""
+        subscription_ids = list(subscription_ids)
+        return sum(broker.remove_subscriptions(subscription_ids) for broker in self.brokers)
+
     def publish(self, publication: Dict[str, Any]):
         """Broadcast a message to all brokers"""
-        for broker in self.brokers:
-            broker.publication_queue.put(publication)
-        log_event(self.logger, 'publication_broadcasted', {
-            'publication': publication,
+        with self.publish_lock:
+            for broker in self.brokers:
+                broker.enqueue(publication)
+        level = event_level(self.logger, 'publication_broadcasted')
+        if level:
+            log_event(self.logger, 'publication_broadcasted', {
+                'publication': publication,
+                'num_brokers': len(self.brokers)
+            }, level)
+
+    def publish_batch(self, publications: List[Any]):
+        """Broadcast a batch of messages to all brokers with a single log event"""
+        with self.publish_lock:
+            for broker in self.brokers:
+                for publication in publications:
+                    broker.enqueue(publication)
+        log_event(self.logger, 'publication_batch_broadcasted', {
+            'batch_size': len(publications),
             'num_brokers': len(self.brokers)
         })
 
+    def migrate_subscriptions(self, source: Broker, target: Broker, subscription_ids: List[int]) -> MigrationMarker:
+        """Move subscriptions (with their window buffers) between two running brokers
+
+        The move takes effect at the current point of the publication stream; call wait()
+        on the returned marker to block until the target has taken over.
+        """
+        marker = MigrationMarker(source, target, list(subscription_ids))
+        with self.publish_lock:
+            source.enqueue(marker)
+            target.enqueue(marker)
+        return marker
+
+    def _migrate_by_owner(self, source: Broker, subscription_ids: Iterable[int],
+                          target_id: str = None) -> List[MigrationMarker]:
+        """Move subscriptions from source to their owners on the ring (only to target_id if given)"""
+        per_target = {}
+        for sub_id in subscription_ids:
+            owner = self.ring.node_for(sub_id)
+            if owner != source.broker_id and (target_id is None or owner == target_id):
+                per_target.setdefault(owner, []).append(sub_id)
+        return [self.migrate_subscriptions(source, self.get_broker(owner), ids) for owner, ids in per_target.items()]
+
+    def add_broker(self) -> Broker:
+        """Start a new broker and move over the subscriptions it now owns on the ring
+
+        The broker joins the publication stream before anything moves to it, so publishing
+        carries on throughout; the call returns once the moved subscriptions are installed.
+        """
+        with self.membership_lock:
+            broker = Broker(f"broker_{self.next_broker_index}", self.window_size, self.logger,
+                            self.metrics, self.expiry_resolution, self.match_cache_size, self.schema,
+                            self.batch_size, self.batch_deadline_us, self.match_shards)
+            self.next_broker_index += 1
+            if self.profile_every:
+                broker.enable_profiling(self.profile_every)
+            self._start_broker(broker)
+            with self.publish_lock:
+                # Copy-on-write so readers iterating the old list are not disturbed
+                self.brokers = self.brokers + [broker]
+            with self.placement_lock:
+                self.ring.add(broker.broker_id)
+                owned = []
+                for source in self.brokers[:-1]:
+                    with source.lock:
+                        owned.append((source, list(source.subscriptions)))
+
+            markers = []
+            for source, subscription_ids in owned:
+                # Subscriptions the rebalancer placed elsewhere stay put unless the new broker owns them
+                markers.extend(self._migrate_by_owner(source, subscription_ids, broker.broker_id))
+            for marker in markers:
+                marker.wait()
+        log_event(self.logger, 'broker_added', {
+            'broker_id': broker.broker_id,
+            'num_brokers': len(self.brokers),
+            'moved_subscriptions': sum(len(marker.subscriptions) for marker in markers)
+        })
+        return broker
+
+    def remove_broker(self, broker_id: str = None) -> Broker:
+        """Drain a broker (the newest by default) into the others and stop it"""
+        with self.membership_lock:
+            if len(self.brokers) < 2:
+                raise ValueError("Cannot remove the last broker")
+            broker = self.get_broker(broker_id) if broker_id else self.brokers[-1]
+            with self.placement_lock:
+                self.ring.remove(broker.broker_id)
+                with broker.lock:
+                    subscription_ids = list(broker.subscriptions)
+            markers = self._migrate_by_owner(broker, subscription_ids)
+            for marker in markers:
+                marker.wait()
+            with self.publish_lock:
+                self.brokers = [other for other in self.brokers if other is not broker]
+            # Whatever is still queued behind the markers has nothing left to match
+            self._stop_broker(broker)
+        log_event(self.logger, 'broker_removed', {
+            'broker_id': broker.broker_id,
+            'num_brokers': len(self.brokers),
+            'moved_subscriptions': sum(len(marker.subscriptions) for marker in markers)
+        })
+        return broker
+
+    def start_rebalancing(self, interval: float = 5.0, imbalance: float = 1.25, max_fraction: float = 0.25):
+        """Periodically migrate subscriptions from overloaded brokers to underloaded ones"""
+        self.stop_rebalancing()
+        self.rebalancer = Rebalancer(self, interval, imbalance, max_fraction)
+        self.rebalancer.start()
+        log_event(self.logger, 'rebalancing_started', {
+            'interval': interval,
+            'imbalance': imbalance,
+            'max_fraction': max_fraction
+        })
+
+    def stop_rebalancing(self):
+        if self.rebalancer:
+            self.rebalancer.stop()
+
+    def queue_depth(self) -> int:
+        """Total number of publications waiting in the broker queues"""
+        return sum(broker.publication_queue.qsize() for broker in self.brokers)
+
+    def wait_until_drained(self, timeout: float = None) -> bool:
+        """Wait until every broker queue is empty; return False if the timeout expired first"""
+        deadline = time.time() + timeout if timeout is not None else None
+        while any(not broker.publication_queue.empty() for broker in self.brokers):
+            if deadline is not None and time.time() > deadline:
+                return False
+            time.sleep(0.01)
+        return True
+
+    def enable_profiling(self, sample_every: int = 1):
+        """Turn on per-subscription cost profiling on every broker"""
+        self.profile_every = sample_every
+        for broker in self.brokers:
+            broker.enable_profiling(sample_every)
+
+    def get_profile_reports(self, top_n: int = 20, sort_by: str = 'eval_ns') -> List[Dict[str, Any]]:
+        return [broker.get_profile_report(top_n, sort_by) for broker in self.brokers]
+
+    def dump_profile_reports(self, directory: str, top_n: int = 20, sort_by: str = 'eval_ns'):
+        """Write one profile_<broker_id>.json top-N report per broker"""
+        os.makedirs(directory, exist_ok=True)
+        for broker in self.brokers:
+            broker.dump_profile_report(os.path.join(directory, f"profile_{broker.broker_id}.json"), top_n, sort_by)
+
+    def save_snapshots(self, directory: str) -> int:
+        """Write one subscription snapshot per broker into a directory"""
+        os.makedirs(directory, exist_ok=True)
+        return sum(broker.save_snapshot(snapshot_file(directory, broker.broker_id)) for broker in self.brokers)
+
+    def load_snapshots(self, directory: str, subscribers: Dict[str, Any] = None) -> int:
+        """Restore every broker's subscriptions from the snapshots in a directory"""
+        return sum(
+            broker.load_snapshot(snapshot_file(directory, broker.broker_id), subscribers)
+            for broker in self.brokers)
+
     def get_all_broker_stats(self):
         """Get statistics from all brokers in the network"""
         stats = []
@@ -0,0 +1,236 @@
+import json
+import os
+from typing import Any, Dict, Iterable, Iterator, List, Tuple
+
+from .proto import publication_pb2 as pb
+from .utils import json_default
+
+FORMATS = ('ndjson', 'pb')
+EXTENSIONS = {'ndjson': 'ndjson', 'pb': 'pb'}
+# Scalar fields only; the hop trace is runtime data, not part of a dataset
+PUBLICATION_FIELDS = [field.name for field in pb.Publication.DESCRIPTOR.fields if field.message_type is None]
+
+
+def dataset_path(dump_path: str, kind: str, fmt: str) -> str:
+    """Return the file path used for a dataset kind ('pubs' or 'subs') in a format"""
+    return os.path.join(dump_path, f"{kind}.{EXTENSIONS[fmt]}")
+
+
+def _encode_varint(value: int) -> bytes:
+    """Encode an unsigned integer as a protobuf varint"""
+    out = bytearray()
+    while True:
+        bits = value & 0x7F
+        value >>= 7
+        if value:
+            out.append(bits | 0x80)
+        else:
+            out.append(bits)
+            return bytes(out)
+
+
+def _read_varint(file) -> int:
+    """Read a protobuf varint from a binary file, or None at end of file"""
+    shift = 0
+    result = 0
+    while True:
+        byte = file.read(1)
+        if not byte:
+            if shift:
+                raise EOFError("Truncated length prefix in dataset file")
+            return None
+        result |= (byte[0] & 0x7F) << shift
+        if not byte[0] & 0x80:
+            return result
+        shift += 7
+
+
+def publication_to_proto(publication: Dict[str, Any]) -> pb.Publication:
+    """Build a Publication message from a generated publication dict"""
+    pub_msg = pb.Publication(**{
+        field: value for field, value in publication.items() if field in PUBLICATION_FIELDS
+    })
+    for hop in publication.get('hops') or ():
+        pub_msg.hops.add(**(hop if isinstance(hop, dict) else hop._asdict()))
+    return pub_msg
+
+
+def publication_from_proto(pub_msg: pb.Publication) -> Dict[str, Any]:
+    """Convert a Publication message back into a publication dict"""
+    return {field: getattr(pub_msg, field) for field in PUBLICATION_FIELDS}
+
+
+def subscription_to_proto(subscription: Dict[str, Tuple[str, Any]]) -> pb.SubscriptionRecord:
+    """Build a SubscriptionRecord message from a generated {field: (operator, value)} dict"""
+    record = pb.SubscriptionRecord()
+    for field, (operator, value) in subscription.items():
+        condition = record.conditions.add(field=field, operator=operator)
+        if isinstance(value, bool) or isinstance(value, int):
+            condition.int_value = int(value)
+        elif isinstance(value, float):
+            condition.float_value = value
+        else:
+            condition.string_value = str(value)
+    return record
+
+
+def subscription_from_proto(record: pb.SubscriptionRecord) -> Dict[str, Tuple[str, Any]]:
+    """Convert a SubscriptionRecord message back into a {field: (operator, value)} dict"""
+    return {
+        condition.field: (condition.operator, getattr(condition, condition.WhichOneof('value')))
+        for condition in record.conditions
+    }
+
+
+def message_to_proto(message: Dict[str, Any]) -> pb.ReceivedMessage:
+    """Build a ReceivedMessage from a delivered publication or window meta-publication"""
+    record = pb.ReceivedMessage(unique_id=message.get('unique_id', ''))
+    if 'aggregated_fields' in message:
+        record.meta.id = message['id']
+        record.meta.timestamp = int(message['timestamp'])
+        record.meta.aggregated_fields.update(message['aggregated_fields'])
+    else:
+        record.publication.CopyFrom(publication_to_proto(message))
+    return record
+
+
+def message_from_proto(record: pb.ReceivedMessage) -> Dict[str, Any]:
+    """Convert a ReceivedMessage back into the dict a subscriber received"""
+    if record.WhichOneof('body') == 'meta':
+        message = {
+            'id': record.meta.id,
+            'timestamp': record.meta.timestamp,
+            'aggregated_fields': dict(record.meta.aggregated_fields),
+        }
+    else:
+        message = publication_from_proto(record.publication)
+        message['hops'] = [
+            {
+                'node_id': hop.node_id,
+                'received_ns': hop.received_ns,
+                'dequeued_ns': hop.dequeued_ns,
+                'decoded_ns': hop.decoded_ns,
+            }
+            for hop in record.publication.hops
+        ]
+    if record.unique_id:
+        message['unique_id'] = record.unique_id
+    return message
+
+
+_TO_PROTO = {
+    'pubs': publication_to_proto,
+    'subs': subscription_to_proto,
+    'messages': message_to_proto,
+}
+
+
+class DatasetWriter:
+    """Append publications, subscriptions or received messages to disk one record at a time"""
+
+    def __init__(self, path: str, kind: str, fmt: str = 'ndjson', buffer_size: int = 1 << 20):
+        if kind not in _TO_PROTO:
+            raise ValueError(f"Unknown dataset kind '{kind}'")
+        if fmt not in FORMATS:
+            raise ValueError(f"Unknown dataset format '{fmt}', expected one of {FORMATS}")
+        self.path = path
+        self.kind = kind
+        self.fmt = fmt
+        self.count = 0
+        if fmt == 'ndjson':
+            self.file = open(path, 'w', encoding='utf-8', buffering=buffer_size)
+        else:
+            self.file = open(path, 'wb', buffering=buffer_size)
+
+    def write(self, record):
+        """Write a single record (a dict, or already serialized protobuf bytes)"""
+        if self.fmt == 'ndjson':
+            self.file.write(json.dumps(record, separators=(',', ':'), default=json_default) + '\n')
+        else:
+            if not isinstance(record, bytes):
+                record = _TO_PROTO[self.kind](record).SerializeToString()
+            self.file.write(_encode_varint(len(record)))
+            self.file.write(record)
+        self.count += 1
+
+    def write_many(self, records: Iterable):
+        """Write every record of an iterable without materializing it"""
+        for record in records:
+            self.write(record)
+
+    def flush(self):
+        self.file.flush()
+
+    def close(self):
+        """Flush and close the underlying file"""
+        if not self.file.closed:
+            self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+def _iter_raw(path: str) -> Iterator[bytes]:
+    """Yield the raw payloads of a length-delimited protobuf file"""
+    with open(path, 'rb') as file:
+        while True:
+            size = _read_varint(file)
+            if size is None:
+                return
+            payload = file.read(size)
+            if len(payload) < size:
+                raise EOFError(f"Truncated record in {path}")
+            yield payload
+
+
+def _guess_format(path: str) -> str:
+    return 'pb' if path.endswith('.pb') else 'ndjson'
+
+
+def iter_dataset(path: str, kind: str, fmt: str = None) -> Iterator[Dict[str, Any]]:
+    """Lazily yield the records of a dataset file as generator-style dicts"""
+    fmt = fmt or _guess_format(path)
+    if fmt == 'ndjson':
+        with open(path, 'r', encoding='utf-8') as file:
+            for line in file:
+                if not line.strip():
+                    continue
+                record = json.loads(line)
+                if kind == 'subs':
+                    record = {field: tuple(op_val) for field, op_val in record.items()}
+                yield record
+        return
+
+    for payload in _iter_raw(path):
+        if kind == 'pubs':
+            pub_msg = pb.Publication()
+            pub_msg.ParseFromString(payload)
+            yield publication_from_proto(pub_msg)
+        elif kind == 'messages':
+            record = pb.ReceivedMessage()
+            record.ParseFromString(payload)
+            yield message_from_proto(record)
+        else:
+            record = pb.SubscriptionRecord()
+            record.ParseFromString(payload)
+            yield subscription_from_proto(record)
+
+
+def iter_serialized_publications(path: str, fmt: str = None) -> Iterator[bytes]:
+    """Yield publications as serialized protobuf bytes, ready for BrokerNetwork.publish"""
+    fmt = fmt or _guess_format(path)
+    if fmt == 'pb':
+        # Already on the wire format, hand the payloads over untouched
+        yield from _iter_raw(path)
+        return
+    for publication in iter_dataset(path, 'pubs', fmt):
+        yield publication_to_proto(publication).SerializeToString()
+
+
+def iter_subscription_conditions(path: str, fmt: str = None) -> Iterator[List[Tuple[str, str, Any]]]:
+    """Yield subscriptions as (field, operator, value) lists, ready for Subscription objects"""
+    for subscription in iter_dataset(path, 'subs', fmt):
+        yield [(field, op_val[0], op_val[1]) for field, op_val in subscription.items()]
@@ -0,0 +1,40 @@
+import heapq
+from typing import Dict, Hashable, List
+
+
+class ExpiryWheel:
+    """Timing wheel of lease deadlines, bucketed into ticks of resolution seconds
+
+    Scheduling and popping cost O(log ticks), independent of how many leases share a
+    tick, and nothing is ever scanned that is not due. Renewals don't touch the wheel:
+    whoever pops a key re-checks its current deadline and reschedules it if it moved.
+    """
+
+    def __init__(self, resolution: float = 0.1):
+        self.resolution = resolution
+        self.buckets: Dict[int, List[Hashable]] = {}
+        self.ticks: List[int] = []
+        self.pending = 0
+
+    def schedule(self, key: Hashable, deadline: float):
+        """Make key due once the tick holding deadline (monotonic seconds) has passed"""
+        tick = int(deadline / self.resolution) + 1
+        bucket = self.buckets.get(tick)
+        if bucket is None:
+            bucket = self.buckets[tick] = []
+            heapq.heappush(self.ticks, tick)
+        bucket.append(key)
+        self.pending += 1
+
+    @property
+    def next_due(self) -> float:
+        """Earliest time at which pop_due can return something (infinity if nothing is scheduled)"""
+        return self.ticks[0] * self.resolution if self.ticks else float('inf')
+
+    def pop_due(self, now: float) -> List[Hashable]:
+        """Remove and return every key whose tick has passed"""
+        due = []
+        while self.ticks and self.ticks[0] * self.resolution <= now:
+            due.extend(self.buckets.pop(heapq.heappop(self.ticks)))
+        self.pending -= len(due)
+        return due
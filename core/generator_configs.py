@@ -2,7 +2,7 @@ import json
 import traceback
 import os
 import random
-from typing import Dict, List, Any
+from typing import Dict, List, Any, Optional
 
 from .utils import (
     generate_field_freq,
@@ -21,6 +21,7 @@ class Configs:
 
         self.threads: List[int] = [1]
         self.results = 'results'
+        self.seed: Optional[int] = None
 
         self.schema: List[Dict[Any]] = {}
         self.fields: List[str] = []
@@ -39,6 +40,9 @@ class Configs:
                 for key, value in content.items():
                     if hasattr(self, key):
                         setattr(self, key, value)
+                    elif key == 'freq_eq':
+                        # Short key used by the config files for freq_equality
+                        self.freq_equality = value
 
                     if key == 'schema':
                         if not validate_schema(self.schema):
@@ -1,3 +1,4 @@
+import heapq
 import random
 import threading
 import time
@@ -5,9 +6,11 @@ import json
 import traceback
 import os
 
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime, timedelta
 from math import ceil
 
+from .dataset_io import DatasetWriter, dataset_path
 from .generator_configs import Configs
 from .utils import create_dir
 
@@ -61,38 +64,48 @@ class GeneratorPubSub:
             'duration': end_time - start_time
         }
 
-    def generate_subs(self, nr_subs, result, index, thread_num, timing):
+    def generate_subs(self, nr_subs, result, index, thread_num, timing, quotas=None):
         """Generate a specified number of subscriptions in a separate thread"""
         start_time = time.time()
         subs = [{} for _ in range(nr_subs)]
+        schema_by_name = {item['name']: item for item in self.configs.schema}
+        not_eq_ops = [op for op in self.operators if op != "="]
+
+        # Min-heap of (conditions, slot index): always fill the emptiest subscription,
+        # lowest index first on ties, without rescanning every slot per field
+        heap = [(0, j) for j in range(nr_subs)]
 
         for field, freq in self.configs.freq_fields.items():
-            nr_field = int(nr_subs * freq)
+            if quotas is not None:
+                nr_field, nr_equality = quotas.get(field, (0, 0))
+            else:
+                nr_field = int(nr_subs * freq)
+
+                fractional_part = nr_subs * freq - nr_field
+                number_threads = int(fractional_part * thread_num)
 
-            fractional_part = nr_subs * freq - nr_field
-            number_threads = int(fractional_part * thread_num)
+                if number_threads > 0:
+                    if index < number_threads:
+                        nr_field += 1
+                nr_equality = int(ceil(nr_field * self.configs.freq_equality[field])) \
+                    if field in self.configs.freq_equality else 0
 
-            if number_threads > 0:
-                if index < number_threads:
-                    nr_field += 1
+            field_schema = schema_by_name.get(field)
             for i in range(nr_field):
                 if field in self.configs.freq_equality:
-                    nr_equality = int(
-                        ceil(nr_field * self.configs.freq_equality[field]))
                     if i < nr_equality:
                         operator = "="
                     else:
-                        not_eq_ops = [op for op in self.operators if op != "="]
                         operator_index = i % len(not_eq_ops)
                         operator = not_eq_ops[operator_index]
                 else:
                     operator_index = i % len(self.operators)
                     operator = self.operators[operator_index]
 
-                valoare = self.generate_random_value(
-                    next((item for item in self.configs.schema if item['name'] == field), None))
-                target_idx = min(range(nr_subs), key=lambda j: len(subs[j]))
+                valoare = self.generate_random_value(field_schema)
+                _, target_idx = heap[0]
                 subs[target_idx][field] = (operator, valoare)
+                heapq.heapreplace(heap, (len(subs[target_idx]), target_idx))
 
         result[index] = subs
         end_time = time.time()
@@ -102,6 +115,24 @@ class GeneratorPubSub:
             'duration': end_time - start_time
         }
 
+    def split_quotas(self, subs_per_worker):
+        """Split the exact per-field and equality counts of the whole dataset across workers"""
+        nr_subs = sum(subs_per_worker)
+        quotas = [{} for _ in subs_per_worker]
+
+        for field, freq in self.configs.freq_fields.items():
+            nr_field = min(int(nr_subs * freq), nr_subs)
+            field_counts = _largest_remainder(nr_field, subs_per_worker)
+
+            nr_equality = 0
+            if field in self.configs.freq_equality:
+                nr_equality = int(ceil(nr_field * self.configs.freq_equality[field]))
+            eq_counts = _largest_remainder(min(nr_equality, nr_field), field_counts)
+
+            for i, quota in enumerate(quotas):
+                quota[field] = (field_counts[i], eq_counts[i])
+        return quotas
+
     def generate_single_sub(self) -> list[tuple]:
         """Generate a single subscription list of tuples without threading"""
         sub = []
@@ -163,7 +194,7 @@ class GeneratorPubSub:
         print(f"Generated window subscription with {len(sub)} conditions {sub}")
         return sub
 
-    def generate_dataset(self, thread_num=1):
+    def generate_dataset(self, thread_num=1, use_processes=False, seed=None):
         """Generate the dataset of publications and subscriptions"""
         start_time = time.time()
         sum_freqs = sum(self.configs.freq_fields.values())
@@ -194,29 +225,51 @@ class GeneratorPubSub:
 
             pubs_results = [None] * thread_num
             subs_results = [None] * thread_num
-
-            threads = []
-
-            for i in range(thread_num):
-                if pubs_per_worker[i] > 0:
-                    thread = threading.Thread(
-                        target=self.generate_pubs,
-                        args=(pubs_per_worker[i], pubs_results, i, timing)
-                    )
-                    threads.append(thread)
-                    thread.start()
-
-            for i in range(thread_num):
-                if subs_per_worker[i] > 0:
-                    thread = threading.Thread(
-                        target=self.generate_subs,
-                        args=(subs_per_worker[i], subs_results, i, thread_num, timing)
-                    )
-                    threads.append(thread)
-                    thread.start()
-
-            for thread in threads:
-                thread.join()
+            quotas = self.split_quotas(subs_per_worker)
+
+            if use_processes:
+                # Threads only interleave on the GIL, so each worker gets its own
+                # process and its own seed derived from the base seed of the run
+                if seed is None:
+                    seed = self.configs.seed
+                if seed is None:
+                    seed = random.randrange(2 ** 32)
+
+                with ProcessPoolExecutor(max_workers=thread_num) as executor:
+                    futures = [
+                        executor.submit(
+                            _generate_worker, self.configs, pubs_per_worker[i],
+                            subs_per_worker[i], i, thread_num, quotas[i], seed + i)
+                        for i in range(thread_num)
+                    ]
+                    for future in futures:
+                        index, worker_pubs, worker_subs, worker_timing = future.result()
+                        pubs_results[index] = worker_pubs
+                        subs_results[index] = worker_subs
+                        timing.update(worker_timing)
+            else:
+                threads = []
+
+                for i in range(thread_num):
+                    if pubs_per_worker[i] > 0:
+                        thread = threading.Thread(
+                            target=self.generate_pubs,
+                            args=(pubs_per_worker[i], pubs_results, i, timing)
+                        )
+                        threads.append(thread)
+                        thread.start()
+
+                for i in range(thread_num):
+                    if subs_per_worker[i] > 0:
+                        thread = threading.Thread(
+                            target=self.generate_subs,
+                            args=(subs_per_worker[i], subs_results, i, thread_num, timing, quotas[i])
+                        )
+                        threads.append(thread)
+                        thread.start()
+
+                for thread in threads:
+                    thread.join()
 
             for res in pubs_results:
                 if res is not None:
@@ -230,25 +283,31 @@ class GeneratorPubSub:
 
         return pubs, subs, sum_freqs, start_time, end_time, timing
 
-    def dump_data(self, pubs, subs, stats, dump_path):
+    def dump_data(self, pubs, subs, stats, dump_path, fmt='json'):
         """Dump the generated publications, subscriptions, and stats to JSON files"""
-        with open(os.path.join(dump_path, "pubs.json"), "w", encoding="utf-8") as f:
-            json.dump(pubs, f, indent=2)
+        if fmt == 'json':
+            with open(os.path.join(dump_path, "pubs.json"), "w", encoding="utf-8") as f:
+                json.dump(pubs, f, indent=2)
+
+            with open(os.path.join(dump_path, "subs.json"), "w", encoding="utf-8") as f:
+                json.dump(subs, f, indent=2)
+        else:
+            with DatasetWriter(dataset_path(dump_path, 'pubs', fmt), 'pubs', fmt) as writer:
+                writer.write_many(pubs)
 
-        with open(os.path.join(dump_path, "subs.json"), "w", encoding="utf-8") as f:
-            json.dump(subs, f, indent=2)
+            with DatasetWriter(dataset_path(dump_path, 'subs', fmt), 'subs', fmt) as writer:
+                writer.write_many(subs)
 
         with open(os.path.join(dump_path, "stats.json"), "w", encoding="utf-8") as f:
             json.dump(stats, f, indent=2)
 
-    def generate(self, iteration, thread_num):
-        """Generate the dataset for a specific iteration and thread number"""
-        pubs, subs, sum_freqs, start_time, end_time, timing = self.generate_dataset(
-            thread_num)
-
+    def build_stats(self, thread_num, mode, sum_freqs, start_time, end_time, timing,
+                    nr_subs, field_counts, eq_counts):
+        """Build the stats document from per-field and equality counts"""
         stats = {
             "configs": {
                 "thread_num": thread_num,
+                "mode": mode,
                 "pubs": self.configs.pubs,
                 "subs": self.configs.subs,
                 "freq_fields": self.configs.freq_fields,
@@ -268,26 +327,120 @@ class GeneratorPubSub:
         }
 
         for field in self.configs.fields:
-            count = sum(1 for sub in subs if sub and field in sub)
+            count = field_counts.get(field, 0)
 
             stats['sub_stats']['freq_fields'][field] = {
                 "count": count,
-                "percentage": count / len(subs),
+                "percentage": count / nr_subs if nr_subs else 0,
                 "expected": self.configs.subs * self.configs.freq_fields[field] \
                     if field in self.configs.freq_fields else 0
             }
 
         for field in self.configs.fields:
-            field_count = sum(1 for sub in subs if sub and field in sub)
+            field_count = field_counts.get(field, 0)
             if field_count > 0:
-                eq_count = sum(
-                    1 for sub in subs if sub and field in sub and sub[field][0] == "=")
+                eq_count = eq_counts.get(field, 0)
                 stats['sub_stats']['freq_eq'][field] = {
                     "eq_count": eq_count,
                     "field_count": field_count,
                     "percentage": eq_count / field_count
                 }
+        return stats
+
+    def generate(self, iteration, thread_num, use_processes=False, seed=None, fmt='json'):
+        """Generate the dataset for a specific iteration and thread number"""
+        pubs, subs, sum_freqs, start_time, end_time, timing = self.generate_dataset(
+            thread_num, use_processes, seed)
+
+        field_counts, eq_counts = {}, {}
+        _count_sub_fields(subs, field_counts, eq_counts)
+        stats = self.build_stats(
+            thread_num, "processes" if use_processes else "threads", sum_freqs,
+            start_time, end_time, timing, len(subs), field_counts, eq_counts)
+
         dump_path = os.path.join(self.configs.results, str(iteration), str(thread_num))
         create_dir(dump_path)
-        self.dump_data(pubs, subs, stats, dump_path)
+        self.dump_data(pubs, subs, stats, dump_path, fmt)
         return pubs, subs, stats
+
+    def generate_stream(self, iteration, fmt='ndjson', chunk_size=10000):
+        """Generate the dataset straight to disk, keeping at most one chunk of subscriptions in memory"""
+        start_time = time.time()
+        sum_freqs = sum(self.configs.freq_fields.values())
+        timing = {}
+        dump_path = os.path.join(self.configs.results, str(iteration), 'stream')
+        create_dir(dump_path)
+
+        with DatasetWriter(dataset_path(dump_path, 'pubs', fmt), 'pubs', fmt) as writer:
+            for _ in range(self.configs.pubs):
+                writer.write(self.generate_pub())
+
+        # Chunks are balanced like workers, so the exact dataset-wide quotas still hold
+        nr_chunks = max(1, ceil(self.configs.subs / chunk_size))
+        subs_per_chunk = [
+            self.configs.subs // nr_chunks + (1 if i < self.configs.subs % nr_chunks else 0)
+            for i in range(nr_chunks)]
+        quotas = self.split_quotas(subs_per_chunk)
+
+        field_counts, eq_counts = {}, {}
+        with DatasetWriter(dataset_path(dump_path, 'subs', fmt), 'subs', fmt) as writer:
+            result = [None]
+            for i, nr_subs in enumerate(subs_per_chunk):
+                self.generate_subs(nr_subs, result, 0, 1, {}, quotas[i])
+                _count_sub_fields(result[0], field_counts, eq_counts)
+                writer.write_many(result[0])
+                result[0] = None
+
+        end_time = time.time()
+        timing['stream'] = {
+            'start': start_time,
+            'end': end_time,
+            'duration': end_time - start_time
+        }
+        stats = self.build_stats(
+            1, f"stream_{fmt}", sum_freqs, start_time, end_time, timing,
+            self.configs.subs, field_counts, eq_counts)
+        with open(os.path.join(dump_path, "stats.json"), "w", encoding="utf-8") as f:
+            json.dump(stats, f, indent=2)
+        return dump_path, stats
+
+
+def _count_sub_fields(subs, field_counts, eq_counts):
+    """Accumulate how many subscriptions use each field, and how many with '='"""
+    for sub in subs:
+        if not sub:
+            continue
+        for field, (operator, _) in sub.items():
+            field_counts[field] = field_counts.get(field, 0) + 1
+            if operator == "=":
+                eq_counts[field] = eq_counts.get(field, 0) + 1
+
+def _largest_remainder(total, weights):
+    """Split an integer total proportionally to the weights, keeping the exact sum"""
+    weight_sum = sum(weights)
+    if weight_sum == 0:
+        return [0] * len(weights)
+
+    shares = [total * weight / weight_sum for weight in weights]
+    counts = [int(share) for share in shares]
+    remaining = total - sum(counts)
+    by_remainder = sorted(range(len(weights)), key=lambda i: counts[i] - shares[i])
+    for i in by_remainder[:remaining]:
+        counts[i] += 1
+    return counts
+
+
+def _generate_worker(configs, nr_pubs, nr_subs, index, worker_num, quotas, seed):
+    """Generate one worker's share of the dataset inside a process pool"""
+    random.seed(seed)
+    generator = GeneratorPubSub(configs)
+    timing = {}
+    pubs_result = [None] * worker_num
+    subs_result = [None] * worker_num
+
+    if nr_pubs > 0:
+        generator.generate_pubs(nr_pubs, pubs_result, index, timing)
+    if nr_subs > 0:
+        generator.generate_subs(nr_subs, subs_result, index, worker_num, timing, quotas)
+
+    return index, pubs_result[index], subs_result[index], timing
@@ -0,0 +1,44 @@
+import bisect
+import hashlib
+from typing import Dict, List
+
+
+def _hash(key) -> int:
+    return int.from_bytes(hashlib.md5(str(key).encode()).digest()[:8], 'big')
+
+
+class HashRing:
+    """Consistent-hash ring of node ids, each placed at replicas points
+
+    Adding or removing a node only changes the owner of the keys on the arcs it gains
+    or loses, about 1/n of them, instead of reshuffling everything.
+    """
+
+    def __init__(self, nodes: List[str] = (), replicas: int = 100):
+        self.replicas = replicas
+        self.points: List[int] = []
+        self.owners: Dict[int, str] = {}
+        for node in nodes:
+            self.add(node)
+
+    def add(self, node: str):
+        for replica in range(self.replicas):
+            point = _hash(f"{node}#{replica}")
+            if point not in self.owners:
+                bisect.insort(self.points, point)
+                self.owners[point] = node
+
+    def remove(self, node: str):
+        kept = [point for point in self.points if self.owners[point] != node]
+        for point in self.points:
+            if self.owners[point] == node:
+                del self.owners[point]
+        self.points = kept
+
+    def node_for(self, key) -> str:
+        """Node owning key: the first point clockwise from the key's hash"""
+        index = bisect.bisect(self.points, _hash(key))
+        return self.owners[self.points[index % len(self.points)]]
+
+    def __len__(self):
+        return len(set(self.owners.values()))
@@ -0,0 +1,108 @@
+import sys
+from bisect import bisect_left
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Iterable, Tuple
+
+from .records import MISSING
+
+# Projection of a value no equality-only field's condition mentions
+OTHER = object()
+EQUALITY_OPERATORS = ('=', '!=')
+
+
+class MatchCache:
+    """LRU cache from a quantized publication to the simple predicates it matches
+
+    Each field a condition looks at is quantized to the cell its value falls in among
+    that field's condition thresholds (or, if the field is only compared with = and !=,
+    to the value itself when some condition names it). Publications landing in the same
+    cells on every field match exactly the same predicates, so one evaluation pass serves
+    them all. The owner calls invalidate() whenever the set of predicates changes.
+    """
+
+    def __init__(self, max_entries: int = 4096, schema=None):
+        self.max_entries = max_entries
+        self.schema = schema
+        self.entries: OrderedDict = OrderedDict()
+        # field -> {threshold: number of predicates using it}, and range conditions per field
+        self.thresholds: Dict[str, Dict[Any, int]] = {}
+        self.range_refs: Dict[str, int] = {}
+        self.layout: Tuple = ()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def reference(self, conditions: Iterable[Tuple[str, str, Any]], count: int = 1):
+        """Track the conditions of a predicate that was added (count=1) or removed (count=-1)"""
+        for field, operator, value in conditions:
+            values = self.thresholds.setdefault(field, {})
+            refs = values.get(value, 0) + count
+            if refs:
+                values[value] = refs
+            else:
+                del values[value]
+                if not values:
+                    del self.thresholds[field]
+            if operator not in EQUALITY_OPERATORS:
+                refs = self.range_refs.get(field, 0) + count
+                if refs:
+                    self.range_refs[field] = refs
+                else:
+                    del self.range_refs[field]
+
+    def invalidate(self):
+        """Drop every cached result and rebuild the quantization from the current thresholds"""
+        self.entries.clear()
+        # Fields outside the schema are missing from every publication: nothing to key on
+        self.layout = tuple(
+            (self.schema.field_ids[field], sorted(values), frozenset(values), field not in self.range_refs)
+            for field, values in sorted(self.thresholds.items()) if field in self.schema.field_ids
+        )
+        self.invalidations += 1
+
+    def key(self, publication) -> Tuple:
+        """Quantized form of a PublicationRecord"""
+        record_values = publication.values
+        parts = []
+        for field_id, bounds, values, equality_only in self.layout:
+            value = record_values[field_id]
+            if value is MISSING:
+                parts.append(MISSING)
+            elif equality_only:
+                parts.append(value if value in values else OTHER)
+            else:
+                # Cell between two thresholds, or the threshold itself
+                parts.append(bisect_left(bounds, value) * 2 + (value in values))
+        return tuple(parts)
+
+    def get(self, key: Hashable):
+        value = self.entries.get(key)
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self.entries.move_to_end(key)
+        return value
+
+    def put(self, key: Hashable, value):
+        self.entries[key] = value
+        if len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def memory_bytes(self) -> int:
+        """Approximate footprint of the cached keys and result lists"""
+        size = sys.getsizeof(self.entries)
+        for key, value in self.entries.items():
+            size += sys.getsizeof(key) + sys.getsizeof(value)
+        return size
+
+    def get_stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            'match_cache_entries': len(self.entries),
+            'match_cache_hits': self.hits,
+            'match_cache_misses': self.misses,
+            'match_cache_hit_rate': self.hits / lookups if lookups else 0.0,
+            'match_cache_bytes': self.memory_bytes(),
+            'match_cache_invalidations': self.invalidations,
+        }
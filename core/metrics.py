@@ -0,0 +1,274 @@
+import csv
+import os
+import threading
+import time
+from datetime import datetime
+from typing import Any, Dict, List, Tuple
+
+# Log-linear buckets: every power of two is split into SUB_BUCKETS equal slices,
+# so a recorded value is off by at most 1/SUB_BUCKETS (~3%) whatever its magnitude
+SUB_BUCKET_BITS = 5
+SUB_BUCKETS = 1 << SUB_BUCKET_BITS
+MAX_VALUE_BITS = 63
+BUCKET_COUNT = (MAX_VALUE_BITS - SUB_BUCKET_BITS) * SUB_BUCKETS + 2 * SUB_BUCKETS
+SNAPSHOT_QUANTILES = (0.5, 0.99, 0.999)
+
+
+def _bucket_index(value: int) -> int:
+    if value < 2 * SUB_BUCKETS:
+        return value
+    shift = value.bit_length() - SUB_BUCKET_BITS - 1
+    return shift * SUB_BUCKETS + (value >> shift)
+
+
+def _bucket_upper_bound(index: int) -> int:
+    if index < 2 * SUB_BUCKETS:
+        return index
+    shift = index // SUB_BUCKETS - 1
+    mantissa = index - shift * SUB_BUCKETS
+    return ((mantissa + 1) << shift) - 1
+
+
+class Counter:
+    """Monotonically increasing count"""
+
+    def __init__(self, name: str, labels: Dict[str, str]):
+        self.name = name
+        self.labels = labels
+        self.value = 0
+        self.lock = threading.Lock()
+
+    def inc(self, amount: int = 1):
+        with self.lock:
+            self.value += amount
+
+
+class Histogram:
+    """Constant-memory HDR-style histogram of non-negative integer samples
+
+    Samples are recorded as integers (nanoseconds for latencies) and reported
+    multiplied by scale (1e-9 turns nanoseconds into seconds).
+    """
+
+    def __init__(self, name: str, labels: Dict[str, str], scale: float = 1e-9):
+        self.name = name
+        self.labels = labels
+        self.scale = scale
+        self.counts = [0] * BUCKET_COUNT
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = 0
+        self.lock = threading.Lock()
+
+    def record(self, value: int, count: int = 1):
+        """Record a sample (count times, e.g. a batch's per-item average); negative values are clamped to zero"""
+        value = int(value) if value > 0 else 0
+        with self.lock:
+            self.counts[_bucket_index(value)] += count
+            self.count += count
+            self.total += value * count
+            if self.min is None or value < self.min:
+                self.min = value
+            if value > self.max:
+                self.max = value
+
+    def merge(self, other: 'Histogram'):
+        """Add every sample of another histogram into this one"""
+        with self.lock:
+            for index, bucket_count in enumerate(other.counts):
+                if bucket_count:
+                    self.counts[index] += bucket_count
+            self.count += other.count
+            self.total += other.total
+            if other.min is not None and (self.min is None or other.min < self.min):
+                self.min = other.min
+            self.max = max(self.max, other.max)
+
+    def reset(self):
+        """Drop every recorded sample, e.g. between the steps of a load ramp"""
+        with self.lock:
+            self.counts = [0] * BUCKET_COUNT
+            self.count = 0
+            self.total = 0
+            self.min = None
+            self.max = 0
+
+    def percentile(self, quantile: float) -> float:
+        """Return the (scaled) value below which the given fraction of samples fall"""
+        if self.count == 0:
+            return 0.0
+        target = max(1, int(round(quantile * self.count)))
+        seen = 0
+        for index, bucket_count in enumerate(self.counts):
+            seen += bucket_count
+            if seen >= target:
+                return min(_bucket_upper_bound(index), self.max) * self.scale
+        return self.max * self.scale
+
+    def mean(self) -> float:
+        return self.total / self.count * self.scale if self.count else 0.0
+
+    def summary(self) -> Dict[str, Any]:
+        """Count, mean, max and the snapshot quantiles, all scaled"""
+        return {
+            'count': self.count,
+            'mean': self.mean(),
+            'max': self.max * self.scale,
+            'p50': self.percentile(0.5),
+            'p99': self.percentile(0.99),
+            'p999': self.percentile(0.999),
+        }
+
+
+def _format_labels(labels: Dict[str, str], extra: Dict[str, str] = None) -> str:
+    merged = dict(labels)
+    if extra:
+        merged.update(extra)
+    if not merged:
+        return ''
+    return '{' + ','.join(f'{key}="{value}"' for key, value in sorted(merged.items())) + '}'
+
+
+class MetricsRegistry:
+    """Get-or-create store of counters and histograms, keyed by name and labels"""
+
+    def __init__(self):
+        self.counters: Dict[Tuple, Counter] = {}
+        self.histograms: Dict[Tuple, Histogram] = {}
+        self.lock = threading.Lock()
+
+    def counter(self, name: str, **labels) -> Counter:
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            if key not in self.counters:
+                self.counters[key] = Counter(name, labels)
+            return self.counters[key]
+
+    def histogram(self, name: str, scale: float = 1e-9, **labels) -> Histogram:
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            if key not in self.histograms:
+                self.histograms[key] = Histogram(name, labels, scale)
+            return self.histograms[key]
+
+    def find_histograms(self, name: str, **labels) -> List[Histogram]:
+        """Return every histogram with this name whose labels include the given ones"""
+        with self.lock:
+            return [
+                histogram for histogram in self.histograms.values()
+                if histogram.name == name
+                and all(histogram.labels.get(key) == value for key, value in labels.items())
+            ]
+
+    def merged_histogram(self, name: str, **labels) -> Histogram:
+        """Merge every matching histogram into a single one, e.g. across subscribers"""
+        merged = None
+        for histogram in self.find_histograms(name, **labels):
+            if merged is None:
+                merged = Histogram(name, labels, histogram.scale)
+            merged.merge(histogram)
+        return merged or Histogram(name, labels)
+
+    def reset_histograms(self, name: str, **labels):
+        """Reset every histogram with this name whose labels include the given ones"""
+        for histogram in self.find_histograms(name, **labels):
+            histogram.reset()
+
+    def to_prometheus(self) -> str:
+        """Render every metric in the Prometheus text exposition format"""
+        lines = []
+        with self.lock:
+            counters = sorted(self.counters.values(), key=lambda metric: metric.name)
+            histograms = sorted(self.histograms.values(), key=lambda metric: metric.name)
+
+        declared = set()
+        for counter in counters:
+            if counter.name not in declared:
+                lines.append(f"# TYPE {counter.name} counter")
+                declared.add(counter.name)
+            lines.append(f"{counter.name}{_format_labels(counter.labels)} {counter.value}")
+
+        for histogram in histograms:
+            if histogram.name not in declared:
+                lines.append(f"# TYPE {histogram.name} summary")
+                declared.add(histogram.name)
+            for quantile in SNAPSHOT_QUANTILES:
+                labels = _format_labels(histogram.labels, {'quantile': str(quantile)})
+                lines.append(f"{histogram.name}{labels} {histogram.percentile(quantile):.9g}")
+            labels = _format_labels(histogram.labels)
+            lines.append(f"{histogram.name}_sum{labels} {histogram.total * histogram.scale:.9g}")
+            lines.append(f"{histogram.name}_count{labels} {histogram.count}")
+        return '\n'.join(lines) + '\n'
+
+    def dump_prometheus(self, path: str):
+        with open(path, 'w') as file:
+            file.write(self.to_prometheus())
+
+    def snapshot(self) -> List[Dict[str, Any]]:
+        """Return one flat row per metric, suitable for CSV"""
+        rows = []
+        timestamp = datetime.now().isoformat()
+        with self.lock:
+            counters = list(self.counters.values())
+            histograms = list(self.histograms.values())
+        for counter in counters:
+            rows.append({
+                'timestamp': timestamp, 'metric': counter.name, 'type': 'counter',
+                'labels': _format_labels(counter.labels), 'count': counter.value,
+            })
+        for histogram in histograms:
+            row = {
+                'timestamp': timestamp, 'metric': histogram.name, 'type': 'histogram',
+                'labels': _format_labels(histogram.labels),
+            }
+            row.update(histogram.summary())
+            rows.append(row)
+        return rows
+
+
+SNAPSHOT_FIELDS = ['timestamp', 'metric', 'type', 'labels', 'count', 'mean', 'max', 'p50', 'p99', 'p999']
+
+
+class CsvSnapshotter:
+    """Append a snapshot of a registry to a CSV file every interval seconds"""
+
+    def __init__(self, registry: MetricsRegistry, path: str, interval: float = 10.0):
+        self.registry = registry
+        self.path = path
+        self.interval = interval
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def write_snapshot(self):
+        new_file = not os.path.exists(self.path)
+        with open(self.path, 'a', newline='') as csvfile:
+            writer = csv.DictWriter(csvfile, fieldnames=SNAPSHOT_FIELDS)
+            if new_file:
+                writer.writeheader()
+            writer.writerows(self.registry.snapshot())
+
+    def _run(self):
+        while not self.stop_event.wait(self.interval):
+            self.write_snapshot()
+
+    def start(self):
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """Stop the periodic snapshots and write a final one"""
+        self.stop_event.set()
+        if self.thread:
+            self.thread.join()
+        self.write_snapshot()
+
+
+# Registry used by components that are not given one explicitly
+REGISTRY = MetricsRegistry()
+
+
+def now_ns() -> int:
+    """Monotonic timestamp used for every stage measurement and for send times"""
+    return time.monotonic_ns()
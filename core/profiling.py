@@ -0,0 +1,63 @@
+import json
+from typing import Any, Dict, List
+
+PROFILE_SORT_KEYS = ('eval_ns', 'attempts', 'matches', 'window_ns', 'avg_eval_ns')
+
+
+class SubscriptionProfile:
+    """Cost counters of one subscription over the sampled publications"""
+    __slots__ = ('attempts', 'matches', 'eval_ns', 'window_ns', 'window_runs')
+
+    def __init__(self):
+        self.attempts = 0
+        self.matches = 0
+        self.eval_ns = 0
+        self.window_ns = 0
+        self.window_runs = 0
+
+
+def build_profile_report(broker_id: str, sampled_publications: int, subscriptions: Dict[str, Any],
+                         profiles: Dict[str, SubscriptionProfile], top_n: int = 20,
+                         sort_by: str = 'eval_ns') -> Dict[str, Any]:
+    """Rank subscriptions by cost and return the top_n of them"""
+    if sort_by not in PROFILE_SORT_KEYS:
+        raise ValueError(f"Unknown sort key '{sort_by}', expected one of {PROFILE_SORT_KEYS}")
+
+    rows: List[Dict[str, Any]] = []
+    total_eval_ns = 0
+    for sub_id, profile in profiles.items():
+        subscription = subscriptions.get(sub_id)
+        if subscription is None:
+            continue
+        total_eval_ns += profile.eval_ns
+        rows.append({
+            'subscription_id': sub_id,
+            'subscriber_id': subscription.subscriber_id,
+            'kind': 'simple' if subscription.window_size is None else 'window',
+            'conditions': [f"{field} {operator} {value}" for field, operator, value in subscription.conditions],
+            'attempts': profile.attempts,
+            'matches': profile.matches,
+            'pass_rate': profile.matches / profile.attempts if profile.attempts else 0.0,
+            'eval_ns': profile.eval_ns,
+            'avg_eval_ns': profile.eval_ns / profile.attempts if profile.attempts else 0.0,
+            'window_ns': profile.window_ns,
+            'window_runs': profile.window_runs,
+        })
+
+    rows.sort(key=lambda row: row[sort_by], reverse=True)
+    for row in rows:
+        row['share_of_eval'] = row['eval_ns'] / total_eval_ns if total_eval_ns else 0.0
+
+    return {
+        'broker_id': broker_id,
+        'sampled_publications': sampled_publications,
+        'profiled_subscriptions': len(rows),
+        'total_eval_ns': total_eval_ns,
+        'sort_by': sort_by,
+        'top': rows[:top_n],
+    }
+
+
+def dump_profile_report(report: Dict[str, Any], path: str):
+    with open(path, 'w') as file:
+        json.dump(report, file, indent=2, default=str)
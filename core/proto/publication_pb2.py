@@ -24,13 +24,27 @@ _sym_db = _symbol_database.Default()
 
 
 
-DESCRIPTOR = _descriptor_pool.Default().AddSerializedFile(b'\n\x11publication.proto\x12\x06pubsub\"\x9a\x01\n\x0bPublication\x12\x12\n\nstation_id\x18\x01 \x01(\x05\x12\x0c\n\x04\x63ity\x18\x02 \x01(\t\x12\x11\n\tdirection\x18\x03 \x01(\t\x12\x13\n\x0btemperature\x18\x04 \x01(\x02\x12\x0c\n\x04rain\x18\x05 \x01(\x02\x12\x0c\n\x04wind\x18\x06 \x01(\x02\x12\x12\n\ncreated_at\x18\x07 \x01(\t\x12\x11\n\ttimestamp\x18\x08 \x01(\tb\x06proto3')
+DESCRIPTOR = _descriptor_pool.Default().AddSerializedFile(b'\n\x11publication.proto\x12\x06pubsub\"\xc9\x01\n\x0bPublication\x12\x12\n\nstation_id\x18\x01 \x01(\x05\x12\x0c\n\x04\x63ity\x18\x02 \x01(\t\x12\x11\n\tdirection\x18\x03 \x01(\t\x12\x13\n\x0btemperature\x18\x04 \x01(\x02\x12\x0c\n\x04rain\x18\x05 \x01(\x02\x12\x0c\n\x04wind\x18\x06 \x01(\x02\x12\x12\n\ncreated_at\x18\x07 \x01(\t\x12\x11\n\ttimestamp\x18\x08 \x01(\t\x12\x12\n\nsent_at_ns\x18\t \x01(\x03\x12\x19\n\x04hops\x18\n \x03(\x0b\x32\x0b.pubsub.Hop\"T\n\x03Hop\x12\x0f\n\x07node_id\x18\x01 \x01(\t\x12\x13\n\x0breceived_ns\x18\x02 \x01(\x03\x12\x13\n\x0b\x64\x65queued_ns\x18\x03 \x01(\x03\x12\x12\n\ndecoded_ns\x18\x04 \x01(\x03\"y\n\tCondition\x12\r\n\x05\x66ield\x18\x01 \x01(\t\x12\x10\n\x08operator\x18\x02 \x01(\t\x12\x13\n\tint_value\x18\x03 \x01(\x12H\x00\x12\x15\n\x0b\x66loat_value\x18\x04 \x01(\x01H\x00\x12\x16\n\x0cstring_value\x18\x05 \x01(\tH\x00\x42\x07\n\x05value\"\x86\x01\n\x12SubscriptionRecord\x12%\n\nconditions\x18\x01 \x03(\x0b\x32\x11.pubsub.Condition\x12\x15\n\rsubscriber_id\x18\x03 \x01(\t\x12\x13\n\x0bwindow_size\x18\x04 \x01(\r\x12\x0b\n\x03ttl\x18\x05 \x01(\x01\x12\n\n\x02id\x18\x06 \x01(\x04J\x04\x08\x02\x10\x03\"\xb3\x01\n\x0fMetaPublication\x12\n\n\x02id\x18\x01 \x01(\t\x12\x11\n\ttimestamp\x18\x02 \x01(\x03\x12H\n\x11\x61ggregated_fields\x18\x03 \x03(\x0b\x32-.pubsub.MetaPublication.AggregatedFieldsEntry\x1a\x37\n\x15\x41ggregatedFieldsEntry\x12\x0b\n\x03key\x18\x01 \x01(\t\x12\r\n\x05value\x18\x02 \x01(\x01:\x02\x38\x01\"\x81\x01\n\x0fReceivedMessage\x12*\n\x0bpublication\x18\x01 \x01(\x0b\x32\x13.pubsub.PublicationH\x00\x12\'\n\x04meta\x18\x02 \x01(\x0b\x32\x17.pubsub.MetaPublicationH\x00\x12\x11\n\tunique_id\x18\x03 \x01(\tB\x06\n\x04\x62odyb\x06proto3')
 
 _globals = globals()
 _builder.BuildMessageAndEnumDescriptors(DESCRIPTOR, _globals)
 _builder.BuildTopDescriptorsAndMessages(DESCRIPTOR, 'publication_pb2', _globals)
 if not _descriptor._USE_C_DESCRIPTORS:
   DESCRIPTOR._loaded_options = None
+  _globals['_METAPUBLICATION_AGGREGATEDFIELDSENTRY']._loaded_options = None
+  _globals['_METAPUBLICATION_AGGREGATEDFIELDSENTRY']._serialized_options = b'8\001'
   _globals['_PUBLICATION']._serialized_start=30
-  _globals['_PUBLICATION']._serialized_end=184
+  _globals['_PUBLICATION']._serialized_end=231
+  _globals['_HOP']._serialized_start=233
+  _globals['_HOP']._serialized_end=317
+  _globals['_CONDITION']._serialized_start=319
+  _globals['_CONDITION']._serialized_end=440
+  _globals['_SUBSCRIPTIONRECORD']._serialized_start=443
+  _globals['_SUBSCRIPTIONRECORD']._serialized_end=577
+  _globals['_METAPUBLICATION']._serialized_start=580
+  _globals['_METAPUBLICATION']._serialized_end=759
+  _globals['_METAPUBLICATION_AGGREGATEDFIELDSENTRY']._serialized_start=704
+  _globals['_METAPUBLICATION_AGGREGATEDFIELDSENTRY']._serialized_end=759
+  _globals['_RECEIVEDMESSAGE']._serialized_start=762
+  _globals['_RECEIVEDMESSAGE']._serialized_end=891
 # @@protoc_insertion_point(module_scope)
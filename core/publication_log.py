@@ -0,0 +1,137 @@
+import mmap
+import os
+import struct
+import threading
+import time
+from typing import Iterator, Tuple
+
+from .proto import publication_pb2 as pb
+
+SEGMENT_MAGIC = b'PUBLOG1\n'
+# Per record: nanoseconds since the recording started, payload length
+RECORD_HEADER = struct.Struct('<QI')
+REPLAY_MODES = ('original', 'rate', 'max')
+
+
+def _segment_name(index: int) -> str:
+    return f"segment_{index:06d}.log"
+
+
+class PublicationLogWriter:
+    """Append serialized publications to size-capped segment files on disk"""
+
+    def __init__(self, log_dir: str, segment_size: int = 64 * 1024 * 1024):
+        self.log_dir = log_dir
+        self.segment_size = segment_size
+        self.lock = threading.Lock()
+        self.records = 0
+        self.segment_index = -1
+        self.segment_bytes = 0
+        self.file = None
+        self.start_ns = time.monotonic_ns()
+        os.makedirs(log_dir, exist_ok=True)
+        self._open_segment()
+
+    def _open_segment(self):
+        if self.file:
+            self.file.close()
+        self.segment_index += 1
+        self.file = open(os.path.join(self.log_dir, _segment_name(self.segment_index)), 'wb')
+        self.file.write(SEGMENT_MAGIC)
+        self.segment_bytes = len(SEGMENT_MAGIC)
+
+    def append(self, serialized_pub: bytes):
+        """Append one serialized publication, stamped with its offset from the start of the recording"""
+        offset_ns = time.monotonic_ns() - self.start_ns
+        with self.lock:
+            if self.segment_bytes >= self.segment_size:
+                self._open_segment()
+            self.file.write(RECORD_HEADER.pack(offset_ns, len(serialized_pub)))
+            self.file.write(serialized_pub)
+            self.segment_bytes += RECORD_HEADER.size + len(serialized_pub)
+            self.records += 1
+
+    def close(self):
+        """Flush and close the current segment"""
+        with self.lock:
+            if self.file:
+                self.file.close()
+                self.file = None
+
+
+class PublicationLogReader:
+    """Read a recorded publication log through memory-mapped segments"""
+
+    def __init__(self, log_dir: str):
+        self.log_dir = log_dir
+        self.segments = sorted(
+            os.path.join(log_dir, name) for name in os.listdir(log_dir)
+            if name.startswith('segment_') and name.endswith('.log'))
+        if not self.segments:
+            raise FileNotFoundError(f"No publication log segments found in {log_dir}")
+
+    def __iter__(self) -> Iterator[Tuple[int, bytes]]:
+        """Yield (offset_ns, serialized publication) in recording order"""
+        for path in self.segments:
+            with open(path, 'rb') as file:
+                if os.fstat(file.fileno()).st_size <= len(SEGMENT_MAGIC):
+                    continue
+                with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                    if data[:len(SEGMENT_MAGIC)] != SEGMENT_MAGIC:
+                        raise ValueError(f"{path} is not a publication log segment")
+                    position = len(SEGMENT_MAGIC)
+                    end = len(data)
+                    while position + RECORD_HEADER.size <= end:
+                        offset_ns, size = RECORD_HEADER.unpack_from(data, position)
+                        position += RECORD_HEADER.size
+                        if position + size > end:
+                            # Torn write at the tail of the last segment
+                            break
+                        yield offset_ns, data[position:position + size]
+                        position += size
+
+
+def restamp_publication(serialized_pub: bytes) -> bytes:
+    """Give a recorded publication a fresh send time so latencies are measured against this run"""
+    pub_msg = pb.Publication()
+    pub_msg.ParseFromString(serialized_pub)
+    pub_msg.sent_at_ns = time.monotonic_ns()
+    pub_msg.timestamp = ''
+    return pub_msg.SerializeToString()
+
+
+def replay(log_dir: str, sink, mode: str = 'original', rate: float = None, restamp: bool = True) -> dict:
+    """Push a recorded log into a sink (e.g. BrokerNetwork) at original speed, a fixed rate or as fast as possible
+
+    Send times recorded in an earlier process mean nothing on this clock, so by default
+    every publication is restamped on its way out.
+    """
+    if mode not in REPLAY_MODES:
+        raise ValueError(f"Unknown replay mode '{mode}', expected one of {REPLAY_MODES}")
+    if mode == 'rate' and not rate:
+        raise ValueError("Replay mode 'rate' needs a positive rate")
+
+    interval_ns = int(1e9 / rate) if mode == 'rate' else 0
+    sent = 0
+    max_lag_ns = 0
+    start_ns = time.monotonic_ns()
+
+    for offset_ns, serialized_pub in PublicationLogReader(log_dir):
+        if mode != 'max':
+            due_ns = start_ns + (offset_ns if mode == 'original' else sent * interval_ns)
+            wait_ns = due_ns - time.monotonic_ns()
+            if wait_ns > 0:
+                time.sleep(wait_ns / 1e9)
+            else:
+                max_lag_ns = max(max_lag_ns, -wait_ns)
+        sink.publish(restamp_publication(serialized_pub) if restamp else serialized_pub)
+        sent += 1
+
+    duration = (time.monotonic_ns() - start_ns) / 1e9
+    return {
+        'mode': mode,
+        'replayed_publications': sent,
+        'duration_s': duration,
+        'achieved_rate': sent / duration if duration > 0 else 0.0,
+        'max_lag_ms': max_lag_ns / 1e6,
+    }
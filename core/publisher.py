@@ -1,3 +1,5 @@
+import asyncio
+import random
 import time
 import threading
 from typing import Dict, Any
@@ -7,46 +9,149 @@ from core.proto import publication_pb2 as pb
 
 from .generator_pub_sub import GeneratorPubSub
 from .generator_configs import Configs
+from .metrics import MetricsRegistry, REGISTRY, now_ns
+from .publication_log import PublicationLogWriter
+
+ARRIVAL_MODES = ('constant', 'poisson')
+# Partial sink batches are flushed before any idle gap longer than this
+FLUSH_IDLE_NS = 1_000_000
 
 class Publisher:
-    def __init__(self, configs: Configs):
+    def __init__(self, configs: Configs, record_path: str = None, sink=None, sink_batch_size: int = 1,
+                 metrics: MetricsRegistry = None):
         self.configs = configs
         self.generator = GeneratorPubSub(configs)
         self.publication_queue = Queue()
         self.is_running = False
         self.publication_thread = None
         self.threads = []
+        self.task: asyncio.Task = None
         self.generated_publications = 0
+        self.lock = threading.Lock()
+        self.target_rate = None
+        self.arrival = 'constant'
+        self.max_lag_ns = 0
+        self.started_ns = None
+        self.stopped_ns = None
+        self.start_count = 0
+        # Optional on-disk log of everything published, for replay
+        self.recorder = PublicationLogWriter(record_path) if record_path else None
+        # Optional consumer (e.g. BrokerNetwork) fed straight from the generator threads
+        self.sink = sink
+        self.sink_batch_size = sink_batch_size
+        self.pending = []
+        self.metrics = metrics or REGISTRY
+        self.publish_hist = self.metrics.histogram('pubsub_stage_seconds', stage='publish')
+        self.published_counter = self.metrics.counter('pubsub_publications_total')
+
+    def _emit(self, serialized_pub: bytes):
+        """Hand a serialized publication over to the sink or the queue (and the recording, if any)"""
+        batch = None
+        # One lock keeps the count exact and the log in the exact order publications are sent:
+        # while recording, the sink is fed under it too
+        with self.lock:
+            self.generated_publications += 1
+            if self.recorder:
+                self.recorder.append(serialized_pub)
+            if self.sink is None:
+                self.publication_queue.put(serialized_pub)
+                return
+            if self.sink_batch_size > 1:
+                self.pending.append(serialized_pub)
+                if len(self.pending) < self.sink_batch_size:
+                    return
+                batch, self.pending = self.pending, []
+                if self.recorder:
+                    self.sink.publish_batch(batch)
+                    return
+            elif self.recorder:
+                self.sink.publish(serialized_pub)
+                return
+
+        if batch is not None:
+            self.sink.publish_batch(batch)
+        else:
+            self.sink.publish(serialized_pub)
+
+    def flush(self):
+        """Push any partially filled batch to the sink"""
+        if self.sink is None or self.sink_batch_size <= 1:
+            return
+        with self.lock:
+            batch, self.pending = self.pending, []
+            if batch and self.recorder:
+                # Same order as the recording, as in _emit
+                self.sink.publish_batch(batch)
+                return
+        if batch:
+            self.sink.publish_batch(batch)
+
+    def build_publication_proto(self):
+        """Generate one publication and serialize it to Protobuf bytes (None if generation failed)"""
+        data = self.generator.generate_pub()
+        if not data:
+            return None
+        # Construim mesajul Protobuf
+
+        pub_msg = pb.Publication(
+            station_id=data['station_id'],
+            city=data['city'],
+            direction=data['direction'],
+            temperature=data['temperature'],
+            rain=data['rain'],
+            wind=data['wind'],
+            created_at=data['created_at'],
+            sent_at_ns=now_ns(),
+        )
+
+        # Serializăm mesajul într-un bytes
+        return pub_msg.SerializeToString()
+
+    def _publish_one(self):
+        """Build one publication and emit it, timing the whole publish stage"""
+        started_ns = now_ns()
+        serialized_pub = self.build_publication_proto()
+        if serialized_pub:
+            # Adăugăm bytes în coadă (transmiterea binară)
+            self._emit(serialized_pub)
+            self.publish_hist.record(now_ns() - started_ns)
+            self.published_counter.inc()
 
     def generate_publications_proto(self, batch_size=5):
         """Generate multiple publications per iteration using GeneratorPubSub and add them to the queue"""
         while self.is_running:
             for _ in range(batch_size):
-                data = self.generator.generate_pub()
-                if data:
-                    data['timestamp'] = datetime.now().isoformat()
-                    # Construim mesajul Protobuf
-
-                    pub_msg = pb.Publication(
-                        station_id=data['station_id'],
-                        city=data['city'],
-                        direction=data['direction'],
-                        temperature=data['temperature'],
-                        rain=data['rain'],
-                        wind=data['wind'],
-                        created_at=data['created_at'],
-                        timestamp=data['timestamp'],
-                    )
-
-                    # Serializăm mesajul într-un bytes
-                    serialized_pub = pub_msg.SerializeToString()
-
-                    # Adăugăm bytes în coadă (transmiterea binară)
-                    self.publication_queue.put(serialized_pub)
-                    self.generated_publications += 1
+                self._publish_one()
 
+            # Never hold a partial batch back while idle
+            self.flush()
             time.sleep(0.1)
 
+    def generate_publications_paced(self, rate: float, arrival: str = 'constant'):
+        """Emit publications open-loop at a target rate, scheduled from the monotonic clock
+
+        Send times follow a fixed schedule (constant gaps or exponential gaps for
+        Poisson arrivals) that never shifts when emission falls behind, so a slow
+        consumer shows up as lag instead of silently lowering the offered load.
+        """
+        interval_ns = 1e9 / rate
+        next_due_ns = time.monotonic_ns()
+        while self.is_running:
+            if arrival == 'poisson':
+                next_due_ns += random.expovariate(1.0) * interval_ns
+            else:
+                next_due_ns += interval_ns
+
+            wait_ns = next_due_ns - time.monotonic_ns()
+            if wait_ns > 0:
+                if wait_ns > FLUSH_IDLE_NS:
+                    self.flush()
+                time.sleep(wait_ns / 1e9)
+            else:
+                self.max_lag_ns = max(self.max_lag_ns, -wait_ns)
+
+            self._publish_one()
+
     def generate_publications(self, batch_size=20):
         """Generate multiple publications per iteration using GeneratorPubSub and add them to the queue"""
         while self.is_running:
@@ -57,23 +162,112 @@ class Publisher:
                     publication['timestamp'] = datetime.now()
                     self.publication_queue.put(publication)
 
-    def start(self, num_threads=4):
-        """Start the publisher with multiple threads generating publications"""
-        self.is_running = True
+    def start(self, num_threads=4, rate: float = None, arrival: str = 'constant'):
+        """Start the publisher with multiple threads generating publications
+
+        Without a rate the threads emit bursts of publications; with a rate (publications
+        per second, split evenly across threads) they pace themselves open-loop, with
+        either 'constant' or 'poisson' inter-arrival times.
+        """
+        self._begin_run(rate, arrival)
         self.threads = []
         for _ in range(num_threads):
-            t = threading.Thread(target=self.generate_publications_proto)
+            if rate:
+                t = threading.Thread(
+                    target=self.generate_publications_paced, args=(rate / num_threads, arrival))
+            else:
+                t = threading.Thread(target=self.generate_publications_proto)
             t.start()
             self.threads.append(t)
-        print(f"Publisher started with {num_threads} threads")
+        print(f"Publisher started with {num_threads} threads" + (f" at {rate} msg/s ({arrival})" if rate else ""))
+
+    def _begin_run(self, rate: float, arrival: str):
+        if arrival not in ARRIVAL_MODES:
+            raise ValueError(f"Unknown arrival mode '{arrival}', expected one of {ARRIVAL_MODES}")
+        self.is_running = True
+        self.target_rate = rate
+        self.arrival = arrival
+        self.max_lag_ns = 0
+        self.started_ns = time.monotonic_ns()
+        self.start_count = self.generated_publications
+
+    def start_async(self, rate: float = None, arrival: str = 'constant') -> asyncio.Task:
+        """Emit publications from one task on the running event loop instead of threads (same modes as start)"""
+        self._begin_run(rate, arrival)
+        emit = self._publish_paced_async(rate, arrival) if rate else self._publish_bursts_async()
+        self.task = asyncio.get_running_loop().create_task(emit, name="publisher")
+        print("Publisher started (asyncio)" + (f" at {rate} msg/s ({arrival})" if rate else ""))
+        return self.task
+
+    async def stop_async(self):
+        """Cancel the publishing task, then stop as stop() does"""
+        if self.task:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+        self.stop()
+
+    async def _publish_bursts_async(self, batch_size=5):
+        """generate_publications_proto as a coroutine"""
+        while True:
+            for _ in range(batch_size):
+                self._publish_one()
+            self.flush()
+            await asyncio.sleep(0.1)
+
+    async def _publish_paced_async(self, rate: float, arrival: str = 'constant'):
+        """generate_publications_paced as a coroutine: the same fixed schedule, awaited instead of slept"""
+        interval_ns = 1e9 / rate
+        next_due_ns = time.monotonic_ns()
+        while True:
+            if arrival == 'poisson':
+                next_due_ns += random.expovariate(1.0) * interval_ns
+            else:
+                next_due_ns += interval_ns
+
+            wait_ns = next_due_ns - time.monotonic_ns()
+            if wait_ns > 0:
+                if wait_ns > FLUSH_IDLE_NS:
+                    self.flush()
+                await asyncio.sleep(wait_ns / 1e9)
+            else:
+                self.max_lag_ns = max(self.max_lag_ns, -wait_ns)
+                # Behind schedule: still let the brokers run
+                await asyncio.sleep(0)
+
+            self._publish_one()
 
     def stop(self):
         """Stop the publisher and wait for threads to finish"""
         self.is_running = False
         for t in self.threads:
             t.join()
+        self.stopped_ns = time.monotonic_ns()
+        self.flush()
+        if self.recorder:
+            self.recorder.close()
         print("Publisher stopped")
 
+    def get_rate_stats(self) -> Dict[str, Any]:
+        """Report the achieved publication rate against the target rate"""
+        if self.started_ns is None:
+            return {'target_rate': self.target_rate, 'achieved_rate': 0.0, 'published': 0,
+                    'elapsed_s': 0.0, 'arrival': self.arrival, 'max_lag_ms': 0.0}
+        end_ns = self.stopped_ns if not self.is_running and self.stopped_ns else time.monotonic_ns()
+        elapsed = (end_ns - self.started_ns) / 1e9
+        published = self.generated_publications - self.start_count
+        return {
+            'target_rate': self.target_rate,
+            'achieved_rate': published / elapsed if elapsed > 0 else 0.0,
+            'published': published,
+            'elapsed_s': elapsed,
+            'arrival': self.arrival,
+            'max_lag_ms': self.max_lag_ns / 1e6,
+        }
+
     def get_publication(self) -> Dict[str, Any]:
         """Get the next publication from the queue"""
         return self.publication_queue.get()
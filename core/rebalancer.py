@@ -0,0 +1,134 @@
+import threading
+from typing import Any, Dict, List
+
+from .subscription import Subscription
+from .utils import log_event
+
+
+class MigrationMarker:
+    """Control item placed in the source's and the target's queues at the same point of the stream
+
+    Publications are enqueued on every broker in one global order, so the marker cuts
+    both streams at the same publication: the source handles the moved subscriptions
+    for everything before it, the target for everything after it. Each publication is
+    therefore matched against a moved subscription exactly once.
+    """
+
+    def __init__(self, source, target, subscription_ids: List[int]):
+        self.source = source
+        self.target = target
+        self.subscription_ids = subscription_ids
+        self.subscriptions: List[Subscription] = []
+        self.handed_off = threading.Event()
+        self.installed = threading.Event()
+
+    def hand_off(self, subscriptions: List[Subscription]):
+        """Called by the source once it reaches the marker"""
+        self.subscriptions = subscriptions
+        self.handed_off.set()
+
+    def wait(self, timeout: float = None) -> bool:
+        """Wait until the target has installed the moved subscriptions"""
+        return self.installed.wait(timeout)
+
+
+def subscription_cost(subscription: Subscription, profile=None) -> float:
+    """Relative matching cost of a subscription: measured if profiled, estimated otherwise"""
+    if profile is not None and profile.attempts:
+        return profile.eval_ns / profile.attempts
+    # Each condition is one comparison; window subscriptions also buffer and aggregate
+    cost = float(subscription.condition_count)
+    if subscription.window_size is not None:
+        cost *= 2
+    return cost
+
+
+class Rebalancer:
+    """Periodically move subscriptions from the most loaded broker to the least loaded one
+
+    A broker's load over an interval is the time it spent matching plus the estimated
+    time needed to work off its queue backlog. When the hottest broker carries more
+    than imbalance times the mean load, subscriptions worth the excess (at most
+    max_fraction of its table) are migrated to the coldest broker.
+    """
+
+    def __init__(self, network, interval: float = 5.0, imbalance: float = 1.25, max_fraction: float = 0.25):
+        self.network = network
+        self.interval = interval
+        self.imbalance = imbalance
+        self.max_fraction = max_fraction
+        self.stop_event = threading.Event()
+        self.thread = None
+        self.last_totals: Dict[str, tuple] = {}
+        self.migrations = 0
+        self.moved_subscriptions = 0
+
+    def broker_loads(self) -> Dict[str, Dict[str, Any]]:
+        """Matching time and backlog of every broker since the previous call"""
+        loads = {}
+        for broker in self.network.brokers:
+            match_ns, publications = broker.match_hist.total, broker.match_hist.count
+            last_ns, last_publications = self.last_totals.get(broker.broker_id, (0, 0))
+            self.last_totals[broker.broker_id] = (match_ns, publications)
+            match_delta = match_ns - last_ns
+            publications_delta = publications - last_publications
+            queue_depth = broker.publication_queue.qsize()
+            per_publication = match_delta / publications_delta if publications_delta else 0
+            loads[broker.broker_id] = {
+                'broker': broker,
+                'match_ns': match_delta,
+                'queue_depth': queue_depth,
+                'load': match_delta + queue_depth * per_publication,
+            }
+        return loads
+
+    def rebalance_once(self):
+        """Compare broker loads and start at most one migration; return the marker if any"""
+        loads = self.broker_loads()
+        if len(loads) < 2:
+            return None
+        mean_load = sum(entry['load'] for entry in loads.values()) / len(loads)
+        hot = max(loads.values(), key=lambda entry: entry['load'])
+        cold = min(loads.values(), key=lambda entry: entry['load'])
+        if mean_load <= 0 or hot['load'] <= self.imbalance * mean_load or hot is cold:
+            return None
+
+        source, target = hot['broker'], cold['broker']
+        share = min((hot['load'] - mean_load) / hot['load'], self.max_fraction)
+        subscription_ids = source.pick_subscriptions(share)
+        if not subscription_ids:
+            return None
+        marker = self.network.migrate_subscriptions(source, target, subscription_ids)
+        self.migrations += 1
+        self.moved_subscriptions += len(subscription_ids)
+        log_event(self.network.logger, 'rebalance_started', {
+            'source': source.broker_id,
+            'target': target.broker_id,
+            'subscriptions': len(subscription_ids),
+            'source_load_ms': hot['load'] / 1e6,
+            'target_load_ms': cold['load'] / 1e6,
+            'mean_load_ms': mean_load / 1e6,
+        })
+        return marker
+
+    def _run(self):
+        self.broker_loads()
+        while not self.stop_event.wait(self.interval):
+            # Brokers can't join or leave while a migration is in flight
+            with self.network.membership_lock:
+                marker = self.rebalance_once()
+                if marker is not None:
+                    # One migration at a time, so the next decision sees its effect
+                    while not marker.wait(self.interval) and not self.stop_event.is_set():
+                        pass
+
+    def start(self):
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+        if self.thread:
+            self.thread.join()
+            self.thread = None
@@ -0,0 +1,159 @@
+import operator
+from collections import namedtuple
+from typing import Any, Dict, Iterable, List, Tuple
+
+from .proto import publication_pb2 as pb
+
+# Scalar fields carried on the wire
+WIRE_FIELDS = [field.name for field in pb.Publication.DESCRIPTOR.fields if field.message_type is None]
+# Stamps added in transit, present in every schema
+TRANSPORT_FIELDS = ('timestamp', 'sent_at_ns')
+
+OPERATORS = {
+    '=': operator.eq,
+    '!=': operator.ne,
+    '>': operator.gt,
+    '>=': operator.ge,
+    '<': operator.lt,
+    '<=': operator.le,
+}
+
+# One broker's timestamps for a publication (monotonic ns)
+Hop = namedtuple('Hop', ['node_id', 'received_ns', 'dequeued_ns', 'decoded_ns'])
+
+
+def new_hop(fields: Tuple) -> Hop:
+    """Hop from a 4-tuple, skipping namedtuple's argument parsing on the decode path"""
+    return tuple.__new__(Hop, fields)
+
+
+class _Missing:
+    """Value of a field a publication doesn't carry: no comparison with it holds"""
+    __slots__ = ()
+
+    def __eq__(self, other):
+        return False
+
+    __ne__ = __lt__ = __le__ = __gt__ = __ge__ = __eq__
+
+    def __hash__(self):
+        return 0
+
+    def __repr__(self):
+        return 'MISSING'
+
+    def __reduce__(self):
+        # Unpickles to the module singleton, so `is MISSING` checks keep working
+        return 'MISSING'
+
+
+MISSING = _Missing()
+
+
+def _never(value, bound):
+    return False
+
+
+class PublicationRecord:
+    """A publication as a tuple of values indexed by schema field ID
+
+    Matching reads record.values[field_id] directly; the dict-like accessors are there
+    for subscribers, window aggregation and serialization, which look fields up by name.
+    """
+    __slots__ = ('schema', 'values', 'hops')
+
+    def __init__(self, schema: 'Schema', values: Tuple, hops: List[Hop] = None):
+        self.schema = schema
+        self.values = values
+        self.hops = hops
+
+    def __getitem__(self, name: str):
+        if name == 'hops' and self.hops is not None:
+            return self.hops
+        field_id = self.schema.field_ids.get(name)
+        if field_id is None or self.values[field_id] is MISSING:
+            raise KeyError(name)
+        return self.values[field_id]
+
+    def get(self, name: str, default=None):
+        try:
+            return self[name]
+        except KeyError:
+            return default
+
+    def __contains__(self, name: str) -> bool:
+        return self.get(name, MISSING) is not MISSING
+
+    def keys(self) -> List[str]:
+        names = [name for name, value in zip(self.schema.fields, self.values) if value is not MISSING]
+        if self.hops is not None:
+            names.append('hops')
+        return names
+
+    def items(self) -> List[Tuple[str, Any]]:
+        return [(name, self[name]) for name in self.keys()]
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Plain dict copy, hops included, e.g. for JSON"""
+        publication = {name: value for name, value in zip(self.schema.fields, self.values) if value is not MISSING}
+        if self.hops is not None:
+            publication['hops'] = [hop._asdict() for hop in self.hops]
+        return publication
+
+    def __repr__(self):
+        return f"PublicationRecord({self.to_dict()})"
+
+
+class Schema:
+    """Publication fields compiled to integer IDs, shared by records and compiled conditions"""
+
+    def __init__(self, fields: Iterable[str]):
+        self.fields = tuple(dict.fromkeys(list(fields) + list(TRANSPORT_FIELDS)))
+        self.field_ids = {name: field_id for field_id, name in enumerate(self.fields)}
+        self.wire_ids = [field_id for field_id, name in enumerate(self.fields) if name in WIRE_FIELDS]
+        wire_names = [self.fields[field_id] for field_id in self.wire_ids]
+        # One C-level call reads all wire fields off a protobuf message, in schema order
+        self._read_wire = operator.attrgetter(*wire_names) if len(wire_names) > 1 else (
+            lambda message: (getattr(message, wire_names[0]),) if wire_names else ())
+        self._all_wire = len(self.wire_ids) == len(self.fields)
+
+    @classmethod
+    def from_configs(cls, configs) -> 'Schema':
+        """Schema of the publications described by a generator Configs"""
+        return cls(configs.fields)
+
+    def from_proto(self, pub_msg: pb.Publication, hops: List[Hop] = None) -> PublicationRecord:
+        values = self._read_wire(pub_msg)
+        if self._all_wire:
+            return PublicationRecord(self, values, hops)
+        padded = [MISSING] * len(self.fields)
+        for field_id, value in zip(self.wire_ids, values):
+            padded[field_id] = value
+        return PublicationRecord(self, tuple(padded), hops)
+
+    def from_dict(self, publication: Dict[str, Any]) -> PublicationRecord:
+        get = publication.get
+        hops = get('hops')
+        if hops is not None:
+            hops = [hop if isinstance(hop, Hop) else Hop(**hop) for hop in hops]
+        return PublicationRecord(self, tuple([get(name, MISSING) for name in self.fields]), hops)
+
+    def compile_conditions(self, conditions: Iterable[Tuple[str, str, Any]]) -> Tuple:
+        """Resolve (field, operator, value) conditions to (field_id, compare, value)
+
+        A condition on a field outside the schema can never hold, so it compiles to a
+        single always-false check; unknown operators constrain nothing, as in
+        Subscription.matches.
+        """
+        compiled = []
+        for field, op, value in conditions:
+            field_id = self.field_ids.get(field)
+            if field_id is None:
+                return ((0, _never, None),)
+            compare = OPERATORS.get(op)
+            if compare is not None:
+                compiled.append((field_id, compare, value))
+        return tuple(compiled)
+
+
+DEFAULT_SCHEMA = Schema(WIRE_FIELDS)
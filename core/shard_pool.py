@@ -0,0 +1,166 @@
+import heapq
+import itertools
+import multiprocessing
+import pickle
+from typing import Dict, List, Tuple
+
+from .subscription import SharedPredicate
+
+
+def _shard_worker(connection):
+    """Worker process: keep one shard of compiled predicates and match publication batches against it
+
+    Each request carries the predicates added to and removed from the shard since the
+    previous one, plus the pickled value tuples of the batch; the reply lists, per
+    publication, the IDs of the matching predicates in ascending order.
+    """
+    predicates: Dict[int, Tuple] = {}
+    connection.send('ready')
+    while True:
+        try:
+            message = connection.recv()
+        except EOFError:
+            return
+        if message is None:
+            return
+        added, removed, payload = message
+        # Adds first: a predicate added and removed since the last batch must end up gone
+        predicates.update(added)
+        for predicate_id in removed:
+            predicates.pop(predicate_id, None)
+        rows = pickle.loads(payload)
+        matched_lists = [[] for _ in rows]
+        pairs = list(zip(rows, matched_lists))
+        # Predicate-major, as in Broker._match_predicates_batch; IDs only grow, so dict order is ascending
+        for predicate_id, conditions in predicates.items():
+            for values, matched in pairs:
+                for field_id, compare, value in conditions:
+                    if not compare(values[field_id], value):
+                        break
+                else:
+                    matched.append(predicate_id)
+        connection.send(matched_lists)
+
+
+class ShardPool:
+    """A broker's simple predicates split into shards, each matched by its own worker process
+
+    The owning broker keeps its full index and calls add()/remove() as predicates come and
+    go; the changes reach each worker with the next batch it matches. A batch is sent to
+    every shard at once and the per-shard results are merged back in predicate creation
+    order, which is the order the unsharded index evaluates them in. add(), remove() and
+    match() run under the broker's lock; start() may run concurrently with them.
+    """
+
+    def __init__(self, shards: int):
+        self.shards = shards
+        self.predicates: Dict[int, SharedPredicate] = {}
+        self.predicate_ids: Dict[tuple, int] = {}
+        self.owners: Dict[int, int] = {}
+        self.sizes = [0] * shards
+        # Changes not yet sent to each shard's worker
+        self.added: List[list] = [[] for _ in range(shards)]
+        self.removed: List[list] = [[] for _ in range(shards)]
+        self.next_id = itertools.count()
+        self.processes = []
+        self.connections = []
+        # Whether the workers hold the current shards (up to the pending changes)
+        self.synced = False
+
+    def add(self, predicate: SharedPredicate):
+        """Assign a new predicate to the smallest shard"""
+        predicate_id = next(self.next_id)
+        shard = self.sizes.index(min(self.sizes))
+        self.predicates[predicate_id] = predicate
+        self.predicate_ids[predicate.packed] = predicate_id
+        self.owners[predicate_id] = shard
+        self.sizes[shard] += 1
+        self.added[shard].append((predicate_id, predicate.conditions))
+
+    def remove(self, predicate: SharedPredicate):
+        predicate_id = self.predicate_ids.pop(predicate.packed)
+        shard = self.owners.pop(predicate_id)
+        del self.predicates[predicate_id]
+        self.sizes[shard] -= 1
+        self.removed[shard].append(predicate_id)
+
+    def start(self):
+        """Start one worker process per shard; each gets its whole shard with the next batch"""
+        if self.processes:
+            return
+        # Spawned rather than forked: the broker process runs threads that may hold locks
+        context = multiprocessing.get_context('spawn')
+        processes, connections = [], []
+        for shard in range(self.shards):
+            parent_end, child_end = context.Pipe()
+            process = context.Process(target=_shard_worker, args=(child_end,),
+                                      name=f"match-shard-{shard}", daemon=True)
+            process.start()
+            child_end.close()
+            processes.append(process)
+            connections.append(parent_end)
+        # Spawning and importing take a while: pay for it here rather than on the first batches
+        for connection in connections:
+            connection.recv()
+        self.synced = False
+        self.connections = connections
+        self.processes = processes
+
+    def _sync(self):
+        """Queue every shard in full for freshly started workers"""
+        self.added = [[] for _ in range(self.shards)]
+        self.removed = [[] for _ in range(self.shards)]
+        for predicate_id, predicate in self.predicates.items():
+            self.added[self.owners[predicate_id]].append((predicate_id, predicate.conditions))
+        self.synced = True
+
+    def close(self):
+        """Stop the workers; the next start() sends them the current shards again"""
+        for connection in self.connections:
+            try:
+                connection.send(None)
+            except OSError:
+                pass
+        for process in self.processes:
+            process.join(timeout=1)
+            if process.is_alive():
+                process.terminate()
+        for connection in self.connections:
+            connection.close()
+        self.processes = []
+        self.connections = []
+
+    def match(self, rows: List[Tuple]) -> List[List[SharedPredicate]]:
+        """Matching predicates of each publication, given as record value tuples"""
+        if not self.processes:
+            self.start()
+        if not self.synced:
+            self._sync()
+        # The batch is pickled once and the same bytes go to every shard
+        payload = pickle.dumps(rows, pickle.HIGHEST_PROTOCOL)
+        try:
+            results = self._exchange(payload)
+        except (OSError, EOFError):
+            # A worker is gone: restart them all from the full shards and retry the batch once
+            self.close()
+            self.start()
+            self._sync()
+            results = self._exchange(payload)
+        predicates = self.predicates
+        return [[predicates[predicate_id] for predicate_id in heapq.merge(*shard_lists)]
+                for shard_lists in zip(*results)]
+
+    def _exchange(self, payload: bytes) -> List[list]:
+        """Send each shard its pending changes and the batch, then collect every shard's result"""
+        for shard, connection in enumerate(self.connections):
+            connection.send((self.added[shard], self.removed[shard], payload))
+            self.added[shard] = []
+            self.removed[shard] = []
+        return [connection.recv() for connection in self.connections]
+
+    def get_stats(self) -> Dict[str, int]:
+        return {
+            'match_shards': self.shards,
+            'largest_shard': max(self.sizes),
+            'smallest_shard': min(self.sizes),
+        }
@@ -1,30 +1,55 @@
+import asyncio
 import random
 import queue
+import shutil
+from collections import deque
 from queue import Queue
-from typing import Dict, Any, List
+from typing import Dict, Any, List, Optional
 import logging
 from datetime import datetime
 from dateutil import parser
 from .subscription import Subscription
-from .utils import log_event
+from .dataset_io import DatasetWriter, iter_dataset
+from .metrics import MetricsRegistry, REGISTRY, now_ns
+from .records import Hop
+from .utils import log_event, event_level
 from .generator_pub_sub import GeneratorPubSub
 
 import threading
 import time
 
 class Subscriber:
-    def __init__(self, subscriber_id: str, logger: logging.Logger = None, configs: Any = None, pass_generation: bool = False):
+    def __init__(self, subscriber_id: str, logger: logging.Logger = None, configs: Any = None, pass_generation: bool = False,
+                 metrics: MetricsRegistry = None, history_size: Optional[int] = 10000,
+                 spill_path: str = None, spill_format: str = 'ndjson', subscription_ttl: float = None):
         self.subscriber_id = subscriber_id
-        self.subscriptions: Dict[str, Subscription] = {}
+        self.subscriptions: Dict[int, Subscription] = {}
         self.logger = logger or logging.getLogger('pubsub_system')
         self.configs = configs
         self.generator = GeneratorPubSub(configs) if configs else None
-        self.received_messages: List[Dict[str, Any]] = []
-        self.latencies: List[float] = []
+        # Ring of the most recent messages/latencies; older messages go to the spill file if any
+        self.history_size = history_size
+        self.received_messages = deque(maxlen=history_size)
+        self.latencies = deque(maxlen=history_size)
+        self.history_lock = threading.Lock()
+        self.spill_writer = DatasetWriter(spill_path, 'messages', spill_format) if spill_path else None
+        # Streaming aggregates over every message, not just the ones still in memory
+        self.message_count = 0
+        self.dropped_messages = 0
+        self.latency_count = 0
+        self.latency_sum_ms = 0.0
         self.is_running = False
         self.sub_thread = None
+        self.task: asyncio.Task = None
         self.message_queue = Queue()
         self.pass_generation = pass_generation  # Flag to control subscription generation
+        # Default lease of new subscriptions; the run loop renews held leases at half-life
+        self.subscription_ttl = subscription_ttl
+        self.next_renewal = 0.0
+        self.metrics = metrics or REGISTRY
+        self.latency_hist = self.metrics.histogram('pubsub_delivery_latency_seconds', subscriber_id=subscriber_id)
+        self.received_counter = self.metrics.counter('pubsub_received_messages_total', subscriber_id=subscriber_id)
+        self.hop_hists = {}
 
     def start(self):
         """Start the subscriber thread"""
@@ -44,6 +69,9 @@ class Subscriber:
         """Run the subscriber thread to process messages and manage subscriptions"""
         print(f"{self.subscriber_id} thread started")
         while self.is_running:
+            if self.subscription_ttl and time.monotonic() >= self.next_renewal:
+                self.renew_subscriptions()
+                self.next_renewal = time.monotonic() + self.subscription_ttl / 2
             try:
                 # Try to get a message with timeout so thread stays responsive
                 message = self.message_queue.get(timeout=1)
@@ -52,26 +80,68 @@ class Subscriber:
                 # No message received, time to add subscriptions
                 if self.pass_generation:
                     continue
-                current_time = time.time()
-                if not hasattr(self, "_last_sub_time"):
-                    self._last_sub_time = 0
-                if int(current_time) - self._last_sub_time > 60:
-                    simple_cond = generate_random_subscription(self.generator)
-                    self.create_simple_subscription(simple_cond)
-                    print(f"{self.subscriber_id} added new simple subscription")
+                self._generate_subscriptions()
 
-                    if random.random() < 0.6:
-                        window_cond = generate_random_window_subscription(self.generator)
-                        self.create_window_subscription(window_cond)
-                        print(f"{self.subscriber_id} added new window subscription")
+        print(f"{self.subscriber_id} thread exiting")
 
-                    self._last_sub_time = current_time
+    def _generate_subscriptions(self) -> float:
+        """Add random subscriptions if a minute has passed since the last ones; return when the next are due"""
+        current_time = time.time()
+        if not hasattr(self, "_last_sub_time"):
+            self._last_sub_time = 0
+        if int(current_time) - self._last_sub_time > 60:
+            simple_cond = generate_random_subscription(self.generator)
+            self.create_simple_subscription(simple_cond)
+            print(f"{self.subscriber_id} added new simple subscription")
 
-        print(f"{self.subscriber_id} thread exiting")
+            if random.random() < 0.6:
+                window_cond = generate_random_window_subscription(self.generator)
+                self.create_window_subscription(window_cond)
+                print(f"{self.subscriber_id} added new window subscription")
+
+            self._last_sub_time = current_time
+        return self._last_sub_time + 61 - current_time
+
+    def start_async(self) -> Optional[asyncio.Task]:
+        """Run the subscriber's periodic work as a task on the running event loop instead of a thread
+
+        Deliveries don't need a task: brokers call receive_message directly. The task only
+        wakes up for lease renewals and subscription generation, and is not created at
+        all when there is neither.
+        """
+        self.is_running = True
+        if self.subscription_ttl or not self.pass_generation:
+            self.task = asyncio.get_running_loop().create_task(
+                self._run_async(), name=f"subscriber:{self.subscriber_id}")
+        return self.task
+
+    async def stop_async(self):
+        """Cancel the subscriber task"""
+        self.is_running = False
+        if self.task:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
 
-    def create_simple_subscription(self, conditions) -> Subscription:
+    async def _run_async(self):
+        """Sleep until the next lease renewal or subscription generation is due, then do it"""
+        while True:
+            waits = []
+            if self.subscription_ttl:
+                if time.monotonic() >= self.next_renewal:
+                    self.renew_subscriptions()
+                    self.next_renewal = time.monotonic() + self.subscription_ttl / 2
+                waits.append(self.next_renewal - time.monotonic())
+            if not self.pass_generation:
+                waits.append(self._generate_subscriptions())
+            await asyncio.sleep(max(min(waits), 0))
+
+    def create_simple_subscription(self, conditions, ttl: float = None) -> Subscription:
         """Create a simple subscription with specified conditions"""
-        subscription = Subscription(conditions=conditions, subscriber=self)
+        subscription = Subscription(conditions=conditions, subscriber=self, ttl=ttl or self.subscription_ttl)
         self.subscriptions[subscription.id] = subscription
         log_conditions = [
             {
@@ -88,9 +158,10 @@ class Subscriber:
         })
         return subscription
 
-    def create_window_subscription(self, conditions) -> Subscription:
+    def create_window_subscription(self, conditions, ttl: float = None) -> Subscription:
         """Create a window-based subscription with specified conditions"""
-        subscription = Subscription(conditions=conditions, window_size=10, subscriber=self)
+        subscription = Subscription(conditions=conditions, window_size=10, subscriber=self,
+                                    ttl=ttl or self.subscription_ttl)
         self.subscriptions[subscription.id] = subscription
         # Convert conditions to a serializable format
         log_conditions = [
@@ -108,45 +179,189 @@ class Subscriber:
         })
         return subscription
 
+    def create_subscriptions(self, conditions_list, window_size: int = None,
+                             ttl: float = None) -> List[Subscription]:
+        """Create many subscriptions at once (window ones if window_size is given) with one log event"""
+        ttl = ttl or self.subscription_ttl
+        subscriptions = [
+            Subscription(conditions=conditions, window_size=window_size, subscriber=self, ttl=ttl)
+            for conditions in conditions_list
+        ]
+        self.subscriptions.update((subscription.id, subscription) for subscription in subscriptions)
+        log_event(self.logger, 'subscriptions_created', {
+            'subscriber_id': self.subscriber_id,
+            'count': len(subscriptions),
+            'window_size': window_size,
+        })
+        return subscriptions
+
+    def renew_subscriptions(self, subscription_ids=None) -> int:
+        """Renew the leases of the given (default: all held) subscriptions and return how many
+
+        A renewal only moves the subscription's deadline; brokers notice it when the old
+        deadline comes up, so renewing costs nothing on the matching path.
+        """
+        if subscription_ids is None:
+            subscriptions = list(self.subscriptions.values())
+        else:
+            subscriptions = [self.subscriptions[sub_id] for sub_id in subscription_ids if sub_id in self.subscriptions]
+        renewed = 0
+        for subscription in subscriptions:
+            if subscription.ttl:
+                subscription.renew()
+                renewed += 1
+        return renewed
+
+    def cancel_subscription(self, subscription_id: str):
+        """Stop renewing a subscription; brokers drop it once its lease runs out"""
+        self.subscriptions.pop(subscription_id, None)
+
     def receive_message(self, message: Dict[str, Any]):
         """Receive a message and calculate latency"""
-        self.received_messages.append(message)
+        self._store_message(message)
+        self.received_counter.inc()
 
         try:
+            received_ns = now_ns()
+            sent_at_ns = message.get('sent_at_ns')
             timestamp_str = message.get('timestamp')
             latency_ms = None
 
-            if timestamp_str:
+            if sent_at_ns:
+                # Same monotonic clock on both ends: plain integer subtraction
+                latency_ns = received_ns - sent_at_ns
+                latency_ms = latency_ns / 1e6
+                if latency_ns >= 0:
+                    self._add_latency(latency_ms)
+                    self.latency_hist.record(latency_ns)
+                hops = message.get('hops')
+                if hops:
+                    self._record_hops(sent_at_ns, hops, received_ns)
+            elif isinstance(timestamp_str, str) and timestamp_str:
+                # Legacy ISO 8601 stamp (e.g. streams recorded before sent_at_ns existed)
                 sent_time = parser.isoparse(timestamp_str)
                 # Get receive time as timezone-aware UTC
                 receive_time = datetime.now()
 
                 latency_ms = (receive_time - sent_time).total_seconds() * 1000
                 if latency_ms >= 0:
-                    self.latencies.append(latency_ms)
+                    self._add_latency(latency_ms)
+                    self.latency_hist.record(latency_ms * 1e6)
 
-            log_event(self.logger, 'message_received', {
-                'subscriber_id': self.subscriber_id,
-                'message_id': message.get('id', repr(message)),
-                'latency_ms': latency_ms
-            })
+            level = event_level(self.logger, 'message_received')
+            if level:
+                log_event(self.logger, 'message_received', {
+                    'subscriber_id': self.subscriber_id,
+                    'message_id': message.get('id', repr(message)),
+                    'latency_ms': latency_ms
+                }, level)
 
         except Exception as e:
             self.logger.error(f"Error calculating latency: {e}")
 
+    def _store_message(self, message: Dict[str, Any]):
+        """Keep a message in the ring, spilling (or dropping) the oldest one when it is full"""
+        with self.history_lock:
+            self.message_count += 1
+            if self.history_size is not None and len(self.received_messages) >= self.history_size:
+                # With history_size=0 the ring stays empty and the message itself is evicted
+                evicted = self.received_messages.popleft() if self.received_messages else message
+                if self.spill_writer:
+                    self.spill_writer.write(evicted)
+                else:
+                    self.dropped_messages += 1
+                if evicted is message:
+                    return
+            self.received_messages.append(message)
+
+    def _add_latency(self, latency_ms: float):
+        with self.history_lock:
+            self.latencies.append(latency_ms)
+            self.latency_count += 1
+            self.latency_sum_ms += latency_ms
+
+    def _record_hops(self, sent_at_ns: int, hops: List[Hop], received_ns: int):
+        """Break the end-to-end latency down into per-hop segments"""
+        previous_ns = sent_at_ns
+        for hop in hops:
+            node_id = hop.node_id
+            self._hop_hist(node_id, 'transfer').record(hop.received_ns - previous_ns)
+            self._hop_hist(node_id, 'queue').record(hop.dequeued_ns - hop.received_ns)
+            self._hop_hist(node_id, 'decode').record(hop.decoded_ns - hop.dequeued_ns)
+            previous_ns = hop.decoded_ns
+        # Matching and delivery on the last node, up to this subscriber
+        self._hop_hist(hops[-1].node_id, 'match_deliver').record(received_ns - previous_ns)
+
+    def _hop_hist(self, node_id: str, segment: str):
+        key = (node_id, segment)
+        hop_hist = self.hop_hists.get(key)
+        if hop_hist is None:
+            hop_hist = self.metrics.histogram(
+                'pubsub_hop_seconds', subscriber_id=self.subscriber_id, node_id=node_id, segment=segment)
+            self.hop_hists[key] = hop_hist
+        return hop_hist
+
     def average_latency(self):
         """Calculate the average latency of received messages"""
-        if hasattr(self, 'latencies') and self.latencies:
-            return sum(self.latencies) / len(self.latencies)
+        if self.latency_count:
+            return self.latency_sum_ms / self.latency_count
         return 0.0
 
     def get_received_messages(self) -> List[Dict[str, Any]]:
-        """Get all received messages"""
-        return self.received_messages
+        """Get the received messages still held in memory"""
+        with self.history_lock:
+            return list(self.received_messages)
+
+    def iter_all_messages(self):
+        """Yield every kept message: the spilled ones from disk first, then the in-memory ring"""
+        if self.spill_writer:
+            with self.history_lock:
+                self.spill_writer.flush()
+            yield from iter_dataset(self.spill_writer.path, 'messages', self.spill_writer.fmt)
+        yield from self.get_received_messages()
+
+    def flush_messages(self, path: str = None) -> str:
+        """Stream every kept message to disk and return the path it ended up in
+
+        With a spill file the in-memory ring is appended to it and the spill file is
+        closed; the result is copied to path if a different one is given. Without a
+        spill file the ring is written to path.
+        """
+        with self.history_lock:
+            ring = list(self.received_messages)
+            self.received_messages.clear()
+            if self.spill_writer:
+                self.spill_writer.write_many(ring)
+                self.spill_writer.close()
+                spill_path = self.spill_writer.path
+                self.spill_writer = None
+                if path and path != spill_path:
+                    shutil.copyfile(spill_path, path)
+                    return path
+                return spill_path
+
+        if path is None:
+            raise ValueError("flush_messages needs a path when no spill file is configured")
+        with DatasetWriter(path, 'messages') as writer:
+            writer.write_many(ring)
+        return path
+
+    def get_message_stats(self) -> Dict[str, Any]:
+        """Streaming aggregates over every message received so far"""
+        return {
+            'subscriber_id': self.subscriber_id,
+            'received_messages': self.message_count,
+            'in_memory': len(self.received_messages),
+            'dropped_messages': self.dropped_messages,
+            'average_latency_ms': self.average_latency(),
+            'p50_latency_ms': self.latency_hist.percentile(0.5) * 1e3,
+            'p99_latency_ms': self.latency_hist.percentile(0.99) * 1e3,
+        }
 
     def clear_messages(self):
         """Clear received messages"""
-        self.received_messages = []
+        with self.history_lock:
+            self.received_messages.clear()
 
     def process_message(self, message):
         pass
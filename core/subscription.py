@@ -1,15 +1,143 @@
+import itertools
+import operator
 import time
-import uuid
 from typing import Dict, List, Any, Tuple
 
+# Field and operator names are interned to small integer codes shared by every subscription
+FIELD_NAMES: List[str] = []
+FIELD_CODES: Dict[str, int] = {}
+OPERATOR_NAMES: List[str] = ['=', '!=', '>', '>=', '<', '<=']
+OPERATOR_CODES: Dict[str, int] = {name: code for code, name in enumerate(OPERATOR_NAMES)}
+# Compare function per operator code; unknown operators constrain nothing
+OPERATOR_FUNCTIONS: List = [operator.eq, operator.ne, operator.gt, operator.ge, operator.lt, operator.le]
 
-class Subscription:
-    def __init__(self, conditions, window_size=None, subscriber=None):
+_subscription_ids = itertools.count(1)
+
+
+def next_subscription_id() -> int:
+    return next(_subscription_ids)
+
+
+def reserve_subscription_ids(last_id: int):
+    """Make sure IDs handed out from now on are above last_id (e.g. after loading a snapshot)"""
+    global _subscription_ids
+    upcoming = next(_subscription_ids)
+    _subscription_ids = itertools.count(max(upcoming, last_id + 1))
+
+
+def _intern(names: List[str], codes: Dict[str, int], name: str) -> int:
+    code = codes.get(name)
+    if code is None:
+        code = codes[name] = len(names)
+        names.append(name)
+    return code
+
+
+def field_code(field: str) -> int:
+    return _intern(FIELD_NAMES, FIELD_CODES, field)
+
+
+def _any(value, bound) -> bool:
+    return True
+
+
+def operator_code(op: str) -> int:
+    code = _intern(OPERATOR_NAMES, OPERATOR_CODES, op)
+    if code == len(OPERATOR_FUNCTIONS):
+        OPERATOR_FUNCTIONS.append(_any)
+    return code
+
+
+def pack_conditions(conditions) -> Tuple:
+    """Canonical packed form of a condition set: a flat (field_code, operator_code, value, ...) tuple
+
+    Conditions are deduplicated and sorted by name, so identical condition sets pack to equal
+    tuples within one process; the packed tuple doubles as the dedup key. Field and operator
+    codes follow this process's interning order, so a packed tuple must not be persisted or
+    sent to another process: use unpack_conditions() for that.
+    """
+    triples = {(field, op, value) for field, op, value in conditions}
+    if len(triples) > 1:
+        triples = sorted(triples, key=lambda triple: (triple[0], triple[1], repr(triple[2])))
+    packed = []
+    for field, op, value in triples:
+        packed += (field_code(field), operator_code(op), value)
+    return tuple(packed)
+
+
+def unpack_conditions(packed: Tuple) -> List[Tuple[str, str, Any]]:
+    """(field, operator, value) triples of a packed condition set"""
+    return [
+        (FIELD_NAMES[packed[i]], OPERATOR_NAMES[packed[i + 1]], packed[i + 2])
+        for i in range(0, len(packed), 3)
+    ]
+
+
+class SharedPredicate:
+    """One distinct condition set and the subscriptions registered with it (its reference count)
+
+    The conditions are compiled against a Schema into (field_id, compare, value) triples,
+    so matching a PublicationRecord is tuple indexing and C-level comparisons.
+    """
+    __slots__ = ('conditions', 'packed', 'registrations')
+
+    def __init__(self, conditions: Tuple, subscription):
         self.conditions = conditions
-        self.window_size = window_size
-        self.window_buffer = []
-        self.id = str(uuid.uuid4())
+        self.packed = subscription.packed
+        self.registrations = {subscription.id: subscription}
+
+    def matches(self, publication) -> bool:
+        """Check a PublicationRecord against the compiled conditions"""
+        values = publication.values
+        for field_id, compare, value in self.conditions:
+            if not compare(values[field_id], value):
+                return False
+        return True
+
+    def release(self, subscription_id) -> bool:
+        """Drop one registration; return True once none are left"""
+        self.registrations.pop(subscription_id, None)
+        return not self.registrations
+
+
+class Subscription:
+    """Compact subscription: an integer ID, packed conditions and a subscriber reference
+
+    Window subscriptions are WindowSubscription instances, created by passing a
+    window_size; only they carry window state.
+    """
+    __slots__ = ('id', 'packed', 'subscriber', 'ttl', 'expires_at')
+    window_size = None
+
+    def __new__(cls, *args, **kwargs):
+        window_size = args[1] if len(args) > 1 else kwargs.get('window_size')
+        if window_size is not None and cls is Subscription:
+            cls = WindowSubscription
+        return object.__new__(cls)
+
+    def __init__(self, conditions=(), window_size=None, subscriber=None, subscription_id=None, ttl=None,
+                 packed: Tuple = None):
+        self.packed = packed if packed is not None else pack_conditions(conditions)
+        self.id = subscription_id or next_subscription_id()
         self.subscriber = subscriber  # Reference to subscriber
+        # Optional lease: the subscription expires ttl seconds after its last renewal
+        self.ttl = ttl
+        self.expires_at = time.monotonic() + ttl if ttl else None
+
+    @property
+    def conditions(self) -> List[Tuple[str, str, Any]]:
+        return unpack_conditions(self.packed)
+
+    @property
+    def condition_count(self) -> int:
+        return len(self.packed) // 3
+
+    def renew(self, ttl=None):
+        """Extend the lease to ttl seconds from now (default: the subscription's own TTL)"""
+        if ttl is not None:
+            self.ttl = ttl
+        if self.ttl:
+            self.expires_at = time.monotonic() + self.ttl
 
     @property
     def subscriber_id(self):
@@ -17,33 +145,25 @@ class Subscription:
 
     def matches(self, publication) -> bool:
         """Check if a publication matches the subscription conditions"""
-        # print(f"Checking publication against subscription {self.id} with conditions: {self.conditions.__repr__()}")
-        for field, operator, value in self.conditions:
-            if field not in publication:
+        packed, names, functions = self.packed, FIELD_NAMES, OPERATOR_FUNCTIONS
+        i, end = 0, len(packed)
+        while i < end:
+            field = names[packed[i]]
+            if field not in publication or not functions[packed[i + 1]](publication[field], packed[i + 2]):
                 return False
+            i += 3
+        return True
 
-            pub_value = publication[field]
-
-            if operator == "=":
-                if pub_value != value:
-                    return False
-            elif operator == ">":
-                if not pub_value > value:
-                    return False
-            elif operator == ">=":
-                if not pub_value >= value:
-                    return False
-            elif operator == "<":
-                if not pub_value < value:
-                    return False
-            elif operator == "<=":
-                if not pub_value <= value:
-                    return False
-            elif operator == "!=":
-                if not pub_value != value:
-                    return False
 
-        return True
+class WindowSubscription(Subscription):
+    """Subscription evaluated over windows of window_size publications"""
+    __slots__ = ('window_size', 'window_buffer')
+
+    def __init__(self, conditions=(), window_size=None, subscriber=None, subscription_id=None, ttl=None,
+                 packed: Tuple = None):
+        super().__init__(conditions, None, subscriber, subscription_id, ttl, packed)
+        self.window_size = window_size
+        self.window_buffer = []
 
     def process_window(self) -> Dict[str, Any]:
         """Process the window buffer and return a meta-publication if conditions are met"""
@@ -51,7 +171,8 @@ class Subscription:
             return None
         # Example: Calculate average, minimum, and maximum for fields starting with 'avg_', 'min_', or 'max_'
         aggregated_fields = {}
-        for field, operator, _ in self.conditions:
+        conditions = self.conditions
+        for field, op, _ in conditions:
             if field.startswith(('avg_', 'min_', 'max_')):
                 prefix, base_field = field.split('_', 1)  # Split prefix and base field
                 values = [pub[base_field] for pub in self.window_buffer if base_field in pub]
@@ -64,20 +185,20 @@ class Subscription:
                         aggregated_fields[field] = max(values)
 
         # Check if window conditions are met
-        for field, operator, value in self.conditions:
+        for field, op, value in conditions:
             if field.startswith(('avg_', 'min_', 'max_')):
                 if field not in aggregated_fields:
                     return None
                 agg_value = aggregated_fields[field]
-                if operator == ">" and not agg_value > value:
+                if op == ">" and not agg_value > value:
                     return None
-                elif operator == ">=" and not agg_value >= value:
+                elif op == ">=" and not agg_value >= value:
                     return None
-                elif operator == "<" and not agg_value < value:
+                elif op == "<" and not agg_value < value:
                     return None
-                elif operator == "<=" and not agg_value <= value:
+                elif op == "<=" and not agg_value <= value:
                     return None
-                elif operator == "=" and not agg_value == value:
+                elif op == "=" and not agg_value == value:
                     return None
         # Create a meta-publication with aggregated fields
         meta_publication = {
@@ -0,0 +1,389 @@
+import gc
+import itertools
+import mmap
+import os
+import struct
+import threading
+from array import array
+from typing import Any, Dict, Iterable, Iterator, List, Tuple
+
+from .proto import publication_pb2 as pb
+from .subscription import Subscription, field_code, operator_code, reserve_subscription_ids
+
+SNAPSHOT_MAGIC = b'SUBSNAP4'
+# Header: subscriptions, chunks, offset of the chunk index, offset and size of the string table
+SNAPSHOT_HEADER = struct.Struct('<QQQQQ')
+# Chunk header: subscriptions, conditions
+CHUNK_HEADER = struct.Struct('<II')
+CHUNK_SIZE = 4096
+VALUE_INT = 0
+VALUE_FLOAT = 1
+VALUE_STRING = 2
+_INT64 = struct.Struct('<q')
+_DOUBLE = struct.Struct('<d')
+
+JOURNAL_MAGIC = b'SUBJRNL2'
+# Journal entry: operation, payload length
+JOURNAL_ENTRY = struct.Struct('<BI')
+JOURNAL_ADD = 1
+JOURNAL_REMOVE = 2
+_SUBSCRIPTION_ID = struct.Struct('<Q')
+
+
+def subscription_to_record(subscription: Subscription) -> pb.SubscriptionRecord:
+    """Build a SubscriptionRecord carrying a subscription's identity and conditions"""
+    record = pb.SubscriptionRecord(
+        id=subscription.id,
+        subscriber_id=subscription.subscriber_id or '',
+        window_size=subscription.window_size or 0,
+        ttl=subscription.ttl or 0.0,
+    )
+    for field, operator, value in subscription.conditions:
+        condition = record.conditions.add(field=field, operator=operator)
+        if isinstance(value, bool) or isinstance(value, int):
+            condition.int_value = int(value)
+        elif isinstance(value, float):
+            condition.float_value = value
+        else:
+            condition.string_value = str(value)
+    return record
+
+
+def subscription_from_record(record: pb.SubscriptionRecord, subscriber=None) -> Subscription:
+    """Rebuild a Subscription (with its original ID) from a SubscriptionRecord"""
+    conditions = [
+        (condition.field, condition.operator, getattr(condition, condition.WhichOneof('value')))
+        for condition in record.conditions
+    ]
+    return Subscription(conditions, window_size=record.window_size or None,
+                        subscriber=subscriber, subscription_id=record.id, ttl=record.ttl or None)
+
+
+def _column(values, typecode: str) -> bytes:
+    return array(typecode, values).tobytes()
+
+
+def _encode_chunk(subscriptions: List[Subscription], intern) -> bytes:
+    """Encode a chunk of subscriptions column by column"""
+    ids, subscriber_ids, window_sizes, ttls, counts = [], [], [], [], []
+    fields, operators, types, values = [], [], [], []
+    for subscription in subscriptions:
+        ids.append(subscription.id)
+        subscriber_ids.append(intern(subscription.subscriber_id or ''))
+        window_sizes.append(subscription.window_size or 0)
+        ttls.append(subscription.ttl or 0.0)
+        counts.append(subscription.condition_count)
+        for field, operator, value in subscription.conditions:
+            fields.append(intern(field))
+            operators.append(intern(operator))
+            if isinstance(value, bool) or isinstance(value, int):
+                types.append(VALUE_INT)
+                values.append(int(value))
+            elif isinstance(value, float):
+                types.append(VALUE_FLOAT)
+                values.append(_INT64.unpack(_DOUBLE.pack(value))[0])
+            else:
+                types.append(VALUE_STRING)
+                values.append(intern(str(value)))
+    return b''.join([
+        CHUNK_HEADER.pack(len(subscriptions), len(fields)),
+        _column(ids, 'Q'), _column(subscriber_ids, 'I'), _column(window_sizes, 'I'), _column(ttls, 'd'),
+        _column(counts, 'I'),
+        _column(fields, 'I'), _column(operators, 'I'), _column(types, 'B'), _column(values, 'q'),
+    ])
+
+
+def write_snapshot(path: str, subscriptions: Iterable[Subscription], chunk_size: int = CHUNK_SIZE) -> int:
+    """Write a subscription table to a snapshot file and return the number of records
+
+    Subscriptions are stored in chunks of columns (IDs, window sizes, leases, condition
+    fields, operators, values) with every string interned in one table, so loading needs no
+    per-record parsing. The file is written next to the target and renamed over it,
+    so a crash never leaves a half-written snapshot behind.
+    """
+    strings: Dict[str, int] = {}
+
+    def intern(value: str) -> int:
+        index = strings.get(value)
+        if index is None:
+            index = strings[value] = len(strings)
+        return index
+
+    tmp_path = f"{path}.tmp"
+    chunk_offsets = []
+    count = 0
+    with open(tmp_path, 'wb', buffering=1 << 20) as file:
+        file.write(SNAPSHOT_MAGIC)
+        file.write(SNAPSHOT_HEADER.pack(0, 0, 0, 0, 0))
+        position = len(SNAPSHOT_MAGIC) + SNAPSHOT_HEADER.size
+        chunk = []
+        for subscription in itertools.chain(subscriptions, [None]):
+            if subscription is not None:
+                chunk.append(subscription)
+                if len(chunk) < chunk_size:
+                    continue
+            if not chunk:
+                break
+            payload = _encode_chunk(chunk, intern)
+            file.write(payload)
+            chunk_offsets.append(position)
+            position += len(payload)
+            count += len(chunk)
+            chunk = []
+
+        index_offset = position
+        file.write(_column(chunk_offsets, 'Q'))
+        strings_offset = index_offset + len(chunk_offsets) * 8
+        blob = '\x00'.join(strings).encode()
+        file.write(blob)
+        file.seek(len(SNAPSHOT_MAGIC))
+        file.write(SNAPSHOT_HEADER.pack(count, len(chunk_offsets), index_offset, strings_offset, len(blob)))
+    os.replace(tmp_path, path)
+    return count
+
+
+class SubscriptionSnapshot:
+    """Memory-mapped view of a snapshot; the string table and chunks are decoded on first use"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.file = open(path, 'rb')
+        self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic = self.data[:len(SNAPSHOT_MAGIC)]
+        if magic != SNAPSHOT_MAGIC:
+            self.close()
+            if magic[:-1] == SNAPSHOT_MAGIC[:-1]:
+                raise ValueError(f"{path} is a {magic.decode()} snapshot, expected {SNAPSHOT_MAGIC.decode()}")
+            raise ValueError(f"{path} is not a subscription snapshot")
+        (self.count, self.chunk_count, self.index_offset,
+         self.strings_offset, self.strings_size) = SNAPSHOT_HEADER.unpack_from(self.data, len(SNAPSHOT_MAGIC))
+        self._strings = None
+
+    def __len__(self):
+        return self.count
+
+    @property
+    def strings(self) -> List[str]:
+        if self._strings is None:
+            blob = self.data[self.strings_offset:self.strings_offset + self.strings_size]
+            self._strings = blob.decode().split('\x00') if self.strings_size else ['']
+        return self._strings
+
+    def _read_column(self, position: int, typecode: str, length: int) -> Tuple[array, int]:
+        column = array(typecode)
+        end = position + length * column.itemsize
+        column.frombytes(self.data[position:end])
+        return column, end
+
+    def read_chunk(self, chunk_index: int, subscribers: Dict[str, Any] = None) -> List[Subscription]:
+        """Decode one chunk into Subscriptions attached to the given subscribers"""
+        subscribers = subscribers or {}
+        strings = self.strings
+        (position,) = struct.unpack_from('<Q', self.data, self.index_offset + chunk_index * 8)
+        nr_subs, nr_conditions = CHUNK_HEADER.unpack_from(self.data, position)
+        position += CHUNK_HEADER.size
+        ids, position = self._read_column(position, 'Q', nr_subs)
+        subscriber_ids, position = self._read_column(position, 'I', nr_subs)
+        window_sizes, position = self._read_column(position, 'I', nr_subs)
+        ttls, position = self._read_column(position, 'd', nr_subs)
+        counts, position = self._read_column(position, 'I', nr_subs)
+        fields, position = self._read_column(position, 'I', nr_conditions)
+        operators, position = self._read_column(position, 'I', nr_conditions)
+        types, position = self._read_column(position, 'B', nr_conditions)
+        values, _ = self._read_column(position, 'q', nr_conditions)
+        floats = array('d', values.tobytes())
+
+        # Decode every condition of the chunk at once into one flat packed sequence, then
+        # slice it per subscription; conditions were written in canonical order already
+        decoded_values = [
+            values[j] if value_type == VALUE_INT else floats[j] if value_type == VALUE_FLOAT else strings[values[j]]
+            for j, value_type in enumerate(types)
+        ]
+        field_codes = {index: field_code(strings[index]) for index in set(fields)}
+        operator_codes = {index: operator_code(strings[index]) for index in set(operators)}
+        packed = list(itertools.chain.from_iterable(zip(
+            map(field_codes.__getitem__, fields), map(operator_codes.__getitem__, operators), decoded_values)))
+
+        subscriptions = []
+        start = 0
+        for i in range(nr_subs):
+            end = start + counts[i] * 3
+            subscriptions.append(Subscription(
+                window_size=window_sizes[i] or None, ttl=ttls[i] or None,
+                subscriber=subscribers.get(strings[subscriber_ids[i]]), subscription_id=ids[i],
+                packed=tuple(packed[start:end])))
+            start = end
+        if nr_subs:
+            reserve_subscription_ids(max(ids))
+        return subscriptions
+
+    def __iter__(self) -> Iterator[Subscription]:
+        for chunk_index in range(self.chunk_count):
+            yield from self.read_chunk(chunk_index)
+
+    def close(self):
+        if not self.data.closed:
+            self.data.close()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+class SubscriptionJournal:
+    """Append-only log of the adds and removes made since the last snapshot"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.lock = threading.Lock()
+        self.entries = 0
+        new_file = not os.path.exists(path) or os.path.getsize(path) == 0
+        if not new_file:
+            # Cut a torn tail off so new entries follow the last complete one
+            os.truncate(path, _journal_valid_length(path))
+        self.file = open(path, 'ab')
+        if new_file:
+            self.file.write(JOURNAL_MAGIC)
+            self.file.flush()
+
+    def _append(self, operation: int, payloads: Iterable[bytes]):
+        """Append entries of one operation with a single write and flush"""
+        entries = [JOURNAL_ENTRY.pack(operation, len(payload)) + payload for payload in payloads]
+        with self.lock:
+            self.file.write(b''.join(entries))
+            self.file.flush()
+            self.entries += len(entries)
+
+    def append_add(self, subscription: Subscription):
+        self.append_adds([subscription])
+
+    def append_remove(self, subscription_id: int):
+        self.append_removes([subscription_id])
+
+    def append_adds(self, subscriptions: Iterable[Subscription]):
+        self._append(JOURNAL_ADD, (
+            subscription_to_record(subscription).SerializeToString() for subscription in subscriptions))
+
+    def append_removes(self, subscription_ids: Iterable[int]):
+        self._append(JOURNAL_REMOVE, (_SUBSCRIPTION_ID.pack(subscription_id) for subscription_id in subscription_ids))
+
+    def close(self):
+        with self.lock:
+            if not self.file.closed:
+                self.file.close()
+
+
+def _journal_valid_length(path: str) -> int:
+    """Length of the journal up to the end of its last complete entry"""
+    with open(path, 'rb') as file:
+        if file.read(len(JOURNAL_MAGIC)) != JOURNAL_MAGIC:
+            raise ValueError(f"{path} is not a subscription journal")
+        end = len(JOURNAL_MAGIC)
+        size_on_disk = os.fstat(file.fileno()).st_size
+        while True:
+            header = file.read(JOURNAL_ENTRY.size)
+            if len(header) < JOURNAL_ENTRY.size:
+                return end
+            _, size = JOURNAL_ENTRY.unpack(header)
+            if end + JOURNAL_ENTRY.size + size > size_on_disk:
+                return end
+            file.seek(size, os.SEEK_CUR)
+            end += JOURNAL_ENTRY.size + size
+
+
+def read_journal(path: str) -> Iterator[Tuple[int, Any]]:
+    """Yield (JOURNAL_ADD, SubscriptionRecord) or (JOURNAL_REMOVE, subscription ID) in order"""
+    if not os.path.exists(path):
+        return
+    with open(path, 'rb') as file:
+        if file.read(len(JOURNAL_MAGIC)) != JOURNAL_MAGIC:
+            return
+        while True:
+            header = file.read(JOURNAL_ENTRY.size)
+            if len(header) < JOURNAL_ENTRY.size:
+                return
+            operation, size = JOURNAL_ENTRY.unpack(header)
+            payload = file.read(size)
+            if len(payload) < size:
+                # Torn write at the tail of the journal
+                return
+            if operation == JOURNAL_ADD:
+                record = pb.SubscriptionRecord()
+                record.ParseFromString(payload)
+                yield operation, record
+            elif operation == JOURNAL_REMOVE:
+                yield operation, _SUBSCRIPTION_ID.unpack(payload)[0]
+
+
+def iter_subscription_chunks(snapshot_path: str, subscribers: Dict[str, Any] = None,
+                             journal_path: str = None, stats: Dict[str, int] = None) -> Iterator[List[Subscription]]:
+    """Yield the subscriptions of a snapshot plus its journal, one decoded chunk at a time
+
+    The journal is read first, so each snapshot chunk can be filtered as it comes off the
+    memory map and handed to the caller (a broker indexes it straight away) without the
+    whole table ever being built; the journal's surviving adds come last. stats, if
+    given, is filled with counts of what was loaded.
+    """
+    subscribers = subscribers or {}
+    if stats is None:
+        stats = {}
+    stats.update(snapshot=0, journal_adds=0, journal_removes=0)
+    # Final journal state per subscription ID: its latest add, or None once removed
+    journaled: Dict[int, Subscription] = {}
+    for operation, entry in read_journal(journal_path) if journal_path else ():
+        if operation == JOURNAL_ADD:
+            journaled[entry.id] = subscription_from_record(entry, subscribers.get(entry.subscriber_id))
+            stats['journal_adds'] += 1
+        else:
+            journaled[entry] = None
+            stats['journal_removes'] += 1
+    if os.path.exists(snapshot_path):
+        with SubscriptionSnapshot(snapshot_path) as snapshot:
+            stats['snapshot'] = len(snapshot)
+            for chunk_index in range(snapshot.chunk_count):
+                chunk = _read_chunk_without_gc(snapshot, chunk_index, subscribers)
+                if journaled:
+                    chunk = [subscription for subscription in chunk if subscription.id not in journaled]
+                yield chunk
+    added = [subscription for subscription in journaled.values() if subscription is not None]
+    if added:
+        # New subscriptions must not reuse the IDs of loaded ones
+        reserve_subscription_ids(max(subscription.id for subscription in added))
+        yield added
+
+
+def _read_chunk_without_gc(snapshot: SubscriptionSnapshot, chunk_index: int,
+                           subscribers: Dict[str, Any]) -> List[Subscription]:
+    """Decode one chunk with the garbage collector paused
+
+    A chunk is thousands of new long-lived objects that would otherwise trigger collection
+    passes; the pause never spans a yield, so the caller runs with GC as it was.
+    """
+    gc_was_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        return snapshot.read_chunk(chunk_index, subscribers)
+    finally:
+        if gc_was_enabled:
+            gc.enable()
+
+
+def load_subscriptions(snapshot_path: str, subscribers: Dict[str, Any] = None,
+                       journal_path: str = None) -> Tuple[Dict[int, Subscription], Dict[str, int]]:
+    """Rebuild a whole subscription table from a snapshot plus its journal
+
+    subscribers maps subscriber IDs to the Subscriber objects the subscriptions are
+    reattached to. Returns the table and counts of what was loaded.
+    """
+    table: Dict[int, Subscription] = {}
+    stats: Dict[str, int] = {}
+    for chunk in iter_subscription_chunks(snapshot_path, subscribers, journal_path, stats):
+        table.update((subscription.id, subscription) for subscription in chunk)
+    return table, stats
+
+
+def journal_path_for(snapshot_path: str) -> str:
+    return f"{snapshot_path}.journal"
@@ -1,10 +1,14 @@
+import atexit
 import random
 import os
 import json
 import logging
+import queue
+import time
 from datetime import datetime
+from logging.handlers import QueueHandler, QueueListener
 from pathlib import Path
-from typing import Dict, List, Any
+from typing import Dict, List, Any, Optional
 
 valid_types = {'int', 'string', 'float', 'date'}
 
@@ -77,15 +81,108 @@ def create_dir(path):
         os.makedirs(path)
 
 
+# Per-event log levels: events fired per publication or per delivery are verbose
+# (DEBUG) so they cost nothing unless explicitly enabled
+EVENT_LEVELS: Dict[str, int] = {
+    'publication_received': logging.DEBUG,
+    'publication_broadcasted': logging.DEBUG,
+    'publication_batch_broadcasted': logging.DEBUG,
+    'window_buffer_updated': logging.DEBUG,
+    'window_size_reached': logging.DEBUG,
+    'subscriber_notified': logging.DEBUG,
+    'message_received': logging.DEBUG,
+    'broker_batch_failed': logging.ERROR,
+    'publication_decode_failed': logging.ERROR,
+}
+# Fraction of events of a type that are actually emitted (default 1.0)
+EVENT_SAMPLE_RATES: Dict[str, float] = {}
+
+_queue_listener: Optional[QueueListener] = None
+_installed_handlers: List[logging.Handler] = []
+
+
+def configure_events(levels: Dict[str, int] = None, sample_rates: Dict[str, float] = None):
+    """Override the level and/or sampling rate of individual event types"""
+    if levels:
+        EVENT_LEVELS.update(levels)
+    if sample_rates:
+        EVENT_SAMPLE_RATES.update(sample_rates)
+
+
+def event_level(logger: logging.Logger, event_type: str) -> Optional[int]:
+    """Return the level to log an event at, or None if it is disabled or sampled out"""
+    level = EVENT_LEVELS.get(event_type, logging.INFO)
+    if not logger.isEnabledFor(level):
+        return None
+    rate = EVENT_SAMPLE_RATES.get(event_type)
+    if rate is not None and rate < 1.0 and random.random() >= rate:
+        return None
+    return level
+
+
+class _DeferredQueueHandler(QueueHandler):
+    """Queue handler that leaves formatting (and JSON encoding) to the listener thread"""
+
+    def prepare(self, record):
+        return record
+
+
+def json_default(value):
+    """json.dumps fallback: publication records become the dicts they stand for, the rest strings"""
+    to_dict = getattr(value, 'to_dict', None)
+    return to_dict() if to_dict else str(value)
+
+
+class _StructuredEvent:
+    """Log message that serializes its event to JSON only when it is formatted
+
+    Formatting may happen later on the listener thread, so the event keeps a copy of
+    data and of the dicts and lists directly in it, taken when it is logged.
+    """
+    __slots__ = ('created', 'event_type', 'data')
+
+    def __init__(self, event_type: str, data: Dict[str, Any]):
+        self.created = time.time()
+        self.event_type = event_type
+        self.data = data = dict(data)
+        for key, value in data.items():
+            if isinstance(value, (dict, list)):
+                data[key] = value.copy()
+
+    def __str__(self):
+        # Ensure all values in `data` are JSON-serializable
+        sanitized_data = {
+            key: value.decode(errors='replace') if isinstance(value, bytes) else value
+            for key, value in self.data.items()
+        }
+        event = {
+            'timestamp': datetime.fromtimestamp(self.created).isoformat(),
+            'type': self.event_type,
+            'data': sanitized_data
+        }
+        return json.dumps(event, default=json_default)
+
+
 # Configure logging
-def setup_logging(log_dir: str = "logs") -> logging.Logger:
-    """Setup logging configuration"""
+def setup_logging(log_dir: str = "logs", async_logging: bool = True, verbose: bool = False) -> logging.Logger:
+    """Setup logging configuration
+
+    With async_logging, callers only enqueue records; a background listener formats
+    them and writes to the file and console handlers. verbose enables DEBUG events.
+    """
+    global _queue_listener
     # Create logs directory if it doesn't exist
     Path(log_dir).mkdir(exist_ok=True)
 
     # Create a logger
     logger = logging.getLogger('pubsub_system')
-    logger.setLevel(logging.INFO)
+    logger.setLevel(logging.DEBUG if verbose else logging.INFO)
+
+    # Calling setup again (e.g. once per experiment) replaces the previous handlers
+    shutdown_logging()
+    for handler in _installed_handlers:
+        logger.removeHandler(handler)
+    _installed_handlers.clear()
 
     # Create handlers
     timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
@@ -98,22 +195,43 @@ def setup_logging(log_dir: str = "logs") -> logging.Logger:
     console_handler.setFormatter(log_format)
 
     # Add handlers to the logger
-    logger.addHandler(file_handler)
-    logger.addHandler(console_handler)
+    if async_logging:
+        queue_handler = _DeferredQueueHandler(queue.SimpleQueue())
+        _queue_listener = QueueListener(queue_handler.queue, file_handler, console_handler)
+        _queue_listener.start()
+        _installed_handlers.append(queue_handler)
+    else:
+        _installed_handlers.extend([file_handler, console_handler])
+
+    for handler in _installed_handlers:
+        logger.addHandler(handler)
 
     return logger
 
 
-def log_event(logger: logging.Logger, event_type: str, data: Dict[str, Any]):
-    """Log an event with timestamp and structured data"""
-    # Ensure all values in `data` are JSON-serializable
-    sanitized_data = {
-        key: value.decode(errors='replace') if isinstance(value, bytes) else value
-        for key, value in data.items()
-    }
-    event = {
-        'timestamp': datetime.now().isoformat(),
-        'type': event_type,
-        'data': sanitized_data
-    }
-    logger.info(json.dumps(event))
+def shutdown_logging():
+    """Stop the background listener, flushing every queued record"""
+    global _queue_listener
+    if _queue_listener is not None:
+        _queue_listener.stop()
+        for handler in _queue_listener.handlers:
+            handler.close()
+        _queue_listener = None
+
+
+atexit.register(shutdown_logging)
+
+
+def log_event(logger: logging.Logger, event_type: str, data: Dict[str, Any], level: int = None):
+    """Log an event with timestamp and structured data
+
+    Hot paths can call event_level() first and pass the result as level, so the
+    data dict is only built for events that will actually be emitted. data and the
+    dicts/lists directly in it are copied when the event is logged; anything nested
+    deeper is serialized later, on the listener thread, and must not be mutated.
+    """
+    if level is None:
+        level = event_level(logger, event_type)
+        if level is None:
+            return
+    logger.log(level, _StructuredEvent(event_type, data))
@@ -0,0 +1,335 @@
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import argparse
+import itertools
+import json
+import logging
+import platform
+import random
+import statistics
+import time
+from datetime import datetime
+
+from core.broker import Broker
+from core.generator_configs import Configs
+from core.generator_pub_sub import GeneratorPubSub
+from core.metrics import MetricsRegistry
+from core.publisher import Publisher
+from core.subscriber import Subscriber
+from core.subscription import Subscription
+from core.utils import log_event
+
+SEED = 1234
+ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+DEFAULT_CONFIG = os.path.join(ROOT_DIR, 'generator_configs.json')
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmark_baseline.json')
+DEFAULT_THRESHOLD = 0.10
+# Benchmarks that take long to set up, skipped with --quick
+LARGE_BENCHMARKS = {'broker_process_publication_100k', 'broker_process_sharded_100k'}
+
+# name -> setup(configs) returning (run, ops): run() performs ops operations
+BENCHMARKS = {}
+
+
+def benchmark(name):
+    def register(setup):
+        BENCHMARKS[name] = setup
+        return setup
+    return register
+
+
+def _quiet_logger(name='pubsub_benchmark', level=logging.WARNING):
+    """Logger that drops the structured events of the code under test"""
+    logger = logging.getLogger(name)
+    logger.setLevel(level)
+    logger.propagate = False
+    return logger
+
+
+def _generate_subscriptions(configs, nr_subs):
+    """Generate nr_subs subscriptions as (field, operator, value) lists"""
+    generator = GeneratorPubSub(configs)
+    result, timing = [None], {}
+    generator.generate_subs(nr_subs, result, 0, 1, timing)
+    return [[(field, op_val[0], op_val[1]) for field, op_val in sub.items()] for sub in result[0]]
+
+
+def _generate_publications(configs, nr_pubs):
+    generator = GeneratorPubSub(configs)
+    return [generator.generate_pub() for _ in range(nr_pubs)]
+
+
+@benchmark('subscription_matches')
+def _bench_subscription_matches(configs):
+    subscriptions = [Subscription(conditions) for conditions in _generate_subscriptions(configs, 1000)]
+    publications = _generate_publications(configs, 1000)
+    pairs = list(zip(subscriptions, publications))
+
+    def run():
+        for subscription, publication in pairs:
+            subscription.matches(publication)
+    return run, len(pairs)
+
+
+def _bench_process_publication(configs, nr_subs, batch_size=1, match_shards=1):
+    metrics = MetricsRegistry()
+    logger = _quiet_logger()
+    # The 100 cycled publications would all be cache hits; measure the matching itself
+    broker = Broker('broker_bench', logger=logger, metrics=metrics, match_cache_size=0, match_shards=match_shards)
+    subscribers = [
+        Subscriber(f"subscriber_{i}", logger, pass_generation=True, metrics=metrics, history_size=1000)
+        for i in range(10)
+    ]
+    for i, conditions in enumerate(_generate_subscriptions(configs, nr_subs)):
+        broker.add_subscription(Subscription(conditions, subscriber=subscribers[i % len(subscribers)]))
+    publications = itertools.cycle(_generate_publications(configs, 100))
+    ops = max(1, 100000 // nr_subs)
+
+    if batch_size > 1:
+        ops = max(ops, batch_size)
+        batches = ops // batch_size
+
+        def run():
+            for _ in range(batches):
+                broker.process_batch([next(publications) for _ in range(batch_size)])
+        return run, batches * batch_size
+
+    def run():
+        for _ in range(ops):
+            broker.process_publication(next(publications))
+    return run, ops
+
+
+@benchmark('broker_process_publication_1k')
+def _bench_process_publication_1k(configs):
+    return _bench_process_publication(configs, 1000)
+
+
+@benchmark('broker_process_publication_10k')
+def _bench_process_publication_10k(configs):
+    return _bench_process_publication(configs, 10000)
+
+
+@benchmark('broker_process_batch_10k')
+def _bench_process_batch_10k(configs):
+    return _bench_process_publication(configs, 10000, batch_size=32)
+
+
+@benchmark('broker_process_publication_100k')
+def _bench_process_publication_100k(configs):
+    return _bench_process_publication(configs, 100000)
+
+
+@benchmark('broker_process_sharded_100k')
+def _bench_process_sharded_100k(configs):
+    return _bench_process_publication(configs, 100000, batch_size=32, match_shards=4)
+
+
+@benchmark('subscription_process_window')
+def _bench_process_window(configs):
+    subscription = Subscription(
+        [('city', '=', 'Cluj'), ('avg_temperature', '>', -100.0), ('max_wind', '>=', 0.0)], window_size=10)
+    subscription.window_buffer = _generate_publications(configs, 10)
+    ops = 1000
+
+    def run():
+        for _ in range(ops):
+            subscription.process_window()
+    return run, ops
+
+
+@benchmark('publisher_encode')
+def _bench_publisher_encode(configs):
+    publisher = Publisher(configs, metrics=MetricsRegistry())
+    ops = 1000
+
+    def run():
+        for _ in range(ops):
+            publisher.build_publication_proto()
+    return run, ops
+
+
+@benchmark('broker_decode')
+def _bench_broker_decode(configs):
+    publisher = Publisher(configs, metrics=MetricsRegistry())
+    broker = Broker('broker_bench', logger=_quiet_logger(), metrics=MetricsRegistry())
+    serialized_pubs = [publisher.build_publication_proto() for _ in range(1000)]
+
+    def run():
+        for serialized_pub in serialized_pubs:
+            broker.decode_publication(serialized_pub, 0, 0)
+    return run, len(serialized_pubs)
+
+
+@benchmark('log_event_disabled')
+def _bench_log_event_disabled(configs):
+    logger = _quiet_logger('pubsub_benchmark_disabled', logging.INFO)
+    data = {'broker_id': 'broker_bench', 'publication': _generate_publications(configs, 1)[0]}
+    ops = 10000
+
+    def run():
+        for _ in range(ops):
+            log_event(logger, 'publication_received', data)
+    return run, ops
+
+
+@benchmark('log_event_emitted')
+def _bench_log_event_emitted(configs):
+    logger = _quiet_logger('pubsub_benchmark_emitted', logging.INFO)
+    if not logger.handlers:
+        handler = logging.StreamHandler(open(os.devnull, 'w'))
+        handler.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
+        logger.addHandler(handler)
+    data = {'broker_id': 'broker_bench', 'subscription_id': 'sub_bench', 'window_size': 10}
+    ops = 1000
+
+    def run():
+        for _ in range(ops):
+            log_event(logger, 'window_subscription_generated', data)
+    return run, ops
+
+
+@benchmark('generator_generate_pub')
+def _bench_generate_pub(configs):
+    generator = GeneratorPubSub(configs)
+    ops = 1000
+
+    def run():
+        for _ in range(ops):
+            generator.generate_pub()
+    return run, ops
+
+
+@benchmark('generator_generate_subs')
+def _bench_generate_subs(configs):
+    generator = GeneratorPubSub(configs)
+    ops = 1000
+
+    def run():
+        generator.generate_subs(ops, [None], 0, 1, {})
+    return run, ops
+
+
+def run_benchmark(name, configs, rounds=5, min_time=0.2):
+    """Time one benchmark and return its per-operation statistics (nanoseconds)"""
+    random.seed(SEED)
+    run, ops = BENCHMARKS[name](configs)
+    run()  # warm-up
+
+    # Repeat the workload so a round lasts at least min_time
+    started_ns = time.perf_counter_ns()
+    run()
+    single_ns = max(1, time.perf_counter_ns() - started_ns)
+    loops = max(1, int(min_time * 1e9 / single_ns))
+
+    per_op = []
+    for _ in range(rounds):
+        started_ns = time.perf_counter_ns()
+        for _ in range(loops):
+            run()
+        per_op.append((time.perf_counter_ns() - started_ns) / (loops * ops))
+
+    median = statistics.median(per_op)
+    return {
+        'ns_per_op': median,
+        'min_ns_per_op': min(per_op),
+        'max_ns_per_op': max(per_op),
+        'stdev_pct': statistics.pstdev(per_op) / median * 100 if median else 0.0,
+        'rounds': rounds,
+        'ops_per_round': loops * ops,
+    }
+
+
+def run_suite(config_path=DEFAULT_CONFIG, names=None, rounds=5, min_time=0.2):
+    """Run the selected benchmarks (all by default) and return the results document"""
+    configs = Configs(config_path=config_path)
+    results = {}
+    for name in names or BENCHMARKS:
+        print(f"Running {name}...")
+        results[name] = run_benchmark(name, configs, rounds, min_time)
+        print(f"  {results[name]['ns_per_op']:,.0f} ns/op (±{results[name]['stdev_pct']:.1f}%)")
+    return {
+        'created_at': datetime.now().isoformat(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'seed': SEED,
+        'config': os.path.basename(config_path),
+        'benchmarks': results,
+    }
+
+
+def compare(current, baseline, threshold=DEFAULT_THRESHOLD):
+    """Compare two results documents; a benchmark regresses if it got slower by more than threshold"""
+    rows = []
+    for name, result in current['benchmarks'].items():
+        base = baseline['benchmarks'].get(name)
+        if base is None:
+            rows.append({'benchmark': name, 'baseline': None, 'current': result['ns_per_op'],
+                         'change': None, 'status': 'new'})
+            continue
+        change = (result['ns_per_op'] - base['ns_per_op']) / base['ns_per_op']
+        if change > threshold:
+            status = 'REGRESSION'
+        elif change < -threshold:
+            status = 'improved'
+        else:
+            status = 'ok'
+        rows.append({'benchmark': name, 'baseline': base['ns_per_op'], 'current': result['ns_per_op'],
+                     'change': change, 'status': status})
+    return rows
+
+
+def print_comparison(rows, threshold):
+    print(f"\n{'benchmark':<36}{'baseline ns/op':>16}{'current ns/op':>16}{'change':>10}  status")
+    for row in rows:
+        baseline = f"{row['baseline']:,.0f}" if row['baseline'] is not None else '-'
+        change = f"{row['change'] * 100:+.1f}%" if row['change'] is not None else '-'
+        print(f"{row['benchmark']:<36}{baseline:>16}{row['current']:>16,.0f}{change:>10}  {row['status']}")
+    regressions = [row['benchmark'] for row in rows if row['status'] == 'REGRESSION']
+    if regressions:
+        print(f"\n{len(regressions)} regression(s) beyond {threshold * 100:.0f}%: {', '.join(regressions)}")
+    else:
+        print(f"\nNo regressions beyond {threshold * 100:.0f}%")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Microbenchmarks of the matching, windowing and serialization hot paths")
+    parser.add_argument('--config', default=DEFAULT_CONFIG, help="generator config used to build the workloads")
+    parser.add_argument('--only', nargs='+', choices=sorted(BENCHMARKS), help="run only these benchmarks")
+    parser.add_argument('--quick', action='store_true', help=f"skip {', '.join(sorted(LARGE_BENCHMARKS))}")
+    parser.add_argument('--rounds', type=int, default=5, help="timed rounds per benchmark (median is reported)")
+    parser.add_argument('--min-time', type=float, default=0.2, help="minimum duration of one round in seconds")
+    parser.add_argument('--output', help="write the results to this JSON file")
+    parser.add_argument('--save-baseline', nargs='?', const=DEFAULT_BASELINE, metavar='PATH',
+                        help="store the results as the baseline (default: evaluation/benchmark_baseline.json)")
+    parser.add_argument('--compare', nargs='?', const=DEFAULT_BASELINE, metavar='PATH',
+                        help="compare against a stored baseline and exit with status 1 on regressions")
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                        help="relative slowdown that counts as a regression (default: 0.10)")
+    parser.add_argument('--list', action='store_true', help="list the benchmarks and exit")
+    args = parser.parse_args()
+
+    if args.list:
+        print('\n'.join(BENCHMARKS))
+        return 0
+
+    names = args.only or [name for name in BENCHMARKS if not (args.quick and name in LARGE_BENCHMARKS)]
+    results = run_suite(args.config, names, args.rounds, args.min_time)
+
+    for path in filter(None, (args.output, args.save_baseline)):
+        with open(path, 'w') as file:
+            json.dump(results, file, indent=2)
+        print(f"Results written to {path}")
+
+    if args.compare:
+        with open(args.compare) as file:
+            baseline = json.load(file)
+        if print_comparison(compare(results, baseline, args.threshold), args.threshold):
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
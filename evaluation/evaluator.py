@@ -2,92 +2,218 @@ import sys
 import os
 from core.generator_pub_sub import GeneratorPubSub
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import asyncio
 import time
+import random
 import json
 import csv
+import argparse
 from datetime import datetime
-from core.publisher import Publisher
-from core.broker_network import BrokerNetwork
+from core.publisher import Publisher, ARRIVAL_MODES
+from core.publication_log import replay, REPLAY_MODES
+from core.broker_network import BrokerNetwork, snapshots_exist
 from core.generator_configs import Configs
+from core.records import Schema
 from core.subscriber import Subscriber
+from core.metrics import MetricsRegistry, CsvSnapshotter
 from core.utils import setup_logging, log_event
 
 
 def print_subscriber_messages(subscriber: Subscriber, file_path=None):
-    """Print received messages for a subscriber"""
-    with open(file_path, 'w') as file:
-        file.write(f"Messages received by {subscriber.subscriber_id}:\n")
-        for msg in subscriber.received_messages:
-            file.write(json.dumps(msg, indent=2) + '\n')
-
-def run_experiment(config_path: str, label: str):
-    """Run the experiment with the given configuration path and label."""
-    logger = setup_logging()
+    """Stream the messages received by a subscriber to a file (one JSON object per line)"""
+    subscriber.flush_messages(file_path)
+
+def window_condition(generator: GeneratorPubSub):
+    """Random aggregate condition (avg/min/max over a numeric field) for a window subscription"""
+    field = random.choice([item for item in generator.configs.schema if item['type'] in ('int', 'float')])
+    prefix = random.choice(['avg', 'min', 'max'])
+    return (f"{prefix}_{field['name']}", random.choice(generator.operators), generator.generate_random_value(field))
+
+def create_subscriptions(generator: GeneratorPubSub, all_subs, subscribers, broker_network: BrokerNetwork,
+                         window_share: float = 0.0):
+    """Spread generated subscriptions over the subscribers, the first window_share of them as window ones"""
+    nr_window = int(round(len(all_subs) * window_share))
+    simple = [[] for _ in subscribers]
+    window = [[] for _ in subscribers]
+    for i, sub_dict in enumerate(all_subs):
+        sub_list = [(field, op_val[0], op_val[1]) for field, op_val in sub_dict.items()]
+        if i < nr_window:
+            window[i % len(subscribers)].append(sub_list + [window_condition(generator)])
+        else:
+            simple[i % len(subscribers)].append(sub_list)
+
+    subscriptions = []
+    for subscriber, simple_conditions, window_conditions in zip(subscribers, simple, window):
+        subscriptions.extend(subscriber.create_subscriptions(window_conditions, window_size=10))
+        subscriptions.extend(subscriber.create_subscriptions(simple_conditions))
+    broker_network.add_subscriptions(subscriptions)
+
+RUNTIMES = ('threads', 'asyncio')
+
+
+async def run_async_session(broker_network: BrokerNetwork, subscribers, publisher: Publisher, duration: float,
+                            rate: float = None, arrival: str = 'constant'):
+    """Run the brokers, subscribers and publisher as tasks on one event loop for duration seconds"""
+    broker_network.start_async()
+    for subscriber in subscribers:
+        subscriber.start_async()
+    publisher.start_async(rate=rate, arrival=arrival)
+    try:
+        await asyncio.sleep(duration)
+    finally:
+        await publisher.stop_async()
+        for subscriber in subscribers:
+            await subscriber.stop_async()
+        await broker_network.stop_async()
+
+def run_experiment(config_path: str, label: str, record_dir: str = None,
+                   replay_dir: str = None, replay_mode: str = 'original', replay_rate: float = None,
+                   rate: float = None, arrival: str = 'constant', publish_batch: int = 1,
+                   verbose_log: bool = False, metrics_interval: float = None,
+                   profile_every: int = 0, profile_top: int = 20,
+                   num_brokers: int = 3, duration: float = 180, settle_time: float = 20,
+                   nr_subs: int = None, equality_ratio: float = None, window_share: float = 0.0,
+                   snapshot_dir: str = None, rebalance_interval: float = None,
+                   match_cache_size: int = 0, batch_size: int = 1, batch_deadline_us: float = 0,
+                   runtime: str = 'threads', match_shards: int = 1):
+    """Run the experiment with the given configuration path and label.
+
+    With record_dir the publication stream is saved for later runs; with replay_dir a
+    previously recorded stream is pushed through the brokers instead of fresh publications.
+    With rate the publisher offers a fixed open-loop load instead of its default bursts.
+    With metrics_interval the per-stage metrics are also snapshotted to CSV periodically.
+    With profile_every the brokers profile every Nth publication per subscription and
+    write their profile_top most expensive subscriptions to profiles_<label>/.
+    nr_subs and equality_ratio override the config's subscription count and equality
+    frequencies; window_share is the fraction of subscriptions created as window ones.
+    With snapshot_dir the brokers warm-start from the subscription snapshots in it, or
+    save snapshots there after generating the subscriptions if there are none yet.
+    With rebalance_interval subscriptions migrate from hot to cold brokers while running.
+    match_cache_size bounds each broker's match-result cache (0, the default, disables it).
+    batch_size and batch_deadline_us set each broker's micro-batching (1 processes one at a time).
+    match_shards > 1 splits each broker's matching over that many worker processes.
+    runtime 'asyncio' runs every component as a task on one event loop instead of threads.
+    """
+    if runtime not in RUNTIMES:
+        raise ValueError(f"Unknown runtime '{runtime}', expected one of {RUNTIMES}")
+    if runtime == 'asyncio' and replay_dir:
+        raise ValueError("Replay runs only with the threads runtime")
+    logger = setup_logging(verbose=verbose_log)
     print(f"\nRunning experiment with config: {label} ({config_path})")
     configs = Configs(config_path=config_path)
+    if nr_subs is not None:
+        configs.subs = nr_subs
+    if equality_ratio is not None:
+        # Applies to the fields the config already constrains, or to every field if none
+        eq_fields = configs.freq_equality or configs.freq_fields
+        configs.freq_equality = {field: equality_ratio for field in eq_fields}
+
+    # A fixed seed keeps the subscription set identical between recorded and replayed runs
+    if configs.seed is not None:
+        random.seed(configs.seed)
 
     # Initialize GeneratorPubSub
     generator = GeneratorPubSub(configs)
     print(f"Generator initialized with config: {configs.__dict__}")
-    _, all_subs, *_ = generator.generate(iteration=0, thread_num=4)  # Only need subs
-    rain_count = 0
-    rain_eq_count = 0
-
-    for sub in all_subs:
-        if 'rain' in sub:
-            rain_count += 1
-            if sub['rain'][0] == "=":
-                rain_eq_count += 1
-
-    if rain_count > 0:
-        rain_eq_percentage = rain_eq_count / rain_count
-    else:
-        rain_eq_percentage = 0
-    print(f"Total subscriptions with 'rain': {rain_count}")
-    print(f"Total subscriptions with '=' operator on rain: {rain_eq_count}")
-    print (f"Percentage of subscriptions with 'rain': {rain_eq_count / rain_count:.2%}")
-    time.sleep(20)
-    broker_network = BrokerNetwork(num_brokers=3, window_size=10, logger=logger)
-    broker_network.start()
+    warm_start = bool(snapshot_dir) and snapshots_exist(snapshot_dir, num_brokers)
+    all_subs = []
+    if not warm_start:
+        _, all_subs, *_ = generator.generate(iteration=0, thread_num=4)  # Only need subs
+        rain_count = 0
+        rain_eq_count = 0
 
-    print(f"Percentage of '=' operator on rain: {rain_eq_percentage:.2%}")
-    subscribers = [Subscriber(f"subscriber_{i}", logger, configs, True) for i in range(3)]
-    for subscriber in subscribers:
-        subscriber.start()
+        for sub in all_subs:
+            if 'rain' in sub:
+                rain_count += 1
+                if sub['rain'][0] == "=":
+                    rain_eq_count += 1
 
-    print(f"Creating {len(all_subs)} subscriptions across {len(subscribers)} subscribers...")
+        if rain_count > 0:
+            rain_eq_percentage = rain_eq_count / rain_count
+        else:
+            rain_eq_percentage = 0
+        print(f"Total subscriptions with 'rain': {rain_count}")
+        print(f"Total subscriptions with '=' operator on rain: {rain_eq_count}")
+        print(f"Percentage of '=' operator on rain: {rain_eq_percentage:.2%}")
+    time.sleep(settle_time)
+    # Fresh registry per experiment so the two configurations don't mix
+    metrics = MetricsRegistry()
+    run_label = label.replace('%', '')
+    snapshotter = None
+    if metrics_interval:
+        snapshotter = CsvSnapshotter(metrics, f"metrics_{run_label}.csv", metrics_interval)
+        snapshotter.start()
+    broker_network = BrokerNetwork(num_brokers=num_brokers, window_size=10, logger=logger, metrics=metrics,
+                                   match_cache_size=match_cache_size, schema=Schema.from_configs(configs),
+                                   batch_size=batch_size, batch_deadline_us=batch_deadline_us,
+                                   match_shards=match_shards)
+    if profile_every:
+        broker_network.enable_profiling(profile_every)
+    if runtime == 'threads':
+        broker_network.start()
+    if rebalance_interval:
+        broker_network.start_rebalancing(rebalance_interval)
 
-    for i, sub_dict in enumerate(all_subs):
-        sub_list = [(field, op_val[0], op_val[1]) for field, op_val in sub_dict.items()]
-        subscriber = subscribers[i % len(subscribers)]
-        subscription = subscriber.create_simple_subscription(sub_list)
-        broker_network.add_subscription(subscription)
+    subscribers = [
+        Subscriber(f"subscriber_{i}", logger, configs, True, metrics=metrics,
+                   spill_path=f"subscriber_{i}_messages.ndjson")
+        for i in range(3)
+    ]
+    if runtime == 'threads':
+        for subscriber in subscribers:
+            subscriber.start()
+
+    if warm_start:
+        started = time.perf_counter()
+        restored = broker_network.load_snapshots(
+            snapshot_dir, {subscriber.subscriber_id: subscriber for subscriber in subscribers})
+        print(f"Restored {restored} subscriptions from {snapshot_dir} in {time.perf_counter() - started:.2f}s")
+    else:
+        print(f"Creating {len(all_subs)} subscriptions across {len(subscribers)} subscribers...")
+        create_subscriptions(generator, all_subs, subscribers, broker_network, window_share)
+        if snapshot_dir:
+            saved = broker_network.save_snapshots(snapshot_dir)
+            print(f"Saved {saved} subscriptions to {snapshot_dir}")
     delivered_messages = 0
-    latencies = []
 
-    publisher = Publisher(configs)
-    publisher.start()
+    publisher = Publisher(configs, record_path=record_dir, sink=broker_network,
+                          sink_batch_size=publish_batch, metrics=metrics)
+    if replay_dir:
+        replay_stats = replay(replay_dir, broker_network, replay_mode, replay_rate)
+        delivered_messages = replay_stats['replayed_publications']
+        broker_network.wait_until_drained()
+        print(f"Replay finished: {replay_stats}")
+    elif runtime == 'threads':
+        publisher.start(rate=rate, arrival=arrival)
 
-    start_time = time.time()
-    run_duration = 180  # 3 minutes
+    run_duration = 0 if replay_dir else duration
 
     try:
-        while time.time() - start_time < run_duration:
-            if not publisher.publication_queue.empty():
-                publication = publisher.get_publication()
-                broker_network.publish(publication)
-                delivered_messages += 1
-            time.sleep(0.001)
+        if runtime == 'asyncio':
+            # Everything is started, run and stopped on one event loop
+            asyncio.run(run_async_session(broker_network, subscribers, publisher, run_duration, rate, arrival))
+        else:
+            # The publisher threads push straight into the broker network
+            time.sleep(run_duration)
 
     finally:
-        # Stop everything cleanly
-        for subscriber in subscribers:
-            print_subscriber_messages(subscriber, f"{subscriber.subscriber_id}_messages.json")
+        if runtime == 'threads':
+            publisher.stop()
+        if not replay_dir:
+            delivered_messages = publisher.generated_publications
+
+        # Stop everything cleanly, then flush: brokers may still deliver until they stop
+        if runtime == 'threads':
+            for subscriber in subscribers:
+                subscriber.stop()
+            broker_network.stop()
 
         for subscriber in subscribers:
-            subscriber.stop()
-        broker_network.stop()
-        publisher.stop()
+            print_subscriber_messages(subscriber, f"{subscriber.subscriber_id}_messages.ndjson")
+        if snapshotter:
+            snapshotter.stop()
+        if profile_every:
+            broker_network.dump_profile_reports(f"profiles_{run_label}", profile_top)
 
     print(f"\n=== Experiment Results for {label} ===")
 
@@ -98,23 +224,36 @@ def run_experiment(config_path: str, label: str):
               })
 
     print(f"\nPublications generated: {publisher.generated_publications}")
+    rate_stats = publisher.get_rate_stats()
+    if rate_stats['target_rate']:
+        print(f"Offered load: {rate_stats['achieved_rate']:.1f} msg/s achieved "
+              f"vs {rate_stats['target_rate']} msg/s target ({rate_stats['arrival']})")
     pubs = publisher.generated_publications
-    for subscriber in subscribers:
-        latencies.extend(subscriber.latencies)
-    avg_latency_ms = sum(latencies) / len(latencies) if latencies else 0
+    latency_count = sum(subscriber.latency_count for subscriber in subscribers)
+    latency_sum_ms = sum(subscriber.latency_sum_ms for subscriber in subscribers)
+    avg_latency_ms = latency_sum_ms / latency_count if latency_count else 0
+    latency_hist = metrics.merged_histogram('pubsub_delivery_latency_seconds')
+    metrics.dump_prometheus(f"metrics_{run_label}.prom")
+    for stage in ('publish', 'dequeue', 'decode', 'match', 'deliver'):
+        stage_hist = metrics.merged_histogram('pubsub_stage_seconds', stage=stage)
+        print(f"Stage {stage}: p50 {stage_hist.percentile(0.5) * 1e3:.3f} ms, "
+              f"p99 {stage_hist.percentile(0.99) * 1e3:.3f} ms, "
+              f"p999 {stage_hist.percentile(0.999) * 1e3:.3f} ms")
     broker_stats = broker_network.get_all_broker_stats()
     total_matches = sum(b["matches_found"] for b in broker_stats)
     total_attempts = sum(b["matching_attempts"] for b in broker_stats)
     match_rate = (total_matches / total_attempts * 100) if total_attempts > 0 else 0
 
     # Save broker stats CSV
-    broker_csv_file = f"broker_stats_{label.replace('%','')}.csv"
+    broker_csv_file = f"broker_stats_{run_label}.csv"
     with open(broker_csv_file, mode='w', newline='') as csvfile:
         fieldnames = [
             "broker_id", "received_publications","sent_to_subscribers",
-            "matching_attempts", "matches_found", "timestamp", "average_latency_ms"
+            "matching_attempts", "matches_found", "expired_subscriptions", "subscriptions",
+            "distinct_predicates", "predicate_evaluations", "match_cache_hit_rate", "match_cache_bytes",
+            "avg_batch_size", "timestamp", "average_latency_ms"
         ]
-        writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
+        writer = csv.DictWriter(csvfile, fieldnames=fieldnames, extrasaction='ignore')
         writer.writeheader()
         timestamp = datetime.now().isoformat()
         for stat in broker_stats:
@@ -126,12 +265,189 @@ def run_experiment(config_path: str, label: str):
     return {
         "config": label,
         "delivered": delivered_messages,
+        "throughput": delivered_messages / run_duration if run_duration else rate_stats['achieved_rate'],
         "avg_latency_ms": avg_latency_ms,
+        "p50_latency_ms": latency_hist.percentile(0.5) * 1e3,
+        "p99_latency_ms": latency_hist.percentile(0.99) * 1e3,
+        "p999_latency_ms": latency_hist.percentile(0.999) * 1e3,
         "match_rate_percent": match_rate,
+        "target_rate": rate_stats['target_rate'],
+        "achieved_rate": rate_stats['achieved_rate'],
     }
 
+SEARCH_MODES = ('ramp', 'binary')
+STEP_FIELDS = ["rate", "achieved_rate", "p50_latency_ms", "p99_latency_ms", "queue_growth",
+               "final_queue_depth", "drained", "sustained", "limits"]
+
+def _growth_rate(samples):
+    """Least-squares slope of (seconds, queue depth) samples, in publications per second"""
+    if len(samples) < 2:
+        return 0.0
+    mean_t = sum(t for t, _ in samples) / len(samples)
+    mean_depth = sum(depth for _, depth in samples) / len(samples)
+    variance = sum((t - mean_t) ** 2 for t, _ in samples)
+    if not variance:
+        return 0.0
+    return sum((t - mean_t) * (depth - mean_depth) for t, depth in samples) / variance
+
+def run_load_step(broker_network: BrokerNetwork, publisher: Publisher, metrics: MetricsRegistry,
+                  rate: float, duration: float, slo_p99_ms: float, max_growth: float,
+                  arrival: str = 'constant', sample_interval: float = 0.25, drain_timeout: float = 60):
+    """Offer one fixed rate for duration seconds and judge whether the network sustained it
+
+    A rate is sustained when the publisher kept up with it, the deepest broker queue did
+    not keep growing (slope at most max_growth * rate), the backlog drained afterwards and
+    the p99 delivery latency, including the time spent draining, stayed within the SLO.
+    """
+    metrics.reset_histograms('pubsub_delivery_latency_seconds')
+    publisher.start(rate=rate, arrival=arrival)
+    samples = []
+    started = time.monotonic()
+    while time.monotonic() - started < duration:
+        # Every broker sees every publication, so the deepest queue is the one to watch
+        deepest = max(broker.publication_queue.qsize() for broker in broker_network.brokers)
+        samples.append((time.monotonic() - started, deepest))
+        time.sleep(sample_interval)
+    publisher.stop()
+
+    final_depth = broker_network.queue_depth()
+    drained = broker_network.wait_until_drained(drain_timeout)
+    if not drained:
+        # Don't let an overload leak into the next step
+        for broker in broker_network.brokers:
+            while not broker.publication_queue.empty():
+                broker.publication_queue.get_nowait()
+    time.sleep(0.2)  # let the last dequeued publications reach their subscribers
+
+    rate_stats = publisher.get_rate_stats()
+    latency_hist = metrics.merged_histogram('pubsub_delivery_latency_seconds')
+    growth = _growth_rate(samples)
+    limits = []
+    if rate_stats['achieved_rate'] < 0.95 * rate:
+        limits.append('publisher')
+    if growth > max_growth * rate:
+        limits.append('queue_growth')
+    if not drained:
+        limits.append('backlog')
+    if latency_hist.percentile(0.99) * 1e3 > slo_p99_ms:
+        limits.append('p99')
+    return {
+        "rate": rate,
+        "achieved_rate": rate_stats['achieved_rate'],
+        "p50_latency_ms": latency_hist.percentile(0.5) * 1e3,
+        "p99_latency_ms": latency_hist.percentile(0.99) * 1e3,
+        "queue_growth": growth,
+        "final_queue_depth": final_depth,
+        "drained": drained,
+        "sustained": not limits,
+        "limits": '+'.join(limits),
+    }
+
+def find_saturation(config_path: str, label: str, slo_p99_ms: float = 50.0, search: str = 'ramp',
+                    start_rate: float = 100.0, max_rate: float = 10000.0, step_rate: float = None,
+                    step_duration: float = 10.0, max_growth: float = 0.05, arrival: str = 'constant',
+                    num_brokers: int = 3, nr_subs: int = None, window_share: float = 0.0,
+                    verbose_log: bool = False, batch_size: int = 1, batch_deadline_us: float = 0,
+                    match_shards: int = 1):
+    """Search for the highest publication rate the broker network sustains within a p99 latency SLO
+
+    'ramp' raises the offered load by step_rate until a step fails; 'binary' bisects
+    between start_rate and max_rate until the interval is no wider than step_rate.
+    step_rate defaults to start_rate.
+    """
+    if search not in SEARCH_MODES:
+        raise ValueError(f"Unknown search mode '{search}', expected one of {SEARCH_MODES}")
+    step_rate = step_rate or start_rate
+    logger = setup_logging(verbose=verbose_log)
+    print(f"\nSearching saturation throughput for config: {label} ({config_path})")
+    configs = Configs(config_path=config_path)
+    if nr_subs is not None:
+        configs.subs = nr_subs
+    if configs.seed is not None:
+        random.seed(configs.seed)
+
+    generator = GeneratorPubSub(configs)
+    _, all_subs, *_ = generator.generate(iteration=0, thread_num=4)
+    metrics = MetricsRegistry()
+    run_label = label.replace('%', '')
+    broker_network = BrokerNetwork(num_brokers=num_brokers, window_size=10, logger=logger, metrics=metrics,
+                                   schema=Schema.from_configs(configs),
+                                   batch_size=batch_size, batch_deadline_us=batch_deadline_us,
+                                   match_shards=match_shards)
+    broker_network.start()
+    subscribers = [
+        Subscriber(f"subscriber_{i}", logger, configs, True, metrics=metrics, history_size=1000)
+        for i in range(3)
+    ]
+    for subscriber in subscribers:
+        subscriber.start()
+    create_subscriptions(generator, all_subs, subscribers, broker_network, window_share)
+    publisher = Publisher(configs, sink=broker_network, metrics=metrics)
+
+    steps = []
+
+    def try_rate(rate):
+        step = run_load_step(broker_network, publisher, metrics, rate, step_duration,
+                             slo_p99_ms, max_growth, arrival)
+        steps.append(step)
+        print(f"Rate {rate:.0f} msg/s: achieved {step['achieved_rate']:.0f}, "
+              f"p99 {step['p99_latency_ms']:.2f} ms, queue growth {step['queue_growth']:.1f}/s -> "
+              f"{'sustained' if step['sustained'] else 'saturated (' + step['limits'] + ')'}")
+        return step['sustained']
+
+    best = None
+    try:
+        if search == 'ramp':
+            rate = start_rate
+            while rate <= max_rate and try_rate(rate):
+                best = rate
+                rate += step_rate
+        elif try_rate(start_rate):
+            low, high = start_rate, max_rate
+            if try_rate(high):
+                low = high
+            while high - low > step_rate:
+                middle = (low + high) / 2
+                if try_rate(middle):
+                    low = middle
+                else:
+                    high = middle
+            best = low
+    finally:
+        for subscriber in subscribers:
+            subscriber.stop()
+        broker_network.stop()
+
+    result = {
+        "config": label,
+        "search": search,
+        "slo_p99_ms": slo_p99_ms,
+        "num_subscriptions": len(all_subs),
+        "num_brokers": num_brokers,
+        "max_sustained_rate": best,
+        "steps": steps,
+    }
+    log_event(logger, 'saturation_search_completed', {
+        'config_label': label,
+        'max_sustained_rate': best,
+        'steps': len(steps),
+    })
+    with open(f"saturation_{run_label}.json", 'w') as file:
+        json.dump(result, file, indent=2)
+    with open(f"saturation_{run_label}.csv", mode='w', newline='') as csvfile:
+        writer = csv.DictWriter(csvfile, fieldnames=STEP_FIELDS)
+        writer.writeheader()
+        writer.writerows(steps)
+    if best is None:
+        print(f"Even {start_rate} msg/s exceeds the {slo_p99_ms} ms p99 SLO")
+    else:
+        print(f"Max sustained rate for {label}: {best:.0f} msg/s within a {slo_p99_ms} ms p99 SLO")
+    return result
+
 def write_summary_csv(results, filename="evaluation_summary.csv"):
-    fieldnames = ["config_label", "delivered_messages", "avg_latency_ms", "match_rate_percent", "timestamp"]
+    fieldnames = ["config_label", "delivered_messages", "avg_latency_ms", "p50_latency_ms",
+                  "p99_latency_ms", "p999_latency_ms", "match_rate_percent",
+                  "target_rate", "achieved_rate", "timestamp"]
     with open(filename, mode='w', newline='') as csvfile:
         writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
         writer.writeheader()
@@ -141,24 +457,105 @@ def write_summary_csv(results, filename="evaluation_summary.csv"):
                 "config_label": res["config"],
                 "delivered_messages": res["delivered"],
                 "avg_latency_ms": f"{res['avg_latency_ms']:.2f}",
+                "p50_latency_ms": f"{res['p50_latency_ms']:.2f}",
+                "p99_latency_ms": f"{res['p99_latency_ms']:.2f}",
+                "p999_latency_ms": f"{res['p999_latency_ms']:.2f}",
                 "match_rate_percent": f"{res['match_rate_percent']:.2f}",
+                "target_rate": res["target_rate"] or "",
+                "achieved_rate": f"{res['achieved_rate']:.2f}",
                 "timestamp": timestamp
             })
     print(f"Summary results saved to {filename}")
 
 def main():
+    parser = argparse.ArgumentParser(description="Evaluate the pub/sub broker network")
+    parser.add_argument("--record", help="directory to record each run's publication stream into")
+    parser.add_argument("--replay", help="directory of recorded streams to replay instead of generating")
+    parser.add_argument("--replay-mode", choices=REPLAY_MODES, default="original")
+    parser.add_argument("--replay-rate", type=float, help="publications per second for --replay-mode rate")
+    parser.add_argument("--rate", type=float, help="offered load in publications per second (open loop)")
+    parser.add_argument("--arrival", choices=ARRIVAL_MODES, default="constant")
+    parser.add_argument("--publish-batch", type=int, default=1,
+                        help="publications pushed to the brokers per batch")
+    parser.add_argument("--verbose-log", action="store_true",
+                        help="also log per-publication and per-delivery events")
+    parser.add_argument("--metrics-interval", type=float,
+                        help="seconds between metrics snapshots appended to metrics_<label>.csv")
+    parser.add_argument("--profile-every", type=int, default=0,
+                        help="profile subscription costs on every Nth publication (0 disables)")
+    parser.add_argument("--profile-top", type=int, default=20,
+                        help="number of most expensive subscriptions kept in each broker report")
+    parser.add_argument("--snapshot-dir",
+                        help="warm-start brokers from subscription snapshots here (saved on the first run)")
+    parser.add_argument("--rebalance-interval", type=float,
+                        help="seconds between load-aware subscription rebalancing rounds")
+    parser.add_argument("--match-cache-size", type=int, default=0,
+                        help="entries in each broker's match-result cache (0, the default, disables it)")
+    parser.add_argument("--batch-size", type=int, default=1,
+                        help="publications each broker processes together (1 disables micro-batching)")
+    parser.add_argument("--batch-deadline-us", type=float, default=0,
+                        help="microseconds a broker waits for a batch to fill")
+    parser.add_argument("--match-shards", type=int, default=1,
+                        help="worker processes each broker splits its matching over (1 matches in-process)")
+    parser.add_argument("--runtime", choices=RUNTIMES, default="threads",
+                        help="run brokers, subscribers and publisher as threads or as asyncio tasks")
+    parser.add_argument("--saturation", action="store_true",
+                        help="search the maximum sustainable publication rate instead of a fixed run")
+    parser.add_argument("--search", choices=SEARCH_MODES, default="ramp")
+    parser.add_argument("--slo-p99-ms", type=float, default=50.0, help="p99 delivery latency SLO")
+    parser.add_argument("--start-rate", type=float, default=100.0)
+    parser.add_argument("--max-rate", type=float, default=10000.0)
+    parser.add_argument("--step-rate", type=float, help="ramp increment / binary search resolution")
+    parser.add_argument("--step-duration", type=float, default=10.0, help="seconds of load per step")
+    parser.add_argument("--max-growth", type=float, default=0.05,
+                        help="tolerated queue growth as a fraction of the offered rate")
+    args = parser.parse_args()
+
     configs = [
         ("generator_config_25.json", "25%"),
         ("generator_config_100.json", "100%"),
     ]
 
+    if args.saturation:
+        for config_path, label in configs:
+            find_saturation(
+                config_path, label, slo_p99_ms=args.slo_p99_ms, search=args.search,
+                start_rate=args.start_rate, max_rate=args.max_rate, step_rate=args.step_rate,
+                step_duration=args.step_duration, max_growth=args.max_growth,
+                arrival=args.arrival, verbose_log=args.verbose_log,
+                batch_size=args.batch_size, batch_deadline_us=args.batch_deadline_us,
+                match_shards=args.match_shards)
+        return
+
     all_results = []
 
     for config_path, label in configs:
-        result = run_experiment(config_path, label)
+        run_dir = label.replace('%', '')
+        result = run_experiment(
+            config_path, label,
+            record_dir=os.path.join(args.record, run_dir) if args.record else None,
+            replay_dir=os.path.join(args.replay, run_dir) if args.replay else None,
+            replay_mode=args.replay_mode,
+            replay_rate=args.replay_rate,
+            rate=args.rate,
+            arrival=args.arrival,
+            publish_batch=args.publish_batch,
+            verbose_log=args.verbose_log,
+            metrics_interval=args.metrics_interval,
+            profile_every=args.profile_every,
+            profile_top=args.profile_top,
+            snapshot_dir=os.path.join(args.snapshot_dir, run_dir) if args.snapshot_dir else None,
+            rebalance_interval=args.rebalance_interval,
+            match_cache_size=args.match_cache_size,
+            batch_size=args.batch_size,
+            batch_deadline_us=args.batch_deadline_us,
+            runtime=args.runtime,
+            match_shards=args.match_shards)
         print(f"\n=== Results for config {label} ===")
         print(f"Delivered messages: {result['delivered']}")
         print(f"Average latency (ms): {result['avg_latency_ms']:.2f}")
+        print(f"Latency p50/p99/p999 (ms): {result['p50_latency_ms']:.2f} / "
+              f"{result['p99_latency_ms']:.2f} / {result['p999_latency_ms']:.2f}")
         print(f"Match rate (%): {result['match_rate_percent']:.2f}")
         all_results.append(result)
 
@@ -0,0 +1,106 @@
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import argparse
+import gc
+import json
+import logging
+import math
+import random
+import tracemalloc
+
+from core.broker import Broker
+from core.generator_configs import Configs
+from core.generator_pub_sub import GeneratorPubSub
+from core.metrics import MetricsRegistry
+from core.subscription import Subscription
+
+SEED = 1234
+ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+DEFAULT_CONFIG = os.path.join(ROOT_DIR, 'generator_configs.json')
+
+
+class _Subscriber:
+    """Stand-in subscriber: only its identity is needed to build subscriptions"""
+
+    def __init__(self, subscriber_id):
+        self.subscriber_id = subscriber_id
+        self.subscriptions = {}
+
+    def receive_message(self, message):
+        pass
+
+
+def _traced_bytes() -> int:
+    gc.collect()
+    return tracemalloc.get_traced_memory()[0]
+
+
+def memory_report(config_path=DEFAULT_CONFIG, nr_subs=100000, window_share=0.1, duplicates=1, subscribers=3):
+    """Measure the bytes held per subscription by the objects alone and once indexed by a broker
+
+    Every distinct generated condition set is repeated duplicates times; window_share of
+    the subscriptions are window subscriptions.
+    """
+    random.seed(SEED)
+    configs = Configs(config_path=config_path)
+    generator = GeneratorPubSub(configs)
+    result = [None]
+    generator.generate_subs(max(1, math.ceil(nr_subs / duplicates)), result, 0, 1, {})
+    generated = result[0]
+    owners = [_Subscriber(f"subscriber_{i}") for i in range(subscribers)]
+    window_every = round(1 / window_share) if window_share else 0
+    logger = logging.getLogger('memory_report')
+    logger.disabled = True
+
+    tracemalloc.start()
+    base = _traced_bytes()
+    subscriptions = []
+    for i in range(nr_subs):
+        conditions = [(field, operator, value) for field, (operator, value) in generated[i // duplicates].items()]
+        window_size = 10 if window_every and i % window_every == 0 else None
+        subscriptions.append(Subscription(conditions, window_size=window_size, subscriber=owners[i % subscribers]))
+    objects = _traced_bytes()
+
+    broker = Broker('broker_memory', logger=logger, metrics=MetricsRegistry(), match_cache_size=0)
+    broker.add_subscriptions(subscriptions)
+    indexed = _traced_bytes()
+    tracemalloc.stop()
+
+    windows = sum(1 for subscription in subscriptions if subscription.window_size is not None)
+    return {
+        'subscriptions': nr_subs,
+        'window_subscriptions': windows,
+        'distinct_conditions': len(generated),
+        'object_bytes_per_subscription': (objects - base) / nr_subs,
+        'broker_bytes_per_subscription': (indexed - objects) / nr_subs,
+        'total_bytes_per_subscription': (indexed - base) / nr_subs,
+        'total_mb': (indexed - base) / 2 ** 20,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Report the memory held per subscription")
+    parser.add_argument('--config', default=DEFAULT_CONFIG, help="generator config used to build the subscriptions")
+    parser.add_argument('--subs', type=int, default=100000, help="number of subscriptions")
+    parser.add_argument('--window-share', type=float, default=0.1, help="fraction of window subscriptions")
+    parser.add_argument('--duplicates', type=int, default=1,
+                        help="how many subscriptions share each generated condition set")
+    parser.add_argument('--output', help="write the report to this JSON file")
+    args = parser.parse_args()
+
+    print(f"Building {args.subs} subscriptions...")
+    report = memory_report(args.config, args.subs, args.window_share, args.duplicates)
+    print(f"  subscription objects: {report['object_bytes_per_subscription']:,.0f} bytes/subscription")
+    print(f"  broker table + index: {report['broker_bytes_per_subscription']:,.0f} bytes/subscription")
+    print(f"  total:                {report['total_bytes_per_subscription']:,.0f} bytes/subscription "
+          f"({report['total_mb']:,.1f} MB)")
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(report, file, indent=2)
+        print(f"Report written to {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
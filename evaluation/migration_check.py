@@ -0,0 +1,272 @@
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import argparse
+import asyncio
+import json
+import logging
+import random
+import threading
+import time
+
+from core.broker_network import BrokerNetwork
+from core.generator_configs import Configs
+from core.generator_pub_sub import GeneratorPubSub
+from core.metrics import MetricsRegistry
+from core.proto import publication_pb2 as pb
+from core.rebalancer import Rebalancer
+from core.records import Schema, WIRE_FIELDS
+from core.subscription import Subscription
+
+SEED = 1234
+ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+DEFAULT_CONFIG = os.path.join(ROOT_DIR, 'generator_configs.json')
+RUNTIMES = ('threads', 'asyncio')
+# Publications sent back to back between the publisher's pauses
+BURST = 50
+# GIL switch interval during the check: threads interleave far more often than with the
+# default 5 ms, so ordering races between publishers and migrations actually show up
+SWITCH_INTERVAL = 0.0001
+
+
+class _RecordingSubscriber:
+    """Stand-in subscriber that records the sequence number of every publication it receives"""
+
+    def __init__(self, subscriber_id):
+        self.subscriber_id = subscriber_id
+        self.received = []
+
+    def receive_message(self, message):
+        self.received.append(message['sent_at_ns'])
+
+
+def _build_publications(configs, nr_pubs):
+    """Generate nr_pubs serialized publications; sent_at_ns carries their sequence number (from 1)"""
+    generator = GeneratorPubSub(configs)
+    publications = []
+    while len(publications) < nr_pubs:
+        data = generator.generate_pub()
+        if not data:
+            continue
+        publications.append(pb.Publication(
+            station_id=data['station_id'],
+            city=data['city'],
+            direction=data['direction'],
+            temperature=data['temperature'],
+            rain=data['rain'],
+            wind=data['wind'],
+            created_at=data['created_at'],
+            sent_at_ns=len(publications) + 1,
+        ).SerializeToString())
+    return publications
+
+
+def _expected_deliveries(subscriptions, publications):
+    """Sequence numbers each subscription should receive, matched on the decoded wire values"""
+    decoded = []
+    for payload in publications:
+        message = pb.Publication.FromString(payload)
+        decoded.append({field: getattr(message, field) for field in WIRE_FIELDS})
+    return {
+        subscription.id: [values['sent_at_ns'] for values in decoded if subscription.matches(values)]
+        for subscription in subscriptions
+    }
+
+
+class _Changes:
+    """Cycle of pool changes applied while publishing: grow, rebalance, shrink, rebalance"""
+
+    def __init__(self, network: BrokerNetwork):
+        self.network = network
+        # imbalance=1 moves load on every call unless the brokers are exactly even
+        self.rebalancer = Rebalancer(network, imbalance=1.0)
+        self.applied = {'add_broker': 0, 'remove_broker': 0, 'rebalance': 0}
+        self.moved_subscriptions = 0
+
+    def step(self, index: int):
+        """Apply one change and block until the subscriptions it moves are installed"""
+        change = index % 4
+        if change == 0:
+            self.network.add_broker()
+            self.applied['add_broker'] += 1
+        elif change == 2:
+            # The oldest broker, so the original ones get drained too
+            self.network.remove_broker(self.network.brokers[0].broker_id)
+            self.applied['remove_broker'] += 1
+        else:
+            with self.network.membership_lock:
+                marker = self.rebalancer.rebalance_once()
+            if marker is not None:
+                marker.wait()
+                self.applied['rebalance'] += 1
+                self.moved_subscriptions += len(marker.subscriptions)
+
+
+def _publish_delay(started: float, published: int, rate: float) -> float:
+    """Seconds to wait so that publishing keeps to rate publications per second"""
+    return started + published / rate - time.perf_counter()
+
+
+def _run_threads(network: BrokerNetwork, publications, changes: _Changes, nr_changes: int, interval: float,
+                 rate: float):
+    network.start()
+
+    def publish():
+        started = time.perf_counter()
+        for i, payload in enumerate(publications, 1):
+            network.publish(payload)
+            if i % BURST == 0:
+                time.sleep(max(0.0, _publish_delay(started, i, rate)))
+
+    publisher = threading.Thread(target=publish)
+    publisher.start()
+    for index in range(nr_changes):
+        time.sleep(interval)
+        changes.step(index)
+    publisher.join()
+    network.wait_until_drained()
+    network.stop()
+
+
+async def _run_asyncio(network: BrokerNetwork, publications, changes: _Changes, nr_changes: int, interval: float,
+                       rate: float):
+    network.start_async()
+
+    async def publish():
+        started = time.perf_counter()
+        for i, payload in enumerate(publications, 1):
+            network.publish(payload)
+            if i % BURST == 0:
+                await asyncio.sleep(max(0.0, _publish_delay(started, i, rate)))
+
+    publisher = asyncio.create_task(publish())
+    for index in range(nr_changes):
+        await asyncio.sleep(interval)
+        # Pool changes block until migrations finish, which needs the loop
+        await asyncio.to_thread(changes.step, index)
+    await publisher
+    # Let enqueues still waiting on the loop reach the queues before checking them
+    await asyncio.sleep(0)
+    while network.queue_depth():
+        await asyncio.sleep(0.01)
+    await network.stop_async()
+
+
+def migration_check(config_path=DEFAULT_CONFIG, nr_subscribers=1000, nr_pubs=3000, rate=1000.0,
+                    runtime='threads', num_brokers=3, nr_changes=16, interval=0.1, batch_size=1,
+                    batch_deadline_us=0, match_shards=1, switch_interval=SWITCH_INTERVAL):
+    """Publish at rate publications/s while brokers join, leave and rebalance, then compare deliveries
+
+    Every subscriber holds one simple subscription; it must receive exactly the
+    publications its conditions match, each once and in publication order.
+    """
+    random.seed(SEED)
+    configs = Configs(config_path=config_path)
+    generator = GeneratorPubSub(configs)
+    result = [None]
+    generator.generate_subs(nr_subscribers, result, 0, 1, {})
+    subscribers = [_RecordingSubscriber(f"subscriber_{i}") for i in range(nr_subscribers)]
+    subscriptions = [
+        Subscription([(field, operator, value) for field, (operator, value) in conditions.items()],
+                     subscriber=subscriber)
+        for subscriber, conditions in zip(subscribers, result[0])
+    ]
+    publications = _build_publications(configs, nr_pubs)
+    expected = _expected_deliveries(subscriptions, publications)
+
+    logger = logging.getLogger('migration_check')
+    logger.disabled = True
+    network = BrokerNetwork(num_brokers, logger=logger, metrics=MetricsRegistry(),
+                            schema=Schema.from_configs(configs), batch_size=batch_size,
+                            batch_deadline_us=batch_deadline_us, match_shards=match_shards)
+    network.add_subscriptions(subscriptions)
+    changes = _Changes(network)
+    default_switch_interval = sys.getswitchinterval()
+    sys.setswitchinterval(switch_interval)
+    started = time.time()
+    try:
+        if runtime == 'asyncio':
+            asyncio.run(_run_asyncio(network, publications, changes, nr_changes, interval, rate))
+        else:
+            _run_threads(network, publications, changes, nr_changes, interval, rate)
+    finally:
+        sys.setswitchinterval(default_switch_interval)
+    elapsed = time.time() - started
+
+    missing = duplicated = reordered = 0
+    mismatched = []
+    for subscription in subscriptions:
+        received = subscription.subscriber.received
+        wanted = expected[subscription.id]
+        if received == wanted:
+            continue
+        mismatched.append(subscription.subscriber.subscriber_id)
+        missing += len(set(wanted) - set(received))
+        duplicated += len(received) - len(set(received))
+        if sorted(set(received)) != list(dict.fromkeys(received)):
+            reordered += 1
+    return {
+        'runtime': runtime,
+        'subscribers': nr_subscribers,
+        'publications': nr_pubs,
+        'expected_deliveries': sum(len(wanted) for wanted in expected.values()),
+        'deliveries': sum(len(subscriber.received) for subscriber in subscribers),
+        'changes': changes.applied,
+        'rebalanced_subscriptions': changes.moved_subscriptions,
+        'final_brokers': [broker.broker_id for broker in network.brokers],
+        'mismatched_subscribers': len(mismatched),
+        'missing': missing,
+        'duplicated': duplicated,
+        'reordered_subscribers': reordered,
+        'first_mismatched': mismatched[:10],
+        'seconds': elapsed,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Check that migrations lose, duplicate or reorder no notification")
+    parser.add_argument('--config', default=DEFAULT_CONFIG, help="generator config used to build the workload")
+    parser.add_argument('--subscribers', type=int, default=1000, help="number of subscribers, one subscription each")
+    parser.add_argument('--pubs', type=int, default=3000, help="number of publications")
+    parser.add_argument('--rate', type=float, default=1000, help="publications per second")
+    parser.add_argument('--runtime', choices=RUNTIMES, nargs='+', default=list(RUNTIMES),
+                        help="runtimes to check (default: both)")
+    parser.add_argument('--brokers', type=int, default=3, help="initial number of brokers")
+    parser.add_argument('--changes', type=int, default=16,
+                        help="pool changes to apply, cycling add_broker, rebalance, remove_broker, rebalance")
+    parser.add_argument('--interval', type=float, default=0.1, help="seconds between changes")
+    parser.add_argument('--batch-size', type=int, default=1, help="broker micro-batch size")
+    parser.add_argument('--batch-deadline-us', type=float, default=0, help="micro-batch deadline in microseconds")
+    parser.add_argument('--match-shards', type=int, default=1, help="shard worker processes per broker")
+    parser.add_argument('--switch-interval', type=float, default=SWITCH_INTERVAL,
+                        help="GIL switch interval in seconds while checking (shorter interleaves threads more)")
+    parser.add_argument('--output', help="write the reports to this JSON file")
+    args = parser.parse_args()
+
+    reports = []
+    for runtime in args.runtime:
+        print(f"Checking migrations ({runtime}): {args.subscribers} subscribers, {args.pubs} publications...")
+        report = migration_check(args.config, args.subscribers, args.pubs, args.rate, runtime, args.brokers,
+                                 args.changes, args.interval, args.batch_size, args.batch_deadline_us,
+                                 args.match_shards, args.switch_interval)
+        reports.append(report)
+        changes = ', '.join(f"{count} {change}" for change, count in report['changes'].items())
+        print(f"  changes: {changes} ({report['rebalanced_subscriptions']} subscriptions rebalanced)")
+        print(f"  deliveries: {report['deliveries']} of {report['expected_deliveries']} expected "
+              f"in {report['seconds']:.1f} s")
+        if report['mismatched_subscribers']:
+            print(f"  FAILED: {report['mismatched_subscribers']} subscribers differ "
+                  f"({report['missing']} missing, {report['duplicated']} duplicated, "
+                  f"{report['reordered_subscribers']} out of order), e.g. {report['first_mismatched']}")
+        else:
+            print("  OK: every subscriber received exactly its matches, in order")
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(reports, file, indent=2)
+        print(f"Reports written to {args.output}")
+    return 1 if any(report['mismatched_subscribers'] for report in reports) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,254 @@
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import argparse
+import csv
+import itertools
+import json
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
+from typing import Any, Dict, List
+
+ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+DEFAULT_CONFIG = os.path.join(ROOT_DIR, 'generator_configs.json')
+
+# Swept parameter -> run_experiment keyword
+SWEEP_PARAMETERS = {
+    'num_brokers': 'num_brokers',
+    'nr_subs': 'nr_subs',
+    'equality_ratio': 'equality_ratio',
+    'window_share': 'window_share',
+    'rate': 'rate',
+}
+RESULT_FIELDS = ['run_id', 'status', 'duration', 'num_brokers', 'nr_subs', 'equality_ratio',
+                 'window_share', 'rate', 'delivered', 'throughput', 'achieved_rate',
+                 'avg_latency_ms', 'p50_latency_ms', 'p99_latency_ms', 'p999_latency_ms',
+                 'match_rate_percent', 'error']
+# Metrics charted against every swept parameter in the report
+REPORT_METRICS = [
+    ('throughput', 'Throughput (pub/s)'),
+    ('p99_latency_ms', 'Latență p99 (ms)'),
+    ('avg_latency_ms', 'Latență medie (ms)'),
+    ('match_rate_percent', 'Rata de potrivire (%)'),
+]
+
+
+def build_grid(values: Dict[str, List[Any]]) -> List[Dict[str, Any]]:
+    """Cartesian product of the swept values, one dict of parameters per run"""
+    names = list(values)
+    return [dict(zip(names, combination)) for combination in itertools.product(*(values[name] for name in names))]
+
+
+def run_point(run_id: str, params: Dict[str, Any], config_path: str, duration: float,
+              output_dir: str) -> Dict[str, Any]:
+    """Run one sweep point in its own directory (meant to execute in a worker process)"""
+    run_dir = os.path.join(output_dir, run_id)
+    os.makedirs(run_dir, exist_ok=True)
+    # Every artifact of the run (logs, broker stats, subscriber messages) lands in its directory
+    os.chdir(run_dir)
+    row = {'run_id': run_id, 'duration': duration, **params}
+    try:
+        from evaluation.evaluator import run_experiment
+        result = run_experiment(
+            config_path, run_id, duration=duration, settle_time=0,
+            **{SWEEP_PARAMETERS[name]: value for name, value in params.items()})
+        row.update({field: result[field] for field in RESULT_FIELDS if field in result})
+        row['status'] = 'ok'
+    except Exception as e:
+        row['status'] = 'failed'
+        row['error'] = f"{e}\n{traceback.format_exc()}"
+    with open('result.json', 'w') as file:
+        json.dump(row, file, indent=2, default=str)
+    return row
+
+
+def run_sweep(grid: List[Dict[str, Any]], config_path: str, duration: float, output_dir: str,
+              workers: int = 1) -> List[Dict[str, Any]]:
+    """Run every point of the grid, each in a fresh process, and return the rows in grid order"""
+    os.makedirs(output_dir, exist_ok=True)
+    config_path = os.path.abspath(config_path)
+    output_dir = os.path.abspath(output_dir)
+    rows = {}
+    # One task per child process keeps global state (logging, metrics registry) per run
+    with ProcessPoolExecutor(max_workers=workers, max_tasks_per_child=1) as executor:
+        futures = {
+            executor.submit(run_point, f"run_{index:03d}", params, config_path, duration, output_dir): index
+            for index, params in enumerate(grid)
+        }
+        for future in as_completed(futures):
+            index = futures[future]
+            rows[index] = future.result()
+            print(f"[{len(rows)}/{len(grid)}] run_{index:03d} {grid[index]}: {rows[index]['status']}")
+    return [rows[index] for index in range(len(grid))]
+
+
+def write_results(rows: List[Dict[str, Any]], output_dir: str, swept: Dict[str, List[Any]]):
+    """Write the consolidated dataset as sweep_results.csv and sweep_results.json"""
+    with open(os.path.join(output_dir, 'sweep_results.csv'), 'w', newline='') as csvfile:
+        writer = csv.DictWriter(csvfile, fieldnames=RESULT_FIELDS, extrasaction='ignore')
+        writer.writeheader()
+        writer.writerows(rows)
+    with open(os.path.join(output_dir, 'sweep_results.json'), 'w') as file:
+        json.dump({
+            'created_at': datetime.now().isoformat(),
+            'parameters': swept,
+            'runs': rows,
+        }, file, indent=2, default=str)
+
+
+def _marginal(rows: List[Dict[str, Any]], parameter: str, metric: str, values: List[Any]) -> List[float]:
+    """Mean of a metric over the successful runs at each value of one parameter"""
+    means = []
+    for value in values:
+        samples = [row[metric] for row in rows
+                   if row.get('status') == 'ok' and row.get(parameter) == value and row.get(metric) is not None]
+        means.append(round(sum(samples) / len(samples), 3) if samples else None)
+    return means
+
+
+REPORT_TEMPLATE = """<!DOCTYPE html>
+<html lang="ro">
+<head>
+    <meta charset="UTF-8">
+    <meta name="viewport" content="width=device-width, initial-scale=1.0">
+    <title>Raport sweep - Pub/Sub</title>
+    <script src="https://cdnjs.cloudflare.com/ajax/libs/Chart.js/3.9.1/chart.min.js"></script>
+    <style>
+        body {{ font-family: 'Arial', sans-serif; line-height: 1.6; color: #333; background: #f8f9fa; margin: 0; }}
+        .container {{ max-width: 1200px; margin: 20px auto; padding: 30px; background: white;
+                      border-radius: 8px; box-shadow: 0 2px 8px rgba(0, 0, 0, 0.1); }}
+        h1 {{ font-size: 2.2em; color: #212529; font-weight: 300; text-align: center; }}
+        h2 {{ color: #212529; font-size: 1.6em; font-weight: 400; border-bottom: 1px solid #dee2e6;
+              padding-bottom: 10px; margin-top: 30px; }}
+        .date {{ text-align: center; color: #868e96; }}
+        .chart-container {{ position: relative; height: 300px; margin: 20px 0; }}
+        .results-table {{ width: 100%; border-collapse: collapse; margin: 20px 0; font-size: 0.9em; }}
+        .results-table th, .results-table td {{ padding: 8px; border: 1px solid #dee2e6; text-align: center; }}
+        .results-table th {{ background: #f8f9fa; font-weight: 600; }}
+    </style>
+</head>
+<body>
+<div class="container">
+    <h1>Raport sweep de parametri</h1>
+    <p class="date">{created_at} &middot; {runs} rulări</p>
+{sections}
+    <h2>Toate rulările</h2>
+    <table class="results-table">
+        <tr>{header}</tr>
+{table_rows}
+    </table>
+</div>
+<script>
+    Chart.defaults.font.family = 'Arial';
+    Chart.defaults.font.size = 12;
+    Chart.defaults.color = '#495057';
+{charts}
+</script>
+</body>
+</html>
+"""
+
+CHART_TEMPLATE = """    new Chart(document.getElementById('{chart_id}').getContext('2d'), {{
+        type: 'line',
+        data: {{
+            labels: {labels},
+            datasets: [{{
+                label: '{label}',
+                data: {data},
+                backgroundColor: '#6c757d',
+                borderColor: '#495057',
+                borderWidth: 2,
+                spanGaps: true
+            }}]
+        }},
+        options: {{
+            responsive: true,
+            maintainAspectRatio: false,
+            plugins: {{ legend: {{ display: false }} }},
+            scales: {{
+                x: {{ title: {{ display: true, text: '{parameter}' }}, grid: {{ color: '#e9ecef' }} }},
+                y: {{ beginAtZero: true, title: {{ display: true, text: '{label}' }}, grid: {{ color: '#e9ecef' }} }}
+            }},
+            animation: false
+        }}
+    }});
+"""
+
+
+def write_report(rows: List[Dict[str, Any]], swept: Dict[str, List[Any]], path: str):
+    """Render docs/pubsub_performance_report.html-style charts of every metric against every swept parameter"""
+    sections, charts = [], []
+    for parameter, values in swept.items():
+        if len(values) < 2:
+            continue
+        sections.append(f"    <h2>Efectul parametrului {parameter}</h2>")
+        for metric, label in REPORT_METRICS:
+            chart_id = f"{parameter}_{metric}"
+            sections.append(f"    <div class=\"chart-container\"><canvas id=\"{chart_id}\"></canvas></div>")
+            charts.append(CHART_TEMPLATE.format(
+                chart_id=chart_id, label=label, parameter=parameter,
+                labels=json.dumps([str(value) for value in values]),
+                data=json.dumps(_marginal(rows, parameter, metric, values))))
+
+    header = ''.join(f"<th>{field}</th>" for field in RESULT_FIELDS if field != 'error')
+    table_rows = []
+    for row in rows:
+        cells = []
+        for field in RESULT_FIELDS:
+            if field == 'error':
+                continue
+            value = row.get(field)
+            cells.append(f"<td>{value:.2f}</td>" if isinstance(value, float) else f"<td>{'' if value is None else value}</td>")
+        table_rows.append(f"        <tr>{''.join(cells)}</tr>")
+
+    with open(path, 'w', encoding='utf-8') as file:
+        file.write(REPORT_TEMPLATE.format(
+            created_at=datetime.now().strftime('%Y-%m-%d %H:%M'), runs=len(rows),
+            sections='\n'.join(sections), header=header,
+            table_rows='\n'.join(table_rows), charts=''.join(charts)))
+    print(f"Report written to {path}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sweep the pub/sub evaluation over a grid of parameters")
+    parser.add_argument('--config', default=DEFAULT_CONFIG, help="base generator config of every run")
+    parser.add_argument('--brokers', type=int, nargs='+', default=[3], help="numbers of brokers")
+    parser.add_argument('--subs', type=int, nargs='+', default=[10000], help="subscription counts")
+    parser.add_argument('--equality', type=float, nargs='+',
+                        help="equality operator ratios (default: as in the config)")
+    parser.add_argument('--window-share', type=float, nargs='+', default=[0.0],
+                        help="fractions of subscriptions created as window subscriptions")
+    parser.add_argument('--rate', type=float, nargs='+',
+                        help="offered loads in publications per second (default: publisher bursts)")
+    parser.add_argument('--duration', type=float, default=30, help="seconds of publishing per run")
+    parser.add_argument('--workers', type=int, default=max(1, (os.cpu_count() or 2) // 2),
+                        help="runs executed in parallel; concurrent runs share the CPUs and skew latencies")
+    parser.add_argument('--output-dir', default=os.path.join('sweep_results', datetime.now().strftime('%Y%m%d_%H%M%S')))
+    parser.add_argument('--report-only', metavar='SWEEP_JSON',
+                        help="only regenerate the HTML report from an existing sweep_results.json")
+    args = parser.parse_args()
+
+    if args.report_only:
+        with open(args.report_only) as file:
+            dataset = json.load(file)
+        write_report(dataset['runs'], dataset['parameters'],
+                     os.path.join(os.path.dirname(os.path.abspath(args.report_only)), 'sweep_report.html'))
+        return
+
+    swept = {
+        'num_brokers': args.brokers,
+        'nr_subs': args.subs,
+        'equality_ratio': args.equality or [None],
+        'window_share': args.window_share,
+        'rate': args.rate or [None],
+    }
+    grid = build_grid(swept)
+    print(f"Sweeping {len(grid)} runs of {args.duration}s with {args.workers} worker(s) into {args.output_dir}")
+    rows = run_sweep(grid, args.config, args.duration, args.output_dir, args.workers)
+    write_results(rows, args.output_dir, swept)
+    write_report(rows, swept, os.path.join(args.output_dir, 'sweep_report.html'))
+
+
+if __name__ == "__main__":
+    main()
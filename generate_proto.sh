@@ -1,11 +1,7 @@
 #!/bin/bash
 
-# Create protos directory if it doesn't exist
-mkdir -p protos
-
 # Generate Python code from proto file
 python -m grpc_tools.protoc \
-    --proto_path=./protos \
-    --python_out=./protos \
-    --grpc_python_out=./protos \
-    ./protos/message.proto 
\ No newline at end of file
+    --proto_path=./core/proto \
+    --python_out=./core/proto \
+    ./core/proto/publication.proto
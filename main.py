@@ -3,16 +3,15 @@ import json
 from core.publisher import Publisher
 from core.broker_network import BrokerNetwork
 from core.generator_configs import Configs
+from core.records import Schema
 from core.subscription import Subscription
 from core.subscriber import Subscriber, generate_random_subscription, generate_random_window_subscription
 from core.utils import setup_logging
 import threading
 
 def save_subscriber_messages(subscriber: Subscriber, filename: str):
-    """Save received messages for a subscriber to a file"""
-    with open(filename, 'w') as file:
-        for msg in subscriber.received_messages:
-            file.write(json.dumps(msg, indent=2) + '\n')
+    """Save received messages for a subscriber to a file (one JSON object per line)"""
+    subscriber.flush_messages(filename)
 
 
 def print_conditions(field_name: str, condition_func):
@@ -68,16 +67,18 @@ def main():
     print(f"Configurations loaded: {configs.__dict__}")
 
     # Create broker network
-    broker_network = BrokerNetwork(num_brokers=3, window_size=10, logger=logger)
+    broker_network = BrokerNetwork(num_brokers=3, window_size=10, logger=logger,
+                                   schema=Schema.from_configs(configs))
     broker_network.start()
 
-    # Create publisher with configurations
-    publisher = Publisher(configs)
+    # Create publisher with configurations, publishing straight into the broker network
+    publisher = Publisher(configs, sink=broker_network)
     publisher.start()
 
     # Create 3 subscribers
     subscribers = [
-        Subscriber(f"subscriber_{i}", logger,configs) for i in range(3)
+        Subscriber(f"subscriber_{i}", logger, configs, spill_path=f"subscriber_{i}_main_messages.ndjson")
+        for i in range(3)
     ]
 
     for subscriber in subscribers:
@@ -98,18 +99,11 @@ def main():
     event.wait()  # Wait until the event is set
 
     try:
-        # Generate and publish messages for 30 seconds
-        start_time = time.time()
-        while time.time() - start_time < 60:
-            if not publisher.publication_queue.empty():
-                publication = publisher.get_publication()
-                broker_network.publish(publication)
-            time.sleep(0.01)
+        # Let the publisher threads feed the brokers for 60 seconds
+        time.sleep(60)
 
     finally:
-        # Print received messages for each subscriber
-        for subscriber in subscribers:
-            save_subscriber_messages(subscriber, f"{subscriber.subscriber_id}_main_messages.json")
+        publisher.stop()
 
         # In finally block:
         for subscriber in subscribers:
@@ -117,7 +111,10 @@ def main():
 
         # Stop the broker network
         broker_network.stop()
-        publisher.stop()
+
+        # Save received messages once nothing can be delivered anymore
+        for subscriber in subscribers:
+            save_subscriber_messages(subscriber, f"{subscriber.subscriber_id}_main_messages.ndjson")
 
 if __name__ == "__main__":
     main()